@@ -0,0 +1,715 @@
+"""
+Módulo de almacenamiento histórico del RCV (SQLite)
+
+Cada extracción se inserta/actualiza (upsert) en tablas indexadas por
+RUT del contribuyente, período, tipo de documento y folio, de modo que
+se pueden consultar y comparar varios períodos sin volver a extraerlos.
+
+Cada extracción se compara además con el estado anterior del período por
+clave (tipo, RUT emisor, folio) y hash del registro; las inserciones,
+actualizaciones y eliminaciones quedan en la tabla cambios con una versión
+creciente para sincronización incremental (GET /cambios).
+
+Al final de cada extracción se guardan los totales del período por tipo de
+documento, proveedor y día (tabla agregados, reemplazando solo los tipos
+extraídos) y un resumen ya compuesto en JSON (tabla resumen_agregado) que
+GET /resumen entrega con una sola lectura por clave primaria.
+"""
+import csv
+import io
+import json
+import logging
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from config import ARCHIVO_DB, VIGENCIA_EXTRACCION_MINUTOS, TIPOS_NOTA_CREDITO, LOTE_REGISTROS
+from contribuyentes import normalizar_rut
+from periodos import formatear_periodo
+
+logger = logging.getLogger("almacen")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS registros (
+    rut_contribuyente TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    tipo_documento TEXT NOT NULL,
+    rut_emisor TEXT NOT NULL DEFAULT '',
+    folio TEXT NOT NULL,
+    fecha_documento TEXT,
+    monto_neto INTEGER,
+    monto_iva INTEGER,
+    monto_total INTEGER,
+    datos TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    fecha_extraccion TEXT NOT NULL,
+    PRIMARY KEY (rut_contribuyente, periodo, tipo_documento, rut_emisor, folio)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_registros_periodo ON registros (periodo, rut_contribuyente);
+CREATE INDEX IF NOT EXISTS idx_registros_emisor ON registros (rut_emisor, periodo);
+
+CREATE TABLE IF NOT EXISTS extracciones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rut_contribuyente TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    fecha_extraccion TEXT NOT NULL,
+    tipos_documento TEXT,
+    total_registros INTEGER NOT NULL,
+    completa INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_extracciones_periodo ON extracciones (rut_contribuyente, periodo, fecha_extraccion);
+
+CREATE TABLE IF NOT EXISTS resumenes (
+    rut_contribuyente TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    tipo_documento TEXT NOT NULL,
+    documentos INTEGER,
+    montos TEXT NOT NULL,
+    conciliado INTEGER NOT NULL,
+    fecha_extraccion TEXT NOT NULL,
+    PRIMARY KEY (rut_contribuyente, periodo, tipo_documento)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cambios (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    rut_contribuyente TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    tipo_documento TEXT NOT NULL,
+    rut_emisor TEXT NOT NULL,
+    folio TEXT NOT NULL,
+    operacion TEXT NOT NULL,
+    hash TEXT,
+    datos TEXT,
+    fecha_extraccion TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_cambios_periodo ON cambios (rut_contribuyente, periodo, version);
+
+CREATE TABLE IF NOT EXISTS agregados (
+    rut_contribuyente TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    tipo_documento TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    documentos INTEGER NOT NULL,
+    monto_neto INTEGER,
+    monto_iva INTEGER,
+    monto_total INTEGER,
+    PRIMARY KEY (rut_contribuyente, periodo, tipo_documento, dimension, clave)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS resumen_agregado (
+    rut_contribuyente TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    contenido TEXT NOT NULL,
+    fecha_actualizacion TEXT NOT NULL,
+    PRIMARY KEY (rut_contribuyente, periodo)
+) WITHOUT ROWID;
+"""
+
+_esquema_creado = set()
+
+
+def _a_entero(valor):
+    """
+    Convierte un monto en formato chileno ("1.234.567") a entero, o None
+    """
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, int):
+        return valor
+    try:
+        return int(str(valor).strip().replace(".", ""))
+    except ValueError:
+        return None
+
+
+def _buscar_columna(registro, *fragmentos):
+    for columna in registro:
+        nombre = columna.upper()
+        if all(f in nombre for f in fragmentos):
+            return columna
+    return None
+
+
+def _fila_registro(rut_contribuyente, periodo, registro, fecha_extraccion):
+    """
+    Convierte un registro extraído en una fila de la tabla registros
+    """
+    datos = json.dumps(registro, ensure_ascii=False, sort_keys=True)
+    hash_registro = hashlib.blake2b(datos.encode("utf-8"), digest_size=16).hexdigest()
+
+    columna_rut = _buscar_columna(registro, "RUT")
+    columna_fecha = _buscar_columna(registro, "FECHA DOC")
+    columna_neto = _buscar_columna(registro, "MONTO", "NETO")
+    columna_iva = _buscar_columna(registro, "IVA")
+    columna_total = _buscar_columna(registro, "MONTO", "TOTAL")
+
+    folio = str(registro.get("Folio") or "").strip()
+    if not folio:
+        # Registros sin folio: se identifican por su contenido
+        folio = f"sin_folio:{hash_registro}"
+
+    return (
+        rut_contribuyente,
+        periodo,
+        str(registro.get("Tipo Documento", "")),
+        normalizar_rut(registro.get(columna_rut)) if columna_rut else "",
+        folio,
+        registro.get(columna_fecha) if columna_fecha else None,
+        _a_entero(registro.get(columna_neto)) if columna_neto else None,
+        _a_entero(registro.get(columna_iva)) if columna_iva else None,
+        _a_entero(registro.get(columna_total)) if columna_total else None,
+        datos,
+        hash_registro,
+        fecha_extraccion,
+    )
+
+
+def _migrar(conexion):
+    """
+    Agrega a una base existente las columnas que el esquema incorporó después de crearla
+    """
+    columnas = {fila["name"] for fila in conexion.execute("PRAGMA table_info(extracciones)")}
+    if "completa" not in columnas:
+        # Las extracciones anteriores no registraron si cubrían el período: se asumen parciales
+        conexion.execute("ALTER TABLE extracciones ADD COLUMN completa INTEGER NOT NULL DEFAULT 0")
+        conexion.commit()
+
+
+@contextmanager
+def conectar(ruta=None):
+    """
+    Abre una conexión a la base histórica creando el esquema si no existe
+
+    Args:
+        ruta: Ruta del archivo SQLite (por defecto ARCHIVO_DB)
+    """
+    ruta = ruta or ARCHIVO_DB
+    conexion = sqlite3.connect(ruta, timeout=30)
+    try:
+        conexion.row_factory = sqlite3.Row
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        if ruta not in _esquema_creado:
+            conexion.executescript(_ESQUEMA)
+            _migrar(conexion)
+            _esquema_creado.add(ruta)
+        yield conexion
+    finally:
+        conexion.close()
+
+
+def guardar_extraccion(rut_contribuyente, mes, anio, registros, tipos_documento=None, fecha_extraccion=None,
+                       tipos_reemplazados=None, completa=False, ruta=None):
+    """
+    Inserta o actualiza (upsert) los registros de una extracción en una única transacción.
+    Las filas se arman, comparan y escriben de a LOTE_REGISTROS para no duplicar el período en memoria
+
+    Args:
+        rut_contribuyente: RUT de la empresa consultada
+        mes: Mes del período (1-12)
+        anio: Año del período
+        registros: Lista de diccionarios con los registros ya deduplicados
+        tipos_documento: Tipos de documento procesados en la extracción
+        fecha_extraccion: Fecha de la extracción (por defecto ahora)
+        tipos_reemplazados: Tipos cuyo detalle se extrajo completo; sus registros
+            almacenados que no vienen en esta extracción se eliminan
+        completa: La extracción cubrió (y concilió) todos los tipos con documentos del resumen
+        ruta: Ruta del archivo SQLite
+
+    Returns:
+        int: Cantidad de registros escritos
+    """
+    periodo = formatear_periodo(mes, anio)
+    rut_contribuyente = normalizar_rut(rut_contribuyente)
+    fecha_extraccion = fecha_extraccion or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    registros = registros or []
+    conteo = {"insertado": 0, "actualizado": 0, "eliminado": 0}
+
+    logger.info("Guardando %d registros del período %s en almacén histórico", len(registros), periodo)
+    with conectar(ruta) as conexion:
+        with conexion:
+            # Hashes almacenados antes del upsert, para el feed de cambios
+            anteriores = _hashes_anteriores(conexion, rut_contribuyente, periodo)
+            nuevas = set()
+            for inicio in range(0, len(registros), LOTE_REGISTROS):
+                filas = [
+                    _fila_registro(rut_contribuyente, periodo, r, fecha_extraccion)
+                    for r in registros[inicio:inicio + LOTE_REGISTROS]
+                ]
+                cambios = _diferencias(rut_contribuyente, periodo, filas, anteriores, nuevas, fecha_extraccion)
+                conexion.executemany(
+                    """
+                    INSERT INTO registros (
+                        rut_contribuyente, periodo, tipo_documento, rut_emisor, folio,
+                        fecha_documento, monto_neto, monto_iva, monto_total,
+                        datos, hash, fecha_extraccion
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (rut_contribuyente, periodo, tipo_documento, rut_emisor, folio)
+                    DO UPDATE SET
+                        fecha_documento = excluded.fecha_documento,
+                        monto_neto = excluded.monto_neto,
+                        monto_iva = excluded.monto_iva,
+                        monto_total = excluded.monto_total,
+                        datos = excluded.datos,
+                        hash = excluded.hash,
+                        fecha_extraccion = excluded.fecha_extraccion
+                    """,
+                    filas
+                )
+                _insertar_cambios(conexion, cambios, conteo)
+
+            # Los registros no actualizados por esta extracción ya no están en el SII
+            for tipo in tipos_reemplazados or []:
+                conexion.execute(
+                    """
+                    DELETE FROM registros
+                    WHERE rut_contribuyente = ? AND periodo = ? AND tipo_documento = ? AND fecha_extraccion <> ?
+                    """,
+                    (rut_contribuyente, periodo, str(tipo), fecha_extraccion)
+                )
+            reemplazados = {str(tipo) for tipo in tipos_reemplazados or []}
+            _insertar_cambios(conexion, [
+                (rut_contribuyente, periodo, *clave, "eliminado", None, None, fecha_extraccion)
+                for clave in anteriores if clave[0] in reemplazados and clave not in nuevas
+            ], conteo)
+            conexion.execute(
+                """
+                INSERT INTO extracciones (
+                    rut_contribuyente, periodo, fecha_extraccion, tipos_documento, total_registros, completa
+                ) VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    rut_contribuyente, periodo, fecha_extraccion, json.dumps(tipos_documento or []), len(registros),
+                    int(completa)
+                )
+            )
+    logger.info(
+        "Almacén histórico actualizado: %d registros (%s); cambios: %d nuevos, %d actualizados, %d eliminados",
+        len(registros), periodo, conteo["insertado"], conteo["actualizado"], conteo["eliminado"]
+    )
+    return len(registros)
+
+
+def _hashes_anteriores(conexion, rut_contribuyente, periodo):
+    """
+    Hash almacenado de cada registro del período: {(tipo, rut_emisor, folio): hash}
+    """
+    return {
+        (fila["tipo_documento"], fila["rut_emisor"], fila["folio"]): fila["hash"]
+        for fila in conexion.execute(
+            "SELECT tipo_documento, rut_emisor, folio, hash FROM registros WHERE rut_contribuyente = ? AND periodo = ?",
+            (rut_contribuyente, periodo)
+        )
+    }
+
+
+def _diferencias(rut_contribuyente, periodo, filas, anteriores, nuevas, fecha_extraccion):
+    """
+    Compara un lote de filas nuevas con los hashes almacenados antes del upsert;
+    agrega sus claves a nuevas (para detectar eliminaciones al final)
+
+    Returns:
+        list: Filas para la tabla cambios (inserciones y actualizaciones)
+    """
+    cambios = []
+    for fila in filas:
+        clave = (fila[2], fila[3], fila[4])
+        nuevas.add(clave)
+        hash_anterior = anteriores.get(clave)
+        if hash_anterior == fila[10]:
+            continue
+        operacion = "insertado" if hash_anterior is None else "actualizado"
+        cambios.append((rut_contribuyente, periodo, *clave, operacion, fila[10], fila[9], fecha_extraccion))
+    return cambios
+
+
+def _insertar_cambios(conexion, cambios, conteo):
+    conexion.executemany(
+        """
+        INSERT INTO cambios (
+            rut_contribuyente, periodo, tipo_documento, rut_emisor, folio,
+            operacion, hash, datos, fecha_extraccion
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        cambios
+    )
+    for cambio in cambios:
+        conteo[cambio[5]] += 1
+
+
+def version_actual(rut_contribuyente=None, periodo=None, ruta=None):
+    """
+    Última versión de cambios registrada (0 si no hay cambios)
+    """
+    where, parametros = _filtros(rut_contribuyente, periodo)
+    with conectar(ruta) as conexion:
+        fila = conexion.execute(f"SELECT MAX(version) AS version FROM cambios {where}", parametros).fetchone()
+    return fila["version"] or 0
+
+
+def obtener_cambios(periodo, rut_contribuyente=None, desde_version=0, limite=1000, ruta=None):
+    """
+    Cambios de un período posteriores a desde_version, consolidados por registro
+    (ej: insertado y luego actualizado se informa como insertado con los datos finales)
+
+    Returns:
+        dict: {"version", "hay_mas", "insertados", "actualizados", "eliminados"}
+    """
+    where, parametros = _filtros(rut_contribuyente, periodo)
+    where = f"{where} AND version > ?" if where else "WHERE version > ?"
+    with conectar(ruta) as conexion:
+        filas = conexion.execute(
+            f"""
+            SELECT version, rut_contribuyente, tipo_documento, rut_emisor, folio, operacion, hash, datos
+            FROM cambios {where} ORDER BY version LIMIT ?
+            """,
+            (*parametros, desde_version, limite + 1)
+        ).fetchall()
+
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    # Sin rut_contribuyente el feed mezcla contribuyentes: el mismo folio de dos empresas son registros distintos
+    por_clave = {}
+    for fila in filas:
+        clave = (fila["rut_contribuyente"], fila["tipo_documento"], fila["rut_emisor"], fila["folio"])
+        primera = por_clave[clave][0] if clave in por_clave else fila["operacion"]
+        por_clave[clave] = (primera, fila)
+
+    resultado = {
+        "version": filas[-1]["version"] if filas else desde_version,
+        "hay_mas": hay_mas,
+        "insertados": [],
+        "actualizados": [],
+        "eliminados": [],
+    }
+    for (rut, tipo, rut_emisor, folio), (primera, fila) in por_clave.items():
+        clave = {"rut_contribuyente": rut, "tipo_documento": tipo, "rut_emisor": rut_emisor, "folio": folio}
+        if fila["operacion"] == "eliminado":
+            # Un registro creado y eliminado dentro del intervalo nunca existió para el consumidor
+            if primera != "insertado":
+                resultado["eliminados"].append(clave)
+            continue
+        cambio = {**clave, "hash": fila["hash"], "version": fila["version"], "datos": json.loads(fila["datos"])}
+        resultado["insertados" if primera == "insertado" else "actualizados"].append(cambio)
+    return resultado
+
+
+def guardar_resumen(rut_contribuyente, mes, anio, conciliacion, fecha_extraccion=None, ruta=None):
+    """
+    Guarda la instantánea del resumen del SII por tipo con su resultado de conciliación
+
+    Args:
+        conciliacion: Resultado de conciliacion.conciliar (lista "tipos")
+    """
+    periodo = formatear_periodo(mes, anio)
+    rut_contribuyente = normalizar_rut(rut_contribuyente)
+    fecha_extraccion = fecha_extraccion or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    filas = [
+        (
+            rut_contribuyente, periodo, tipo["tipo"], tipo["documentos_resumen"],
+            json.dumps(tipo["montos_resumen"], sort_keys=True), int(tipo["estado"] == "ok"), fecha_extraccion
+        )
+        for tipo in conciliacion.get("tipos", [])
+    ]
+    with conectar(ruta) as conexion:
+        with conexion:
+            conexion.executemany(
+                """
+                INSERT INTO resumenes (
+                    rut_contribuyente, periodo, tipo_documento, documentos, montos, conciliado, fecha_extraccion
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (rut_contribuyente, periodo, tipo_documento)
+                DO UPDATE SET
+                    documentos = excluded.documentos,
+                    montos = excluded.montos,
+                    conciliado = excluded.conciliado,
+                    fecha_extraccion = excluded.fecha_extraccion
+                """,
+                filas
+            )
+
+
+def obtener_resumen(rut_contribuyente, mes, anio, ruta=None):
+    """
+    Última instantánea del resumen del SII guardada para un período
+
+    Returns:
+        dict: {tipo: {"documentos": int, "montos": dict, "conciliado": bool, "fecha_extraccion": str}}
+    """
+    with conectar(ruta) as conexion:
+        filas = conexion.execute(
+            """
+            SELECT tipo_documento, documentos, montos, conciliado, fecha_extraccion
+            FROM resumenes WHERE rut_contribuyente = ? AND periodo = ?
+            """,
+            (normalizar_rut(rut_contribuyente), formatear_periodo(mes, anio))
+        )
+        return {
+            fila["tipo_documento"]: {
+                "documentos": fila["documentos"],
+                "montos": json.loads(fila["montos"]),
+                "conciliado": bool(fila["conciliado"]),
+                "fecha_extraccion": fila["fecha_extraccion"],
+            }
+            for fila in filas
+        }
+
+
+_MONTOS = ("monto_neto", "monto_iva", "monto_total")
+
+
+def _sumar_montos(destino, fila, signo=1):
+    destino["documentos"] += fila["documentos"]
+    for monto in _MONTOS:
+        if fila[monto] is not None:
+            destino[monto] = (destino[monto] or 0) + signo * fila[monto]
+
+
+def _componer_resumen(filas):
+    """
+    Compone el resumen del período a partir de las filas de la tabla agregados
+
+    Los totales por tipo se informan tal cual; los totales del período, por
+    proveedor y por día son netos (las notas de crédito restan).
+    """
+    vacio = lambda: {"documentos": 0, "monto_neto": None, "monto_iva": None, "monto_total": None}
+    totales = vacio()
+    por_tipo, por_proveedor, por_dia = {}, {}, {}
+    for fila in filas:
+        signo = -1 if fila["tipo_documento"] in TIPOS_NOTA_CREDITO else 1
+        if fila["dimension"] == "tipo":
+            _sumar_montos(por_tipo.setdefault(fila["tipo_documento"], vacio()), fila)
+            _sumar_montos(totales, fila, signo)
+        elif fila["dimension"] == "proveedor":
+            _sumar_montos(por_proveedor.setdefault(fila["clave"], vacio()), fila, signo)
+        elif fila["dimension"] == "dia":
+            _sumar_montos(por_dia.setdefault(fila["clave"], vacio()), fila, signo)
+    return {
+        "totales": totales,
+        "por_tipo": por_tipo,
+        "por_proveedor": dict(sorted(por_proveedor.items())),
+        "por_dia": dict(sorted(por_dia.items())),
+    }
+
+
+def guardar_agregados(rut_contribuyente, mes, anio, filas, tipos_documento, fecha_extraccion=None, ruta=None):
+    """
+    Reemplaza los agregados de los tipos extraídos y recompone el resumen del período
+
+    Los agregados de los tipos no extraídos en esta ejecución se conservan, de
+    modo que el resumen se mantiene al día aunque se extraiga solo parte del período.
+
+    Args:
+        filas: Resultado de procesador.calcular_agregados
+        tipos_documento: Tipos cuyos agregados se reemplazan
+    """
+    periodo = formatear_periodo(mes, anio)
+    rut_contribuyente = normalizar_rut(rut_contribuyente)
+    fecha_extraccion = fecha_extraccion or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with conectar(ruta) as conexion:
+        with conexion:
+            conexion.executemany(
+                "DELETE FROM agregados WHERE rut_contribuyente = ? AND periodo = ? AND tipo_documento = ?",
+                [(rut_contribuyente, periodo, tipo) for tipo in tipos_documento]
+            )
+            conexion.executemany(
+                """
+                INSERT OR REPLACE INTO agregados (
+                    rut_contribuyente, periodo, tipo_documento, dimension, clave,
+                    documentos, monto_neto, monto_iva, monto_total
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(rut_contribuyente, periodo, *fila) for fila in filas]
+            )
+            actuales = conexion.execute(
+                "SELECT * FROM agregados WHERE rut_contribuyente = ? AND periodo = ?",
+                (rut_contribuyente, periodo)
+            ).fetchall()
+            resumen = {
+                "rut": rut_contribuyente,
+                "periodo": periodo,
+                "fecha_actualizacion": fecha_extraccion,
+                **_componer_resumen(actuales),
+            }
+            conexion.execute(
+                """
+                INSERT INTO resumen_agregado (rut_contribuyente, periodo, contenido, fecha_actualizacion)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (rut_contribuyente, periodo)
+                DO UPDATE SET contenido = excluded.contenido, fecha_actualizacion = excluded.fecha_actualizacion
+                """,
+                (rut_contribuyente, periodo, json.dumps(resumen, ensure_ascii=False), fecha_extraccion)
+            )
+    return resumen
+
+
+def obtener_resumen_agregado(rut_contribuyente, periodo, ruta=None):
+    """
+    Resumen precalculado de un período (JSON ya compuesto, o None si no existe)
+    """
+    with conectar(ruta) as conexion:
+        fila = conexion.execute(
+            "SELECT contenido FROM resumen_agregado WHERE rut_contribuyente = ? AND periodo = ?",
+            (normalizar_rut(rut_contribuyente), periodo)
+        ).fetchone()
+    return fila["contenido"] if fila else None
+
+
+def ultima_extraccion(rut_contribuyente, mes, anio, completa=False, ruta=None):
+    """
+    Última extracción registrada de un período
+
+    Args:
+        completa: Considerar solo las extracciones que cubrieron el período completo
+
+    Returns:
+        dict: {"fecha_extraccion", "tipos_documento", "total_registros", "completa"} o None
+    """
+    with conectar(ruta) as conexion:
+        fila = conexion.execute(
+            f"""
+            SELECT fecha_extraccion, tipos_documento, total_registros, completa
+            FROM extracciones WHERE rut_contribuyente = ? AND periodo = ?{" AND completa = 1" if completa else ""}
+            ORDER BY fecha_extraccion DESC LIMIT 1
+            """,
+            (normalizar_rut(rut_contribuyente), formatear_periodo(mes, anio))
+        ).fetchone()
+    if fila is None:
+        return None
+    return {
+        "fecha_extraccion": fila["fecha_extraccion"],
+        "tipos_documento": json.loads(fila["tipos_documento"] or "[]"),
+        "total_registros": fila["total_registros"],
+        "completa": bool(fila["completa"]),
+    }
+
+
+def periodo_vigente(rut_contribuyente, mes, anio, tipos_documento=None, minutos=None, ruta=None):
+    """
+    Indica si el período tiene una extracción reciente que cubre los tipos pedidos
+
+    Args:
+        tipos_documento: Tipos requeridos (None exige una extracción del período completo: una
+            parcial, como la de una regla programada con tipos, no cubre los demás tipos)
+        minutos: Antigüedad máxima de la extracción (por defecto VIGENCIA_EXTRACCION_MINUTOS)
+
+    Returns:
+        dict: La última extracción si está vigente, None si no
+    """
+    minutos = VIGENCIA_EXTRACCION_MINUTOS if minutos is None else minutos
+    if minutos <= 0:
+        return None
+    extraccion = ultima_extraccion(rut_contribuyente, mes, anio, completa=tipos_documento is None, ruta=ruta)
+    if extraccion is None:
+        return None
+    fecha = datetime.strptime(extraccion["fecha_extraccion"], "%Y-%m-%d %H:%M:%S")
+    if datetime.now() - fecha > timedelta(minutes=minutos):
+        return None
+    if tipos_documento is not None and not set(map(str, tipos_documento)) <= set(extraccion["tipos_documento"]):
+        return None
+    return extraccion
+
+
+def _filtros(rut_contribuyente=None, periodo=None, tipo_documento=None, desde=None, hasta=None):
+    condiciones, parametros = [], []
+    if rut_contribuyente:
+        condiciones.append("rut_contribuyente = ?")
+        parametros.append(normalizar_rut(rut_contribuyente))
+    if periodo:
+        condiciones.append("periodo = ?")
+        parametros.append(periodo)
+    if desde:
+        condiciones.append("periodo >= ?")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("periodo <= ?")
+        parametros.append(hasta)
+    if tipo_documento:
+        condiciones.append("tipo_documento = ?")
+        parametros.append(str(tipo_documento))
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return where, parametros
+
+
+def obtener_registros(rut_contribuyente=None, periodo=None, tipo_documento=None, ruta=None):
+    """
+    Obtiene los registros almacenados de un período
+
+    Returns:
+        list: Lista de diccionarios con los registros originales
+    """
+    where, parametros = _filtros(rut_contribuyente, periodo, tipo_documento)
+    with conectar(ruta) as conexion:
+        filas = conexion.execute(
+            f"SELECT datos FROM registros {where} ORDER BY periodo, tipo_documento, folio",
+            parametros
+        )
+        return [json.loads(fila["datos"]) for fila in filas]
+
+
+def listar_periodos(rut_contribuyente=None, ruta=None):
+    """
+    Lista los períodos almacenados con su cantidad de registros y última extracción
+    """
+    where, parametros = _filtros(rut_contribuyente)
+    with conectar(ruta) as conexion:
+        filas = conexion.execute(
+            f"""
+            SELECT rut_contribuyente, periodo, COUNT(*) AS total_registros,
+                   MAX(fecha_extraccion) AS ultima_extraccion
+            FROM registros {where}
+            GROUP BY rut_contribuyente, periodo
+            ORDER BY rut_contribuyente, periodo
+            """,
+            parametros
+        )
+        return [dict(fila) for fila in filas]
+
+
+def agregados_por_periodo(rut_contribuyente=None, desde=None, hasta=None, ruta=None):
+    """
+    Calcula totales por período y tipo de documento sobre el histórico
+
+    Args:
+        desde: Período inicial "YYYY-MM" (inclusive)
+        hasta: Período final "YYYY-MM" (inclusive)
+    """
+    where, parametros = _filtros(rut_contribuyente, desde=desde, hasta=hasta)
+    with conectar(ruta) as conexion:
+        filas = conexion.execute(
+            f"""
+            SELECT rut_contribuyente, periodo, tipo_documento,
+                   COUNT(*) AS documentos,
+                   SUM(monto_neto) AS monto_neto,
+                   SUM(monto_iva) AS monto_iva,
+                   SUM(monto_total) AS monto_total
+            FROM registros {where}
+            GROUP BY rut_contribuyente, periodo, tipo_documento
+            ORDER BY rut_contribuyente, periodo, tipo_documento
+            """,
+            parametros
+        )
+        return [dict(fila) for fila in filas]
+
+
+def exportar_csv(rut_contribuyente=None, periodo=None, tipo_documento=None, ruta=None):
+    """
+    Exporta los registros almacenados a texto CSV
+    """
+    registros = obtener_registros(rut_contribuyente, periodo, tipo_documento, ruta)
+    columnas = []
+    for registro in registros:
+        for columna in registro:
+            if columna not in columnas:
+                columnas.append(columna)
+
+    salida = io.StringIO()
+    writer = csv.DictWriter(salida, fieldnames=columnas)
+    writer.writeheader()
+    writer.writerows(registros)
+    return salida.getvalue()
@@ -1,24 +1,61 @@
 """
 Servidor API REST para RCV Scrap
+
+El módulo no importa extractor (pandas, Playwright) al cargarse: la función de
+scraping por defecto lo importa en su primer uso y, con PRECARGA_MODULOS, un
+hilo lo precarga después de que el servidor empieza a aceptar conexiones.
 """
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+import time
+
+_INICIO_IMPORTACION = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import os
+import sys
 import json
+import asyncio
 import logging
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
 from enum import Enum
 import uvicorn
 
-from config import ARCHIVO_JSON, ARCHIVO_EXCEL
+from config import (
+    ARCHIVO_JSON, ARCHIVO_EXCEL, ARCHIVO_PARQUET, ARCHIVO_CSV,
+    TRABAJADORES_EXTRACCION, MAX_UNIDADES_POR_CONTRIBUYENTE, PERIODOS_POR_UNIDAD,
+    TRAZAS_HABILITADAS, PRECARGA_MODULOS, PROGRESO_INTERVALO,
+    LOG_NIVEL, LOG_FORMATO, LOG_REGISTROS_POR_SEGUNDO
+)
+from bitacora import configurar_logging
+import almacen
+from contribuyentes import obtener_credenciales, listar_contribuyentes, normalizar_rut, rut_por_defecto
+from periodos import periodos_en_rango, formatear_periodo, parsear_periodo
+from planificador import PlanificadorJusto
+from programador import Programador
+from limitador import limitador
+from selectores import resolutor
+import metricas
+from trazas import ruta_traza
+import salidas
+import navegador
 
 logger = logging.getLogger("api_server")
 
 # Variable global para almacenar la función de scraping
 _ejecutar_scraping_func = None
 
+# Tiempos de arranque (segundos desde el inicio de la importación de este módulo)
+_arranque = {
+    "importacion_segundos": None,
+    "listo_segundos": None,
+    "precarga_segundos": None,
+    "precarga_completa": False,
+}
+
 
 def configurar_scraping(func):
     """
@@ -31,20 +68,66 @@ def configurar_scraping(func):
     _ejecutar_scraping_func = func
 
 
-def crear_app(ejecutar_scraping_func):
+def _ejecutar_scraping_diferido(**kwargs):
+    """
+    Función de scraping por defecto: importa extractor recién en el primer uso
+    """
+    from extractor import ejecutar_scraping
+    return ejecutar_scraping(**kwargs)
+
+
+def _precargar_modulos():
+    """
+    Importa los módulos pesados en segundo plano para que la primera extracción no pague su costo
+    """
+    inicio = time.perf_counter()
+    try:
+        import extractor  # noqa: F401
+        _arranque["precarga_completa"] = True
+    except Exception as e:
+        logger.error("Error al precargar módulos de extracción: %s", str(e))
+    _arranque["precarga_segundos"] = round(time.perf_counter() - inicio, 3)
+    logger.info("Módulos de extracción precargados en %.2fs", _arranque["precarga_segundos"])
+
+
+def estado_arranque():
+    """
+    Tiempos de arranque del servidor
+    """
+    return dict(_arranque)
+
+
+def crear_app(ejecutar_scraping_func, precargar=False):
     """
     Crea y configura la aplicación FastAPI
     
     Args:
         ejecutar_scraping_func: Función que ejecuta el scraping
+        precargar: Importar extractor en un hilo en segundo plano al iniciar
         
     Returns:
         FastAPI: Aplicación configurada
     """
+    @asynccontextmanager
+    async def ciclo_de_vida(app):
+        # Al arrancar el servidor (main.py o uvicorn directo), no al importar el módulo
+        configurar_logging(LOG_NIVEL, LOG_FORMATO, por_segundo=LOG_REGISTROS_POR_SEGUNDO)
+        _arranque["listo_segundos"] = round(time.perf_counter() - _INICIO_IMPORTACION, 3)
+        logger.info(
+            "API lista en %.2fs (importación de api_server: %.2fs)",
+            _arranque["listo_segundos"], _arranque["importacion_segundos"] or 0
+        )
+        if precargar:
+            threading.Thread(target=_precargar_modulos, name="precarga", daemon=True).start()
+        programador.iniciar()
+        yield
+        programador.detener()
+    
     app = FastAPI(
         title="RCV Scrap API",
         description="API para extraer datos del Registro de Compras y Ventas del SII",
-        version="2.0.0"
+        version="2.0.0",
+        lifespan=ciclo_de_vida
     )
     
     # Modelo para solicitud de extracción
@@ -55,6 +138,20 @@ def crear_app(ejecutar_scraping_func):
             None, 
             description="Lista de códigos de tipos de documento. Si no se especifica, se procesarán TODOS los tipos disponibles."
         )
+        desde: Optional[str] = Field(
+            None, pattern=r"^\d{4}-\d{2}$",
+            description="Período inicial (YYYY-MM) para extraer un rango en una sola sesión. Reemplaza a mes/anio"
+        )
+        hasta: Optional[str] = Field(
+            None, pattern=r"^\d{4}-\d{2}$",
+            description="Período final (YYYY-MM) del rango. Si no se especifica, igual a 'desde'"
+        )
+        contextos: int = Field(1, ge=1, le=8, description="Contextos de navegador en paralelo para un rango de períodos")
+        rut: Optional[str] = Field(None, description="RUT del contribuyente registrado. Si no se especifica, usa SII_RUT")
+        trazar: bool = Field(False, description="Registrar una traza de spans del trabajo (GET /trazas/{id})")
+        forzar: bool = Field(
+            False, description="Extraer el detalle de todos los tipos aunque su resumen no haya cambiado"
+        )
         
         class Config:
             json_schema_extra = {
@@ -65,18 +162,9 @@ def crear_app(ejecutar_scraping_func):
                 }
             }
     
-    # Estado global de la extracción
-    estado_extraccion = {
-        "estado": "inactivo",
-        "mensaje": "",
-        "fecha_inicio": None,
-        "fecha_fin": None,
-        "total_registros": 0,
-        "error": None
-    }
-    
     class EstadoEnum(str, Enum):
         inactivo = "inactivo"
+        en_cola = "en_cola"
         ejecutando = "ejecutando"
         completado = "completado"
         error = "error"
@@ -84,42 +172,113 @@ def crear_app(ejecutar_scraping_func):
     class EstadoResponse(BaseModel):
         estado: EstadoEnum
         mensaje: str
+        id: Optional[str] = None
+        rut: Optional[str] = None
+        fecha_creacion: Optional[str] = None
         fecha_inicio: Optional[str] = None
         fecha_fin: Optional[str] = None
         total_registros: int = 0
         error: Optional[str] = None
         periodo: Optional[dict] = None
         tipos_documento: Optional[List[str]] = None
+        origen: Optional[str] = None
+        unidades_total: int = 0
+        unidades_completadas: int = 0
+        metricas: Optional[dict] = None
+        traza_disponible: bool = False
+        progreso: Optional[dict] = None
+    
+    def ejecutar_unidad(rut, **kwargs):
+        """Ejecuta una unidad de trabajo del planificador (las salidas se publican por trabajo)"""
+        return ejecutar_scraping_func(rut=rut, exportar=False, conservar_navegador=True, **kwargs)
     
-    def ejecutar_extraccion_background(mes=None, anio=None, tipos_documento=None):
-        """Ejecuta la extracción en segundo plano"""
-        nonlocal estado_extraccion
+    def publicar_trabajo(trabajo, resultados):
+        """Publica las salidas del trabajo completo; las programadas solo pre-calientan el almacén"""
+        if trabajo.parametros.get("origen") == "programado" or not any(resultados):
+            return
+        from extractor import exportar_trabajo
+        exportar_trabajo(trabajo.id, trabajo.rut, resultados)
+    
+    def liberar_navegador():
+        """Cierra el navegador que el trabajador conserva entre unidades (si extractor ya se cargó)"""
+        extractor = sys.modules.get("extractor")
+        if extractor is not None:
+            extractor.cerrar_navegador_del_hilo()
+    
+    # Planificador justo: reparte los trabajadores entre contribuyentes en round-robin
+    planificador = PlanificadorJusto(
+        ejecutar_unidad,
+        trabajadores=TRABAJADORES_EXTRACCION,
+        max_por_contribuyente=MAX_UNIDADES_POR_CONTRIBUYENTE,
+        al_terminar=publicar_trabajo,
+        al_quedar_inactivo=liberar_navegador
+    )
+    
+    # Extracciones programadas para pre-calentar el almacén antes de los picos de demanda
+    programador = Programador(planificador)
+    
+    # Medidores calculados al exponer /metrics
+    metricas.registrar_medidor(
+        "rcv_limitador_concurrencia", "Límite actual de solicitudes simultáneas al SII",
+        lambda: limitador.estado()["concurrencia_limite"]
+    )
+    metricas.registrar_medidor(
+        "rcv_limitador_tasa", "Tasa actual de solicitudes por segundo al SII",
+        lambda: limitador.estado()["tasa_por_segundo"]
+    )
+    metricas.registrar_medidor(
+        "rcv_memoria_rss_bytes", "Memoria residente del proceso",
+        metricas.memoria_rss
+    )
+    metricas.registrar_medidor(
+        "rcv_navegador_heap_bytes", "Heap de JavaScript del renderer por contexto abierto (CDP)",
+        lambda: {(("contexto", id_monitor),): m["heap_bytes"] for id_monitor, m in navegador.muestras_actuales().items()}
+    )
+    metricas.registrar_medidor(
+        "rcv_navegador_cpu_porcentaje", "CPU del hilo principal del renderer por contexto abierto (CDP)",
+        lambda: {
+            (("contexto", id_monitor),): m["cpu_porcentaje"]
+            for id_monitor, m in navegador.muestras_actuales().items() if m["cpu_porcentaje"] is not None
+        }
+    )
+    metricas.registrar_medidor(
+        "rcv_unidades_en_cola", "Unidades de trabajo pendientes en el planificador",
+        planificador.pendientes
+    )
+    metricas.registrar_medidor(
+        "rcv_arranque_segundos", "Tiempos de arranque del servidor",
+        lambda: {
+            (("etapa", etapa),): _arranque[f"{etapa}_segundos"]
+            for etapa in ("importacion", "listo", "precarga")
+            if _arranque[f"{etapa}_segundos"] is not None
+        }
+    )
+    
+    def _describir_periodo(mes, anio, desde, hasta):
+        if desde or hasta:
+            return {"desde": desde or hasta, "hasta": hasta or desde}
+        return {"mes": mes, "anio": anio}
+    
+    def _dividir_en_unidades(mes, anio, tipos_documento, desde, hasta, contextos, forzar=False):
+        """
+        Divide una solicitud en unidades de trabajo. Los rangos se parten en bloques de
+        PERIODOS_POR_UNIDAD períodos para que el planificador pueda intercalar contribuyentes.
+        """
+        if not (desde or hasta):
+            return [{"mes": mes, "anio": anio, "tipos_documento": tipos_documento, "forzar": forzar}]
         
-        try:
-            estado_extraccion["estado"] = "ejecutando"
-            estado_extraccion["mensaje"] = "Extracción en proceso..."
-            estado_extraccion["fecha_inicio"] = datetime.now().isoformat()
-            estado_extraccion["fecha_fin"] = None
-            estado_extraccion["error"] = None
-            estado_extraccion["periodo"] = {"mes": mes, "anio": anio}
-            estado_extraccion["tipos_documento"] = tipos_documento
-            
-            # Ejecutar la extracción con parámetros
-            resultado = ejecutar_scraping_func(mes=mes, anio=anio, tipos_documento=tipos_documento)
-            
-            if resultado:
-                estado_extraccion["total_registros"] = len(resultado.get("datos", []))
-            
-            estado_extraccion["estado"] = "completado"
-            estado_extraccion["mensaje"] = "Extracción completada exitosamente"
-            estado_extraccion["fecha_fin"] = datetime.now().isoformat()
-            
-        except Exception as e:
-            logger.error("Error durante la extracción: %s", str(e))
-            estado_extraccion["estado"] = "error"
-            estado_extraccion["mensaje"] = "Error durante la extracción"
-            estado_extraccion["error"] = str(e)
-            estado_extraccion["fecha_fin"] = datetime.now().isoformat()
+        periodos = periodos_en_rango(desde or hasta, hasta or desde)
+        unidades = []
+        for i in range(0, len(periodos), PERIODOS_POR_UNIDAD):
+            bloque = periodos[i:i + PERIODOS_POR_UNIDAD]
+            unidades.append({
+                "desde": formatear_periodo(*bloque[0]),
+                "hasta": formatear_periodo(*bloque[-1]),
+                "tipos_documento": tipos_documento,
+                "contextos": contextos,
+                "forzar": forzar
+            })
+        return unidades
     
     @app.get("/", tags=["General"])
     async def root():
@@ -131,124 +290,312 @@ def crear_app(ejecutar_scraping_func):
             "tipos_documento_disponibles": TIPOS_DOCUMENTO,
             "endpoints": {
                 "GET /": "Información de la API",
-                "POST /extraer": "Iniciar extracción de datos. Parámetros opcionales: mes, anio (usa mes/año actual si no se especifican), tipos_documento (usa todos si no se especifica)",
-                "GET /estado": "Obtener estado de la extracción",
-                "GET /descargar/json": "Descargar datos en formato JSON",
+                "POST /extraer": "Iniciar extracción de datos. Parámetros opcionales: mes, anio (usa mes/año actual si no se especifican), tipos_documento (usa todos si no se especifica), desde/hasta (rango YYYY-MM en una sola sesión), contextos, rut (contribuyente registrado) y forzar (no reutilizar tipos sin cambios)",
+                "GET /estado": "Obtener estado de la última extracción o de un trabajo (id)",
+                "GET /trabajos": "Listar trabajos de extracción y estado del planificador",
+                "GET /contribuyentes": "Listar contribuyentes registrados",
+                "GET /programacion": "Reglas de extracción programada (pre-calentamiento) y sus próximas ejecuciones",
+                "GET /limites": "Límites actuales de tasa y concurrencia hacia el SII",
+                "GET /selectores": "Ranking aprendido de selectores y sondeos evitados",
+                "GET /metrics": "Métricas en formato Prometheus (tiempos por fase, contadores)",
+                "GET /progreso/{id}": "Progreso en vivo del trabajo y registros a medida que se extraen (Server-Sent Events)",
+                "GET /trazas/{id}": "Traza del trabajo en formato Chrome Trace (solicitada con trazar=true)",
+                "GET /descargar/json": "Descargar datos en formato JSON del trabajo (id) o los últimos del contribuyente (rut)",
                 "GET /descargar/excel": "Descargar datos en formato Excel",
-                "GET /datos": "Obtener datos en formato JSON directamente",
+                "GET /descargar/parquet": "Descargar datos en formato Parquet (esquema tipado)",
+                "GET /descargar/csv": "Descargar datos en formato CSV (esquema tipado)",
+                "GET /datos": "Obtener datos en formato JSON directamente (id del trabajo o rut)",
+                "GET /historico/periodos": "Listar períodos almacenados en el histórico",
+                "GET /historico": "Obtener registros históricos de un período (periodo=YYYY-MM)",
+                "GET /cambios": "Registros insertados, actualizados y eliminados de un período desde una versión (periodo, desde_version)",
+                "GET /resumen": "Totales precalculados del período por tipo de documento, proveedor y día (periodo=YYYY-MM, rut)",
+                "GET /historico/agregados": "Totales por período y tipo de documento (desde/hasta=YYYY-MM)",
+                "GET /historico/descargar": "Descargar registros históricos de un período en CSV",
                 "GET /health": "Health check del servidor"
             }
         }
               
     
     @app.post("/extraer", tags=["Extracción"])
-    async def iniciar_extraccion(
-        background_tasks: BackgroundTasks,
-        request: Optional[ExtraccionRequest] = None
-    ):
-        nonlocal estado_extraccion
-        
-        if estado_extraccion["estado"] == "ejecutando":
-            raise HTTPException(
-                status_code=409,
-                detail="Ya hay una extracción en proceso. Por favor espera a que termine."
-            )
-        
+    async def iniciar_extraccion(request: Optional[ExtraccionRequest] = None):
         # Extraer parámetros (usar valores actuales si no se proporcionan)
         mes = request.mes if request else None
         anio = request.anio if request else None
         tipos_documento = request.tipos_documento if request else None
+        desde = request.desde if request else None
+        hasta = request.hasta if request else None
+        contextos = request.contextos if request else 1
+        trazar = (request.trazar if request else False) or TRAZAS_HABILITADAS
+        forzar = request.forzar if request else False
         
-        estado_extraccion = {
-            "estado": "ejecutando",
-            "mensaje": "Extracción iniciada",
-            "fecha_inicio": datetime.now().isoformat(),
-            "fecha_fin": None,
-            "total_registros": 0,
-            "error": None,
-            "periodo": {"mes": mes, "anio": anio},
-            "tipos_documento": tipos_documento
-        }
+        try:
+            rut, _ = obtener_credenciales(request.rut if request else None)
+            unidades = _dividir_en_unidades(mes, anio, tipos_documento, desde, hasta, contextos, forzar)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
         
-        background_tasks.add_task(
-            ejecutar_extraccion_background, 
-            mes=mes, 
-            anio=anio, 
-            tipos_documento=tipos_documento
+        trabajo = planificador.enviar(
+            rut,
+            unidades,
+            parametros={
+                "periodo": _describir_periodo(mes, anio, desde, hasta),
+                "tipos_documento": tipos_documento
+            },
+            trazar=trazar
         )
         
         return {
             "mensaje": "Extracción iniciada correctamente",
-            "estado": estado_extraccion["estado"],
-            "periodo": estado_extraccion["periodo"],
-            "tipos_documento": tipos_documento
+            "id": trabajo.id,
+            "rut": rut,
+            "estado": trabajo.estado,
+            "periodo": trabajo.parametros["periodo"],
+            "tipos_documento": tipos_documento,
+            "unidades": len(unidades),
+            "unidades_en_cola": planificador.pendientes()
         }
     
     @app.get("/estado", tags=["Extracción"], response_model=EstadoResponse)
-    async def obtener_estado():
-        return EstadoResponse(**estado_extraccion)
+    async def obtener_estado(id: Optional[str] = None):
+        if id:
+            trabajo = planificador.obtener(id)
+            if not trabajo:
+                raise HTTPException(status_code=404, detail=f"Trabajo {id} no encontrado")
+        else:
+            trabajo = planificador.ultimo()
+        if not trabajo:
+            return EstadoResponse(estado="inactivo", mensaje="")
+        return EstadoResponse(**trabajo)
     
-    @app.get("/descargar/json", tags=["Descarga"])
-    async def descargar_json():
-        if not os.path.exists(ARCHIVO_JSON):
+    @app.get("/trabajos", tags=["Extracción"])
+    async def listar_trabajos(rut: Optional[str] = None):
+        return {
+            "trabajos": planificador.listar(normalizar_rut(rut) if rut else None),
+            "planificador": planificador.estadisticas()
+        }
+    
+    @app.get("/metrics", tags=["General"])
+    async def exponer_metricas():
+        return Response(content=metricas.exponer(), media_type="text/plain; version=0.0.4")
+    
+    @app.get("/progreso/{trabajo_id}", tags=["Extracción"])
+    async def transmitir_progreso(
+        trabajo_id: str,
+        request: Request,
+        registros: bool = True,
+        ultimo_evento: Optional[int] = Header(None, alias="Last-Event-ID")
+    ):
+        progreso = planificador.progreso(trabajo_id)
+        if progreso is None:
+            raise HTTPException(status_code=404, detail=f"Trabajo {trabajo_id} no encontrado")
+        
+        async def eventos():
+            ultimo_id = ultimo_evento or 0
+            ultima_escritura = time.monotonic()
+            # Estado actual para clientes que se conectan con el trabajo en curso
+            if not ultimo_id:
+                yield f"event: estado\ndata: {json.dumps(progreso.estado(), ensure_ascii=False)}\n\n"
+            while True:
+                pendientes, cerrado = progreso.eventos_desde(ultimo_id)
+                for evento in pendientes:
+                    ultimo_id = evento["id"]
+                    if evento["evento"] == "registros" and not registros:
+                        continue
+                    datos = json.dumps(evento, ensure_ascii=False, default=str)
+                    yield f"id: {evento['id']}\nevent: {evento['evento']}\ndata: {datos}\n\n"
+                if cerrado and not pendientes:
+                    break
+                if pendientes:
+                    ultima_escritura = time.monotonic()
+                    continue
+                if await request.is_disconnected():
+                    break
+                # Comentario periódico para que los proxies no corten la conexión inactiva
+                if time.monotonic() - ultima_escritura > 15:
+                    ultima_escritura = time.monotonic()
+                    yield ": keepalive\n\n"
+                await asyncio.sleep(PROGRESO_INTERVALO)
+        
+        return StreamingResponse(
+            eventos(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    @app.get("/trazas/{trabajo_id}", tags=["Extracción"])
+    async def descargar_traza(trabajo_id: str):
+        ruta = ruta_traza(trabajo_id)
+        if not trabajo_id.isalnum() or not os.path.exists(ruta):
             raise HTTPException(
                 status_code=404,
-                detail="Archivo JSON no encontrado. Ejecuta primero la extracción."
+                detail=f"Traza del trabajo {trabajo_id} no encontrada. Inicia la extracción con trazar=true."
             )
         return FileResponse(
-            path=ARCHIVO_JSON,
+            path=ruta,
             media_type="application/json",
-            filename=ARCHIVO_JSON
+            filename=f"traza_{trabajo_id}.json"
         )
     
-    @app.get("/descargar/excel", tags=["Descarga"])
-    async def descargar_excel():
-        if not os.path.exists(ARCHIVO_EXCEL):
+    @app.get("/programacion", tags=["Extracción"])
+    def programacion():
+        return programador.estado()
+    
+    @app.get("/limites", tags=["Extracción"])
+    async def limites():
+        return limitador.estado()
+    
+    @app.get("/selectores", tags=["Extracción"])
+    async def selectores():
+        return resolutor.estadisticas()
+    
+    @app.get("/contribuyentes", tags=["Extracción"])
+    async def contribuyentes():
+        return {"contribuyentes": listar_contribuyentes()}
+    
+    def _puntero_salidas(id, rut):
+        # Salidas del trabajo indicado o, si no, las más recientes del contribuyente (por defecto SII_RUT)
+        if id:
+            trabajo = planificador.obtener(id)
+            if not id.isalnum() or (trabajo is None and salidas.version_actual(salidas.ambito_trabajo(id)) is None):
+                raise HTTPException(status_code=404, detail=f"Trabajo {id} no encontrado")
+            if trabajo is not None and rut and normalizar_rut(rut) != trabajo["rut"]:
+                raise HTTPException(status_code=404, detail=f"Trabajo {id} no encontrado para el RUT {rut}")
+            return salidas.version_actual(salidas.ambito_trabajo(id))
+        rut = normalizar_rut(rut) if rut else rut_por_defecto()
+        try:
+            return salidas.version_actual(salidas.ambito_rut(rut)) if rut else None
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    
+    def _archivo_publicado(nombre, media_type, descripcion, id, rut, adjunto=True):
+        # Versión inmutable publicada por rename atómico: se sirve tal cual, sin leerla ni copiarla
+        puntero = _puntero_salidas(id, rut)
+        ruta = salidas.ruta_actual(nombre, puntero) if puntero else None
+        if ruta is None:
             raise HTTPException(
                 status_code=404,
-                detail="Archivo Excel no encontrado. Ejecuta primero la extracción."
+                detail=f"{descripcion} no encontrado. Ejecuta primero la extracción."
             )
         return FileResponse(
-            path=ARCHIVO_EXCEL,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=ARCHIVO_EXCEL
+            path=ruta,
+            media_type=media_type,
+            filename=nombre if adjunto else None,
+            headers={"X-Version-Salidas": puntero["version"]}
         )
     
+    @app.get("/salidas", tags=["Descarga"])
+    async def version_salidas(id: Optional[str] = None, rut: Optional[str] = None):
+        puntero = _puntero_salidas(id, rut)
+        if puntero is None:
+            raise HTTPException(status_code=404, detail="Aún no hay salidas publicadas. Ejecuta primero la extracción.")
+        return puntero
+    
+    @app.get("/descargar/json", tags=["Descarga"])
+    async def descargar_json(id: Optional[str] = None, rut: Optional[str] = None):
+        return _archivo_publicado(ARCHIVO_JSON, "application/json", "Archivo JSON", id, rut)
+    
+    @app.get("/descargar/excel", tags=["Descarga"])
+    async def descargar_excel(id: Optional[str] = None, rut: Optional[str] = None):
+        return _archivo_publicado(
+            ARCHIVO_EXCEL, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "Archivo Excel",
+            id, rut
+        )
+    
+    @app.get("/descargar/parquet", tags=["Descarga"])
+    async def descargar_parquet(id: Optional[str] = None, rut: Optional[str] = None):
+        return _archivo_publicado(ARCHIVO_PARQUET, "application/vnd.apache.parquet", "Archivo Parquet", id, rut)
+    
+    @app.get("/descargar/csv", tags=["Descarga"])
+    async def descargar_csv(id: Optional[str] = None, rut: Optional[str] = None):
+        return _archivo_publicado(ARCHIVO_CSV, "text/csv", "Archivo CSV", id, rut)
+    
     @app.get("/datos", tags=["Datos"])
-    async def obtener_datos():
-        if not os.path.exists(ARCHIVO_JSON):
-            raise HTTPException(
-                status_code=404,
-                detail="Datos no disponibles. Ejecuta primero la extracción."
-            )
+    async def obtener_datos(id: Optional[str] = None, rut: Optional[str] = None):
+        return _archivo_publicado(ARCHIVO_JSON, "application/json", "Datos", id, rut, adjunto=False)
+    
+    @app.get("/historico/periodos", tags=["Histórico"])
+    def historico_periodos(rut: Optional[str] = None):
+        return {"periodos": almacen.listar_periodos(rut)}
+    
+    @app.get("/historico", tags=["Histórico"])
+    def historico_registros(periodo: str, rut: Optional[str] = None, tipo_documento: Optional[str] = None):
+        registros = almacen.obtener_registros(rut, periodo, tipo_documento)
+        return {
+            "periodo": periodo,
+            "total_registros": len(registros),
+            "datos": registros
+        }
+    
+    @app.get("/cambios", tags=["Histórico"])
+    def cambios(
+        periodo: str,
+        rut: Optional[str] = None,
+        desde_version: int = 0,
+        limite: int = Query(1000, ge=1, le=10000)
+    ):
+        try:
+            periodo = formatear_periodo(*parsear_periodo(periodo))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return {
+            "periodo": periodo,
+            "rut": normalizar_rut(rut) if rut else None,
+            "desde_version": desde_version,
+            **almacen.obtener_cambios(periodo, rut, desde_version, limite)
+        }
+    
+    @app.get("/resumen", tags=["Histórico"])
+    def resumen_periodo(periodo: str, rut: Optional[str] = None):
         try:
-            with open(ARCHIVO_JSON, 'r', encoding='utf-8') as f:
-                datos = json.load(f)
-            return JSONResponse(content=datos)
-        except Exception as e:
+            periodo = formatear_periodo(*parsear_periodo(periodo))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        rut = rut or rut_por_defecto()
+        contenido = almacen.obtener_resumen_agregado(rut, periodo) if rut else None
+        if contenido is None:
             raise HTTPException(
-                status_code=500,
-                detail=f"Error al leer los datos: {str(e)}"
+                status_code=404,
+                detail=f"No hay resumen para el período {periodo}. Ejecuta primero la extracción."
             )
+        # El resumen se guarda ya serializado: se entrega sin recalcular ni re-serializar
+        return Response(content=contenido, media_type="application/json")
+    
+    @app.get("/historico/agregados", tags=["Histórico"])
+    def historico_agregados(rut: Optional[str] = None, desde: Optional[str] = None, hasta: Optional[str] = None):
+        return {"agregados": almacen.agregados_por_periodo(rut, desde, hasta)}
+    
+    @app.get("/historico/descargar", tags=["Histórico"])
+    def historico_descargar(periodo: str, rut: Optional[str] = None, tipo_documento: Optional[str] = None):
+        contenido = almacen.exportar_csv(rut, periodo, tipo_documento)
+        return Response(
+            content=contenido,
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="rcv_{periodo}.csv"'}
+        )
     
     @app.get("/health", tags=["General"])
     async def health_check():
         return {
             "status": "ok",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "arranque": estado_arranque()
         }
     
     return app
 
 
-def iniciar_servidor(ejecutar_scraping_func):
+def iniciar_servidor(ejecutar_scraping_func=None):
     """
     Inicia el servidor FastAPI
     
     Args:
-        ejecutar_scraping_func: Función que ejecuta el scraping
+        ejecutar_scraping_func: Función que ejecuta el scraping. Por defecto se importa
+            extractor en el primer uso (o en la precarga con PRECARGA_MODULOS)
     """
-    app = crear_app(ejecutar_scraping_func)
+    if ejecutar_scraping_func is None:
+        app = crear_app(_ejecutar_scraping_diferido, precargar=PRECARGA_MODULOS)
+    else:
+        app = crear_app(ejecutar_scraping_func)
     
     # Obtener puerto de la variable de entorno (Cloud Run usa PORT=8080)
     # Fallback a 8000 para desarrollo local
@@ -263,6 +610,6 @@ def iniciar_servidor(ejecutar_scraping_func):
 
 
 # Crear instancia de la app para Cloud Run/uvicorn
-# La función de scraping se configurará en tiempo de importación
-from extractor import ejecutar_scraping as _ejecutar_scraping_default
-app = crear_app(_ejecutar_scraping_default)
+# extractor se importa en el primer uso (o en la precarga), no al importar este módulo
+app = crear_app(_ejecutar_scraping_diferido, precargar=PRECARGA_MODULOS)
+_arranque["importacion_segundos"] = round(time.perf_counter() - _INICIO_IMPORTACION, 3)
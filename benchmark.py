@@ -0,0 +1,434 @@
+"""
+Benchmark de la extracción contra el portal SII simulado
+
+Levanta portal_simulado.PortalSimulado en un puerto local, apunta el scraper
+a él y ejecuta ejecutar_scraping de punta a punta para varios tamaños de
+datos. Por escenario registra:
+    - tiempo total y tiempo por fase (métricas de metricas.py)
+    - mensajes enviados al driver de Playwright (round-trips de IPC)
+    - solicitudes HTTP atendidas por el portal
+    - memoria máxima del heap de Python (tracemalloc) y RSS máximo del proceso
+    - RSS máximo de los procesos de Chromium (suma de los descendientes, muestreada)
+      y telemetría CDP del renderer (heap de JavaScript, nodos, CPU)
+
+Con --perfiles cada escenario se repite con cada perfil de lanzamiento de
+Chromium (navegador.PERFILES) para comparar consumo y velocidad.
+
+Con --arranque N mide además N arranques en frío del servidor API (uvicorn en un
+subproceso) hasta la primera respuesta 200 de /health.
+
+Uso:
+    python benchmark.py --tamanos 10,100,500 --tipos 33,61 --latencia 0.02
+    python benchmark.py --salida actual.json --comparar base.json --umbral 0.2
+    python benchmark.py --tamanos "" --arranque 5
+    python benchmark.py --tamanos 500 --perfiles estandar,liviano,minimo
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import subprocess
+import urllib.request
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+
+from bitacora import configurar_logging
+from portal_simulado import PortalSimulado
+
+logger = logging.getLogger("benchmark")
+
+RUT_BENCHMARK = "76123456-0"
+CLAVE_BENCHMARK = "clave-benchmark"
+
+
+class ContadorIPC:
+    """
+    Cuenta los mensajes que el cliente de Playwright envía a su driver
+    (cada llamada a la API sync es al menos un round-trip de IPC)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._original = None
+        self.total = 0
+        self.por_metodo = {}
+
+    def instalar(self):
+        from playwright._impl._connection import Connection
+
+        contador = self
+        self._original = original = Connection._send_message_to_server
+
+        def _enviar(conexion, objeto, metodo, *args, **kwargs):
+            with contador._lock:
+                contador.total += 1
+                contador.por_metodo[metodo] = contador.por_metodo.get(metodo, 0) + 1
+            return original(conexion, objeto, metodo, *args, **kwargs)
+
+        Connection._send_message_to_server = _enviar
+
+    def desinstalar(self):
+        if self._original:
+            from playwright._impl._connection import Connection
+            Connection._send_message_to_server = self._original
+            self._original = None
+
+    def reiniciar(self):
+        with self._lock:
+            self.total = 0
+            self.por_metodo = {}
+
+
+def _rss_maximo_mb(quien):
+    # ru_maxrss está en KB en Linux
+    return round(resource.getrusage(quien).ru_maxrss / 1024, 1)
+
+
+class MuestreoNavegador:
+    """
+    Muestrea la suma del RSS de los procesos descendientes (driver de Playwright y
+    Chromium) mientras dura un escenario. Solo Linux (/proc); en otro sistema queda en None.
+    """
+
+    def __init__(self, intervalo=0.2):
+        self.intervalo = intervalo
+        self.pico_mb = None
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @staticmethod
+    def _rss_descendientes():
+        padres, rss = {}, {}
+        pagina = os.sysconf("SC_PAGE_SIZE")
+        for entrada in os.listdir("/proc"):
+            if not entrada.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entrada}/stat") as f:
+                    # El nombre del proceso va entre paréntesis y puede contener espacios
+                    campos = f.read().rsplit(")", 1)[1].split()
+                with open(f"/proc/{entrada}/statm") as f:
+                    rss[int(entrada)] = int(f.read().split()[1]) * pagina
+                padres[int(entrada)] = int(campos[1])
+            except (OSError, IndexError, ValueError):
+                continue
+        raiz, total = os.getpid(), 0
+        for pid in rss:
+            actual = padres.get(pid)
+            while actual and actual != raiz:
+                actual = padres.get(actual)
+            if actual == raiz:
+                total += rss[pid]
+        return total
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self.pico_mb = 0.0
+            self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+            self._hilo.start()
+        return self
+
+    def _muestrear(self):
+        while not self._detener.wait(self.intervalo):
+            self.pico_mb = max(self.pico_mb, round(self._rss_descendientes() / 2**20, 1))
+
+    def __exit__(self, *exc):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+def _configurar_entorno(portal, escala_esperas, directorio):
+    """
+    Variables de entorno leídas por config.py y contribuyentes.py al importarse
+    """
+    os.environ.update({
+        "SII_URL_LOGIN": portal.url_login,
+        "SII_URL_RCV": portal.url_rcv,
+        "ESCALA_ESPERAS": str(escala_esperas),
+        "SII_RUT": RUT_BENCHMARK,
+        "SII_CLAVE": CLAVE_BENCHMARK,
+        "RCV_DB": os.path.join(directorio, "rcv_benchmark.db"),
+        "ARCHIVO_CONTRIBUYENTES": os.path.join(directorio, "contribuyentes.json"),
+        "AMBIENTE": "PROD",
+    })
+    os.environ.pop("SII_CONTRIBUYENTES", None)
+
+
+def ejecutar_escenario(portal, contador_ipc, tamano, tipos, mes, anio, perfil="estandar"):
+    """
+    Ejecuta una extracción completa con `tamano` documentos por tipo, lanzando Chromium con `perfil`
+
+    Returns:
+        dict: Resultados del escenario
+    """
+    from extractor import ejecutar_scraping
+    from contribuyentes import invalidar_sesion
+    from metricas import usar_resumen
+    from navegador import seleccionar_perfil
+
+    seleccionar_perfil(perfil)
+    portal.configurar(documentos_por_tipo={tipo: tamano for tipo in tipos})
+    portal.reiniciar_estadisticas()
+    contador_ipc.reiniciar()
+    # Cada escenario inicia sesión desde cero para que sean comparables
+    invalidar_sesion(RUT_BENCHMARK)
+
+    resumen = {}
+    tracemalloc.reset_peak()
+    inicio = time.perf_counter()
+    error = None
+    registros = 0
+    try:
+        with usar_resumen(resumen), MuestreoNavegador() as muestreo:
+            resultado = ejecutar_scraping(mes=mes, anio=anio, rut=RUT_BENCHMARK)
+        registros = len(resultado.get("datos", [])) if resultado else 0
+    except Exception as e:
+        logger.error("Escenario de %d documentos por tipo falló: %s", tamano, str(e))
+        error = str(e)
+    duracion = time.perf_counter() - inicio
+    _, pico_heap = tracemalloc.get_traced_memory()
+
+    telemetria = resumen.get("navegador", {})
+    return {
+        "perfil": perfil,
+        "documentos_por_tipo": tamano,
+        "tipos": list(tipos),
+        "registros": registros,
+        "error": error,
+        "tiempo_total_segundos": round(duracion, 3),
+        "fases": {
+            fase: {"conteo": datos["conteo"], "total_segundos": round(datos["total_segundos"], 3)}
+            for fase, datos in sorted(resumen.get("fases", {}).items())
+        },
+        "ipc_round_trips": contador_ipc.total,
+        "ipc_por_registro": round(contador_ipc.total / registros, 1) if registros else None,
+        "ipc_metodos_frecuentes": dict(sorted(contador_ipc.por_metodo.items(), key=lambda m: -m[1])[:10]),
+        "solicitudes_http": portal.estadisticas(),
+        "memoria_pico_heap_mb": round(pico_heap / 1024 / 1024, 1),
+        "memoria_rss_maximo_mb": _rss_maximo_mb(resource.RUSAGE_SELF),
+        "memoria_rss_maximo_navegador_mb": _rss_maximo_mb(resource.RUSAGE_CHILDREN),
+        "memoria_rss_pico_chromium_mb": muestreo.pico_mb,
+        "renderer_heap_pico_mb": telemetria.get("heap_pico_mb"),
+        "renderer_nodos_pico": telemetria.get("nodos_pico"),
+        "renderer_cpu_pico_porcentaje": telemetria.get("cpu_pico_porcentaje"),
+        "reciclajes_contexto": sum(
+            valor for nombre, valor in resumen.get("contadores", {}).items()
+            if nombre.startswith("rcv_navegador_reciclajes_total")
+        ),
+    }
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def medir_arranque(repeticiones, precarga=True, timeout=60):
+    """
+    Arranca el servidor API en frío y mide el tiempo hasta la primera respuesta de /health
+
+    Returns:
+        dict: Tiempos por arranque y promedio (segundos)
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    entorno = dict(os.environ, PRECARGA_MODULOS="true" if precarga else "false")
+    tiempos, reportados = [], []
+    for _ in range(repeticiones):
+        puerto = _puerto_libre()
+        inicio = time.perf_counter()
+        proceso = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_server:app", "--host", "127.0.0.1", "--port", str(puerto)],
+            cwd=directorio, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while time.perf_counter() - inicio < timeout:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/health", timeout=1) as respuesta:
+                        if respuesta.status == 200:
+                            tiempos.append(time.perf_counter() - inicio)
+                            reportados.append(json.load(respuesta).get("arranque"))
+                            break
+                except OSError:
+                    time.sleep(0.01)
+            else:
+                logger.error("El servidor no respondió /health en %ds", timeout)
+        finally:
+            proceso.terminate()
+            proceso.wait()
+    return {
+        "precarga": precarga,
+        "primera_respuesta_segundos": [round(t, 3) for t in tiempos],
+        "promedio_segundos": round(sum(tiempos) / len(tiempos), 3) if tiempos else None,
+        "reportado_por_servidor": reportados[-1] if reportados else None,
+    }
+
+
+def comparar(actual, base, umbral):
+    """
+    Compara tiempos e IPC contra un resultado base
+
+    Returns:
+        list: Descripciones de las regresiones sobre el umbral (proporción, ej: 0.2)
+    """
+    regresiones = []
+    previo = (base.get("arranque") or {}).get("promedio_segundos")
+    nuevo = (actual.get("arranque") or {}).get("promedio_segundos")
+    if previo and nuevo is not None and (nuevo - previo) / previo > umbral:
+        regresiones.append(f"arranque hasta /health: {previo} -> {nuevo} ({(nuevo - previo) / previo:+.0%})")
+    def clave(escenario):
+        return escenario.get("perfil", "estandar"), escenario["documentos_por_tipo"]
+
+    base_por_escenario = {clave(e): e for e in base.get("escenarios", [])}
+    for escenario in actual["escenarios"]:
+        anterior = base_por_escenario.get(clave(escenario))
+        if not anterior:
+            continue
+        for metrica in (
+            "tiempo_total_segundos", "ipc_round_trips", "memoria_pico_heap_mb", "memoria_rss_pico_chromium_mb"
+        ):
+            previo, nuevo = anterior.get(metrica), escenario.get(metrica)
+            if not previo or nuevo is None:
+                continue
+            variacion = (nuevo - previo) / previo
+            logger.info(
+                "%5d docs/tipo %-24s %10s -> %10s (%+.1f%%)",
+                escenario["documentos_por_tipo"], metrica, previo, nuevo, variacion * 100
+            )
+            if variacion > umbral:
+                regresiones.append(
+                    f"{metrica} con {escenario['documentos_por_tipo']} docs/tipo: {previo} -> {nuevo} ({variacion:+.0%})"
+                )
+    return regresiones
+
+
+def _imprimir_tabla(escenarios):
+    print()
+    print(
+        f"{'perfil':<9} {'docs/tipo':>9} {'registros':>9} {'total (s)':>10} {'IPC':>8} {'IPC/reg':>8} {'HTTP':>6} "
+        f"{'heap MB':>8} {'RSS MB':>8} {'Chrom MB':>9} {'JS MB':>7} {'CPU %':>6}"
+    )
+    for e in escenarios:
+        print(
+            f"{e['perfil']:<9} {e['documentos_por_tipo']:>9} {e['registros']:>9} {e['tiempo_total_segundos']:>10.2f} "
+            f"{e['ipc_round_trips']:>8} {str(e['ipc_por_registro']):>8} {e['solicitudes_http']['total']:>6} "
+            f"{e['memoria_pico_heap_mb']:>8} {e['memoria_rss_maximo_mb']:>8} {str(e['memoria_rss_pico_chromium_mb']):>9} "
+            f"{str(e['renderer_heap_pico_mb']):>7} {str(e['renderer_cpu_pico_porcentaje']):>6}"
+        )
+    fases = sorted({fase for e in escenarios for fase in e["fases"]})
+    if fases:
+        print()
+        print(f"{'fase (s)':<24}" + "".join(f"{e['documentos_por_tipo']:>10}" for e in escenarios))
+        if len({e["perfil"] for e in escenarios}) > 1:
+            print(f"{'':<24}" + "".join(f"{e['perfil']:>10}" for e in escenarios))
+        for fase in fases:
+            fila = "".join(
+                f"{e['fases'][fase]['total_segundos']:>10.2f}" if fase in e["fases"] else f"{'-':>10}"
+                for e in escenarios
+            )
+            print(f"{fase:<24}{fila}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la extracción contra el portal SII simulado")
+    parser.add_argument("--tamanos", default="10,100,500", help="Documentos por tipo de cada escenario")
+    parser.add_argument("--tipos", default="33,61", help="Tipos de documento presentes en el resumen")
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia por respuesta del portal (s)")
+    parser.add_argument("--variacion", type=float, default=0.0, help="Latencia aleatoria adicional (s)")
+    parser.add_argument("--escala-esperas", type=float, default=0.05, help="Factor para las esperas fijas del scraper")
+    parser.add_argument("--mes", type=int, default=1)
+    parser.add_argument("--anio", type=int, default=2025)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="Resultados JSON base para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=0.2, help="Regresión tolerada (proporción)")
+    parser.add_argument("--verbose", action="store_true", help="Mantener los logs INFO del scraper")
+    parser.add_argument("--arranque", type=int, default=0, help="Arranques en frío del servidor API a medir")
+    parser.add_argument(
+        "--perfiles", default="estandar",
+        help="Perfiles de lanzamiento de Chromium a comparar (estandar,liviano,minimo)"
+    )
+    args = parser.parse_args()
+
+    arranque = None
+    if args.arranque:
+        logger.info("Midiendo %d arranques en frío del servidor API...", args.arranque)
+        arranque = medir_arranque(args.arranque)
+        logger.info(
+            "Primera respuesta de /health: %.2fs promedio (%s)",
+            arranque["promedio_segundos"] or 0, arranque["primera_respuesta_segundos"]
+        )
+
+    tamanos = [int(t) for t in args.tamanos.split(",") if t.strip()]
+    tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+    perfiles = [p.strip() for p in args.perfiles.split(",") if p.strip()]
+
+    portal = PortalSimulado(
+        rut=RUT_BENCHMARK, clave=CLAVE_BENCHMARK, latencia=args.latencia, variacion=args.variacion
+    )
+    portal.iniciar()
+    directorio = tempfile.mkdtemp(prefix="rcv_benchmark_")
+    _configurar_entorno(portal, args.escala_esperas, directorio)
+    directorio_original = os.getcwd()
+    # Los archivos de salida (JSON, Excel, Parquet, CSV) se escriben en el directorio temporal
+    os.chdir(directorio)
+
+    # Importar después de configurar el entorno: config.py lee las URLs y esperas al importarse
+    import config  # noqa: F401
+    if not args.verbose:
+        for nombre in ("scraper", "extractor", "procesador", "guardador", "almacen", "limitador", "contribuyentes"):
+            logging.getLogger(nombre).setLevel(logging.WARNING)
+
+    contador_ipc = ContadorIPC()
+    contador_ipc.instalar()
+    tracemalloc.start()
+    escenarios = []
+    try:
+        for perfil in perfiles:
+            for tamano in tamanos:
+                logger.info("Escenario: %d documentos por tipo (%s), perfil %s", tamano, ",".join(tipos), perfil)
+                escenarios.append(ejecutar_escenario(portal, contador_ipc, tamano, tipos, args.mes, args.anio, perfil))
+    finally:
+        tracemalloc.stop()
+        contador_ipc.desinstalar()
+        portal.detener()
+        os.chdir(directorio_original)
+
+    resultado = {
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "parametros": {
+            "tipos": tipos, "latencia": args.latencia, "variacion": args.variacion,
+            "escala_esperas": args.escala_esperas, "perfiles": perfiles,
+        },
+        "escenarios": escenarios,
+        "arranque": arranque,
+    }
+    if escenarios:
+        _imprimir_tabla(escenarios)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        logger.info("Resultados guardados en %s", args.salida)
+
+    codigo = 1 if any(e["error"] for e in escenarios) else 0
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(resultado, base, args.umbral)
+        for regresion in regresiones:
+            logger.warning("Regresión: %s", regresion)
+        if regresiones:
+            codigo = 1
+    sys.exit(codigo)
+
+
+if __name__ == "__main__":
+    configurar_logging(formato="texto")
+    main()
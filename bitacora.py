@@ -0,0 +1,153 @@
+"""
+Configuración de logging no bloqueante
+
+Los hilos que registran mensajes solo encolan el LogRecord; un hilo listener
+(QueueListener) los formatea y escribe en stdout, de modo que la extracción
+no espera la escritura ni paga el costo del formateo. La salida puede ser
+texto o JSON estructurado (una línea por mensaje con "severity", que Cloud
+Logging interpreta en Cloud Run).
+
+Los mensajes por registro (uno o más por folio) se emiten con loggers
+muestreados (por defecto "scraper.registros"): cada plantilla de mensaje
+se limita a una cantidad por segundo y el siguiente mensaje que pasa informa
+cuántos se omitieron.
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_manejador = None  # handler instalado en el logger raíz por configurar_logging
+
+
+class FormateadorJSON(logging.Formatter):
+    """
+    Una línea JSON por mensaje; los campos pasados en extra= se agregan tal cual
+    """
+
+    def format(self, record):
+        entrada = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_ESTANDAR and not clave.startswith("_"):
+                entrada[clave] = valor
+        if record.exc_info:
+            entrada["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entrada, ensure_ascii=False, default=str)
+
+
+class FormateadorTexto(logging.Formatter):
+    """
+    Formato de texto habitual, indicando los mensajes similares omitidos por el muestreo
+    """
+
+    def format(self, record):
+        texto = super().format(record)
+        omitidos = getattr(record, "omitidos", 0)
+        if omitidos:
+            texto += f" [{omitidos} mensajes similares omitidos]"
+        return texto
+
+
+class FiltroMuestreo(logging.Filter):
+    """
+    Limita los mensajes de los loggers indicados a por_segundo por plantilla de mensaje
+
+    Args:
+        loggers: Nombres de los loggers muestreados (y sus hijos)
+        por_segundo: Mensajes por segundo y plantilla (0 = sin límite)
+    """
+
+    def __init__(self, loggers, por_segundo):
+        super().__init__()
+        self.loggers = tuple(loggers)
+        self.prefijos = tuple(f"{nombre}." for nombre in self.loggers)
+        self.por_segundo = por_segundo
+        self._lock = threading.Lock()
+        self._ventanas = {}  # (logger, plantilla) -> [inicio, emitidos, omitidos]
+
+    def filter(self, record):
+        if self.por_segundo <= 0 or not (record.name in self.loggers or record.name.startswith(self.prefijos)):
+            return True
+        ahora = time.monotonic()
+        clave = (record.name, record.msg)
+        with self._lock:
+            ventana = self._ventanas.get(clave)
+            if ventana is None or ahora - ventana[0] >= 1.0:
+                if ventana is not None and ventana[2]:
+                    record.omitidos = ventana[2]
+                ventana = self._ventanas[clave] = [ahora, 0, 0]
+            if ventana[1] >= self.por_segundo:
+                ventana[2] += 1
+                return False
+            ventana[1] += 1
+        return True
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # La cola es del mismo proceso: el mensaje se formatea en el hilo del listener
+        return record
+
+
+def configurar_logging(nivel="INFO", formato="texto", loggers_muestreados=("scraper.registros",), por_segundo=5):
+    """
+    Agrega al logger raíz una cola atendida por un hilo listener. Se llama desde los
+    puntos de entrada (main.py, rcv_scrap, api_server, benchmark, trabajadores del
+    supervisor); al volver a llamarla solo se reemplaza el handler que instaló esta
+    función, sin tocar los que haya agregado la aplicación que importa el paquete.
+
+    Args:
+        nivel: Nivel del logger raíz
+        formato: "texto" o "json"
+        loggers_muestreados: Loggers de mensajes por registro
+        por_segundo: Mensajes por segundo y plantilla de los loggers muestreados
+    """
+    global _listener, _manejador
+    detener_logging()
+
+    salida = logging.StreamHandler(sys.stdout)
+    if formato == "json":
+        salida.setFormatter(FormateadorJSON())
+    else:
+        salida.setFormatter(FormateadorTexto("%(asctime)s [%(levelname)s] %(name)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+
+    cola = queue.SimpleQueue()
+    manejador = _ManejadorCola(cola)
+    manejador.addFilter(FiltroMuestreo(loggers_muestreados, por_segundo))
+
+    raiz = logging.getLogger()
+    if _manejador is not None:
+        raiz.removeHandler(_manejador)
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+    _manejador = manejador
+
+    _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+    _listener.start()
+
+
+def detener_logging():
+    """
+    Escribe los mensajes pendientes y detiene el hilo listener
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(detener_logging)
@@ -0,0 +1,420 @@
+"""
+Captura y reproducción de páginas del RCV para re-procesar sin navegador
+
+Con CAPTURA_HABILITADA, cada detalle de tipo extraído guarda en un archivo
+comprimido (DIRECTORIO_CAPTURAS/<rut>/<YYYY-MM>/<tipo>.json.gz) el HTML del
+detalle, las respuestas XHR recibidas mientras se extraía y el texto del
+detalle de cada folio; el resumen del período se guarda en resumen.json.gz.
+
+La reproducción reconstruye las tablas del HTML capturado en un DOM mínimo
+compatible con scraper.parsear_tabla, de modo que un cambio en el parseo o en
+el esquema se aplica a meses de historia sin volver a consultar el SII
+(ver extractor.reprocesar_capturas):
+
+    python capturas.py --rut 76123456-7 --desde 2025-01 --hasta 2025-06
+"""
+import os
+import re
+import gzip
+import argparse
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from html.parser import HTMLParser
+
+from config import CAPTURA_HABILITADA, DIRECTORIO_CAPTURAS, LOG_NIVEL, LOG_FORMATO, LOG_REGISTROS_POR_SEGUNDO
+from bitacora import configurar_logging
+from contribuyentes import normalizar_rut
+from periodos import formatear_periodo
+from metricas import contar
+
+logger = logging.getLogger("capturas")
+
+
+class _EstadoHilo(threading.local):
+    captura = None
+
+
+_local = _EstadoHilo()
+
+
+def ruta_captura(rut, mes, anio, nombre):
+    """
+    Ruta del archivo de captura de un período ("33" para un tipo, "resumen" para el resumen)
+    """
+    return os.path.join(DIRECTORIO_CAPTURAS, normalizar_rut(rut), formatear_periodo(mes, anio), f"{nombre}.json.gz")
+
+
+def _escribir(ruta, contenido):
+    """
+    Escribe un archivo comprimido de forma atómica
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.tmp"
+    with gzip.open(temporal, "wt", encoding="utf-8") as f:
+        json.dump(contenido, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _leer(ruta):
+    with gzip.open(ruta, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def existe_captura(rut, mes, anio, tipo):
+    return os.path.exists(ruta_captura(rut, mes, anio, tipo))
+
+
+def guardar_resumen_capturado(rut, mes, anio, resumen):
+    """
+    Guarda el resumen por tipo del período (sin efecto si la captura está deshabilitada)
+    """
+    if not CAPTURA_HABILITADA:
+        return
+    try:
+        _escribir(ruta_captura(rut, mes, anio, "resumen"), {
+            "rut": normalizar_rut(rut),
+            "periodo": formatear_periodo(mes, anio),
+            "fecha_captura": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "resumen": resumen,
+        })
+    except OSError as e:
+        logger.error("No se pudo guardar la captura del resumen: %s", str(e))
+
+
+def registrar_extraccion(rut, mes, anio, tipos, fecha_extraccion):
+    """
+    Anota en la captura del período la extracción que guardó en el almacén los tipos
+    capturados en esta ejecución (sin efecto si la captura está deshabilitada)
+    """
+    if not CAPTURA_HABILITADA or not tipos:
+        return
+    ruta = ruta_captura(rut, mes, anio, "extracciones")
+    try:
+        anteriores = leer_extracciones_capturadas(rut, mes, anio)
+        _escribir(ruta, {
+            "rut": normalizar_rut(rut),
+            "periodo": formatear_periodo(mes, anio),
+            "tipos": {**anteriores, **{str(tipo): fecha_extraccion for tipo in tipos}},
+        })
+    except (OSError, ValueError) as e:
+        logger.error("No se pudo registrar la extracción de las capturas: %s", str(e))
+
+
+def leer_extracciones_capturadas(rut, mes, anio):
+    """
+    Fecha de la extracción que guardó cada tipo capturado del período ({tipo: fecha_extraccion})
+    """
+    ruta = ruta_captura(rut, mes, anio, "extracciones")
+    if not os.path.exists(ruta):
+        return {}
+    return _leer(ruta).get("tipos") or {}
+
+
+def listar_capturas(rut=None, desde=None, hasta=None):
+    """
+    Períodos capturados
+
+    Returns:
+        list: [{"rut", "periodo", "tipos": [...]}] ordenados por RUT y período
+    """
+    if not os.path.isdir(DIRECTORIO_CAPTURAS):
+        return []
+    ruts = [normalizar_rut(rut)] if rut else sorted(os.listdir(DIRECTORIO_CAPTURAS))
+    capturas = []
+    for rut_captura in ruts:
+        directorio_rut = os.path.join(DIRECTORIO_CAPTURAS, rut_captura)
+        if not os.path.isdir(directorio_rut):
+            continue
+        for periodo in sorted(os.listdir(directorio_rut)):
+            if (desde and periodo < desde) or (hasta and periodo > hasta):
+                continue
+            tipos = sorted(
+                archivo[:-len(".json.gz")] for archivo in os.listdir(os.path.join(directorio_rut, periodo))
+                if archivo.endswith(".json.gz") and archivo not in ("resumen.json.gz", "extracciones.json.gz")
+            )
+            if tipos:
+                capturas.append({"rut": rut_captura, "periodo": periodo, "tipos": tipos})
+    return capturas
+
+
+class Captura:
+    """
+    Material crudo del detalle de un tipo de documento en un período
+    """
+
+    def __init__(self, rut, mes, anio, tipo):
+        self.rut = normalizar_rut(rut)
+        self.mes = mes
+        self.anio = anio
+        self.tipo = tipo
+        self.html = None
+        self.xhr = []
+        self.folios = {}
+        self._respuestas = []
+        self.page = None  # página cuyas respuestas se registran
+
+    def registrar_respuesta(self, respuesta):
+        if respuesta.request.resource_type in ("xhr", "fetch"):
+            self._respuestas.append(respuesta)
+
+    def escuchar(self, page):
+        """
+        Registra las respuestas XHR de page (tras soltar, ej: contexto reciclado a mitad del tipo)
+        """
+        page.on("response", self.registrar_respuesta)
+        self.page = page
+
+    def soltar(self):
+        """
+        Deja de escuchar la página actual y lee sus respuestas pendientes (antes de cerrar su contexto)
+        """
+        if self.page is None:
+            return
+        self.page.remove_listener("response", self.registrar_respuesta)
+        self.page = None
+        self._leer_respuestas()
+
+    def _leer_respuestas(self):
+        for respuesta in self._respuestas:
+            try:
+                cuerpo = respuesta.text()
+            except Exception as e:
+                logger.debug("Cuerpo no disponible para %s: %s", respuesta.url, str(e))
+                cuerpo = None
+            self.xhr.append({"url": respuesta.url, "estado": respuesta.status, "cuerpo": cuerpo})
+        self._respuestas = []
+
+    def guardar(self):
+        self._leer_respuestas()
+        ruta = ruta_captura(self.rut, self.mes, self.anio, self.tipo)
+        _escribir(ruta, {
+            "rut": self.rut,
+            "periodo": formatear_periodo(self.mes, self.anio),
+            "tipo": self.tipo,
+            "fecha_captura": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "html": self.html,
+            "xhr": self.xhr,
+            "folios": self.folios,
+        })
+        contar("rcv_capturas_total", ayuda="Detalles de tipo capturados para reproducción")
+        logger.info(
+            "Captura del tipo %s guardada en %s (%d XHR, %d folios)",
+            self.tipo, ruta, len(self.xhr), len(self.folios)
+        )
+        return ruta
+
+
+@contextmanager
+def capturar_tipo(page, rut, mes, anio, tipo):
+    """
+    Captura el detalle de un tipo mientras se extrae (sin efecto si la captura está deshabilitada)
+
+    Ejemplo:
+        with capturar_tipo(page, rut, mes, anio, "33") as captura:
+            navegar_a_detalle_tipo(page, "33")
+            if captura:
+                captura.html = page.content()
+            datos = extraer_datos_tablas(page)
+    """
+    if not CAPTURA_HABILITADA:
+        yield None
+        return
+
+    captura = Captura(rut, mes, anio, tipo)
+    anterior = _local.captura
+    _local.captura = captura
+    captura.escuchar(page)
+    try:
+        yield captura
+    finally:
+        captura.soltar()
+        _local.captura = anterior
+    try:
+        captura.guardar()
+    except Exception as e:
+        logger.error("No se pudo guardar la captura del tipo %s: %s", tipo, str(e))
+
+
+def captura_actual():
+    """
+    Captura activa del hilo (o None)
+    """
+    return _local.captura
+
+
+def capturar_folio(folio, texto_detalle):
+    """
+    Guarda el texto del detalle de un folio en la captura activa del hilo
+    """
+    captura = _local.captura
+    if captura is not None:
+        captura.folios[str(folio)] = texto_detalle
+
+
+_ELEMENTOS_VACIOS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"
+}
+_SIN_TEXTO = {"script", "style", "template", "head"}
+_CELDAS = {"td", "th"}
+
+
+class Nodo:
+    """
+    Elemento de un DOM mínimo con la interfaz que usa scraper.parsear_tabla
+    (query_selector_all con selectores de etiqueta e inner_text)
+    """
+
+    __slots__ = ("etiqueta", "hijos", "padre")
+
+    def __init__(self, etiqueta, padre=None):
+        self.etiqueta = etiqueta
+        self.hijos = []
+        self.padre = padre
+
+    def _descendientes(self):
+        for hijo in self.hijos:
+            if isinstance(hijo, Nodo):
+                yield hijo
+                yield from hijo._descendientes()
+
+    def query_selector_all(self, selector):
+        etiquetas = {parte.strip().lower() for parte in selector.split(",")}
+        if not all(re.fullmatch(r"[a-z][a-z0-9]*", e) for e in etiquetas):
+            raise ValueError(f"Selector no soportado en reproducción: '{selector}'")
+        return [nodo for nodo in self._descendientes() if nodo.etiqueta in etiquetas]
+
+    def _texto(self, partes):
+        for hijo in self.hijos:
+            if isinstance(hijo, Nodo):
+                if hijo.etiqueta == "br":
+                    partes.append("\n")
+                elif hijo.etiqueta not in _SIN_TEXTO:
+                    hijo._texto(partes)
+            else:
+                partes.append(hijo)
+
+    def inner_text(self):
+        partes = []
+        self._texto(partes)
+        lineas = "".join(partes).split("\n")
+        return "\n".join(" ".join(linea.split()) for linea in lineas).strip()
+
+
+class _ConstructorDOM(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.raiz = Nodo("#documento")
+        self._actual = self.raiz
+
+    def _cerrar_hasta(self, etiquetas, limite=("table",)):
+        """
+        Cierra implícitamente el elemento abierto más cercano de etiquetas (sin salir de limite)
+        """
+        nodo = self._actual
+        while nodo is not self.raiz and nodo.etiqueta not in limite:
+            if nodo.etiqueta in etiquetas:
+                self._actual = nodo.padre
+                return
+            nodo = nodo.padre
+
+    def handle_starttag(self, etiqueta, atributos):
+        if etiqueta in _CELDAS:
+            self._cerrar_hasta(_CELDAS)
+        elif etiqueta == "tr":
+            self._cerrar_hasta({"tr"})
+        nodo = Nodo(etiqueta, self._actual)
+        self._actual.hijos.append(nodo)
+        if etiqueta not in _ELEMENTOS_VACIOS:
+            self._actual = nodo
+
+    def handle_startendtag(self, etiqueta, atributos):
+        self._actual.hijos.append(Nodo(etiqueta, self._actual))
+
+    def handle_endtag(self, etiqueta):
+        nodo = self._actual
+        while nodo is not self.raiz:
+            if nodo.etiqueta == etiqueta:
+                self._actual = nodo.padre
+                return
+            nodo = nodo.padre
+
+    def handle_data(self, datos):
+        self._actual.hijos.append(datos)
+
+
+def construir_dom(html):
+    """
+    Construye el DOM mínimo de un documento HTML
+    """
+    constructor = _ConstructorDOM()
+    constructor.feed(html or "")
+    constructor.close()
+    return constructor.raiz
+
+
+def reproducir_tipo(rut, mes, anio, tipo, metadatos=None):
+    """
+    Re-parsea el detalle capturado de un tipo con la lógica actual del scraper
+
+    Args:
+        metadatos: Diccionario opcional donde se deja la fecha_captura más antigua de los
+            tipos reproducidos
+
+    Returns:
+        list: Registros del tipo (con razón social desde el detalle capturado de cada folio)
+    """
+    from scraper import parsear_tabla, razon_social_desde_texto
+
+    captura = _leer(ruta_captura(rut, mes, anio, tipo))
+    if metadatos is not None and captura.get("fecha_captura"):
+        anterior = metadatos.get("fecha_captura")
+        metadatos["fecha_captura"] = min(anterior, captura["fecha_captura"]) if anterior else captura["fecha_captura"]
+    folios = captura.get("folios") or {}
+    datos = []
+    for tabla in construir_dom(captura.get("html")).query_selector_all("table"):
+        for registro in parsear_tabla(tabla):
+            folio = registro.get("Folio")
+            if folio and folios.get(str(folio)):
+                razon_social = razon_social_desde_texto(folios[str(folio)])
+                if razon_social:
+                    registro["Razon Social Emisor"] = razon_social
+            datos.append(registro)
+    return datos
+
+
+def leer_resumen_capturado(rut, mes, anio):
+    """
+    Resumen por tipo capturado del período ([] si no se capturó)
+    """
+    ruta = ruta_captura(rut, mes, anio, "resumen")
+    if not os.path.exists(ruta):
+        return []
+    return _leer(ruta).get("resumen") or []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-procesa las capturas del RCV sin navegador")
+    parser.add_argument("--rut", help="RUT del contribuyente (por defecto todos los capturados)")
+    parser.add_argument("--desde", help="Período inicial YYYY-MM")
+    parser.add_argument("--hasta", help="Período final YYYY-MM")
+    parser.add_argument("--sin-exportar", action="store_true", help="No escribir los archivos de salida")
+    parser.add_argument(
+        "--guardar", action="store_true",
+        help="Actualizar el almacén histórico con la fecha de la captura (sin eliminar registros)"
+    )
+    args = parser.parse_args()
+
+    from extractor import reprocesar_capturas
+    resultado = reprocesar_capturas(
+        args.rut, args.desde, args.hasta, exportar=not args.sin_exportar, guardar=args.guardar
+    )
+    if resultado is None:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    configurar_logging(LOG_NIVEL, LOG_FORMATO, por_segundo=LOG_REGISTROS_POR_SEGUNDO)
+    main()
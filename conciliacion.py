@@ -0,0 +1,151 @@
+"""
+Conciliación entre el resumen del RCV y el detalle extraído
+
+La pantalla de resumen informa, por tipo de documento, la cantidad de
+documentos y los montos totales. Comparar esos valores con el detalle
+extraído permite detectar extracciones truncadas o incompletas, y comparar
+el resumen actual con la instantánea guardada permite omitir el detalle de
+los tipos que no cambiaron desde la última extracción conciliada.
+"""
+import logging
+
+from metricas import contar
+
+logger = logging.getLogger("conciliacion")
+
+
+def _entero(valor):
+    """
+    Convierte un monto del detalle ("1.234.567", 1234567) a entero, o None
+    """
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, int):
+        return valor
+    try:
+        return int(str(valor).strip().replace(".", "").replace("$", "").replace(" ", ""))
+    except ValueError:
+        return None
+
+
+def _columna_detalle(encabezado, columnas):
+    """
+    Columna del detalle que corresponde a un monto del resumen
+    (ej: "IVA Recuperable" -> "Monto IVA Recuperable")
+    """
+    if encabezado in columnas:
+        return encabezado
+    nombre = encabezado.upper()
+    for columna in columnas:
+        if nombre in columna.upper():
+            return columna
+    return None
+
+
+def conciliar_tipo(fila_resumen, registros):
+    """
+    Compara la fila de resumen de un tipo con sus registros de detalle
+
+    Args:
+        fila_resumen: Dict de scraper.obtener_resumen_tipos (tipo, documentos, montos)
+        registros: Registros extraídos de ese tipo
+
+    Returns:
+        dict: tipo, estado ("ok", "diferencia" o "sin_resumen"), conteos, montos y diferencias
+    """
+    documentos_detalle = len(registros)
+    columnas = list(dict.fromkeys(columna for registro in registros for columna in registro))
+    resultado = {
+        "tipo": fila_resumen["tipo"],
+        "estado": "ok",
+        "documentos_resumen": fila_resumen.get("documentos"),
+        "documentos_detalle": documentos_detalle,
+        "montos_resumen": dict(fila_resumen.get("montos") or {}),
+        "montos_detalle": {},
+        "diferencias": [],
+    }
+
+    if resultado["documentos_resumen"] is None:
+        resultado["estado"] = "sin_resumen"
+        return resultado
+
+    if documentos_detalle != resultado["documentos_resumen"]:
+        faltantes = resultado["documentos_resumen"] - documentos_detalle
+        detalle = f"faltan {faltantes} (posible extracción truncada)" if faltantes > 0 else f"sobran {-faltantes}"
+        resultado["diferencias"].append(
+            f"documentos: resumen {resultado['documentos_resumen']}, detalle {documentos_detalle}, {detalle}"
+        )
+
+    for encabezado, monto_resumen in resultado["montos_resumen"].items():
+        columna = _columna_detalle(encabezado, columnas)
+        if columna is None:
+            continue
+        total = sum(_entero(registro.get(columna)) or 0 for registro in registros)
+        resultado["montos_detalle"][encabezado] = total
+        if total != monto_resumen:
+            resultado["diferencias"].append(f"{encabezado}: resumen {monto_resumen}, detalle {total}")
+
+    if resultado["diferencias"]:
+        resultado["estado"] = "diferencia"
+    return resultado
+
+
+def conciliar(resumen_sii, registros, tipos_documento=None):
+    """
+    Concilia el resumen del SII con el detalle de todos los tipos procesados
+
+    Args:
+        resumen_sii: Lista de filas de resumen por tipo
+        registros: Registros del período (con la columna "Tipo Documento")
+        tipos_documento: Tipos a conciliar (por defecto todos los del resumen)
+
+    Returns:
+        dict: {"tipos": [...], "conciliados": n, "con_diferencias": [tipos], "sin_resumen": [tipos]}
+    """
+    por_tipo = {}
+    for registro in registros:
+        por_tipo.setdefault(str(registro.get("Tipo Documento", "")), []).append(registro)
+
+    tipos = []
+    for fila in resumen_sii or []:
+        if tipos_documento is not None and fila["tipo"] not in tipos_documento:
+            continue
+        resultado = conciliar_tipo(fila, por_tipo.get(fila["tipo"], []))
+        tipos.append(resultado)
+        contar("rcv_conciliacion_total", ayuda="Tipos conciliados contra el resumen del SII", estado=resultado["estado"])
+        if resultado["estado"] == "diferencia":
+            logger.warning("Tipo %s no cuadra con el resumen: %s", fila["tipo"], "; ".join(resultado["diferencias"]))
+
+    return {
+        "tipos": tipos,
+        "conciliados": sum(1 for t in tipos if t["estado"] == "ok"),
+        "con_diferencias": [t["tipo"] for t in tipos if t["estado"] == "diferencia"],
+        "sin_resumen": [t["tipo"] for t in tipos if t["estado"] == "sin_resumen"],
+    }
+
+
+def tipos_sin_cambios(resumen_sii, instantanea, tipos_documento):
+    """
+    Tipos cuyo resumen actual es idéntico al de la última extracción conciliada
+
+    Args:
+        resumen_sii: Resumen actual por tipo
+        instantanea: Dict {tipo: {"documentos", "montos", "conciliado"}} del almacén
+        tipos_documento: Tipos que se van a procesar
+
+    Returns:
+        list: Tipos cuyo detalle puede tomarse del almacén sin volver a extraerlo
+    """
+    sin_cambios = []
+    for fila in resumen_sii or []:
+        anterior = (instantanea or {}).get(fila["tipo"])
+        if (
+            fila["tipo"] in tipos_documento
+            and anterior is not None
+            and anterior["conciliado"]
+            and fila["documentos"] is not None
+            and anterior["documentos"] == fila["documentos"]
+            and anterior["montos"] == fila["montos"]
+        ):
+            sin_cambios.append(fila["tipo"])
+    return sin_cambios
@@ -2,43 +2,104 @@
 Configuración y constantes del sistema RCV Scrap
 """
 import os
-import sys
 import logging
 from dotenv import load_dotenv
 
-# Configurar logging a nivel de módulo para que funcione tanto con main() como con uvicorn directo
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Cargar variables de entorno
+load_dotenv()
+
+# Logging no bloqueante (cola + hilo listener): lo instalan los puntos de entrada con
+# bitacora.configurar_logging, de modo que importar estos módulos no toca los handlers de quien
+# los importa. Formato "json" (estructurado, para Cloud Run) o "texto"; los mensajes por folio
+# se limitan a LOG_REGISTROS_POR_SEGUNDO por plantilla de mensaje
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "texto" if os.getenv("AMBIENTE", "PROD") == "DEV" else "json")
+LOG_REGISTROS_POR_SEGUNDO = int(os.getenv("LOG_REGISTROS_POR_SEGUNDO", "5"))
 logging.getLogger("playwright").setLevel(logging.WARNING)
 logging.getLogger("uvicorn").setLevel(logging.WARNING)
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 
 logger = logging.getLogger("config")
 
-# Cargar variables de entorno
-load_dotenv()
-
 # Credenciales
 RUT = os.getenv("SII_RUT")
 CLAVE = os.getenv("SII_CLAVE")
 AMBIENTE = os.getenv("AMBIENTE", "PROD")
 
-# URLs
-URL_LOGIN_SII = "https://misii.sii.cl/cgi_misii/siihome.cgi"
-URL_RCV = "https://www4.sii.cl/consdcvinternetui"
+# URLs (sobrescribibles para apuntar al portal simulado de portal_simulado.py)
+URL_LOGIN_SII = os.getenv("SII_URL_LOGIN", "https://misii.sii.cl/cgi_misii/siihome.cgi")
+URL_RCV = os.getenv("SII_URL_RCV", "https://www4.sii.cl/consdcvinternetui")
 
 # Configuración de timeouts (en milisegundos)
 DEFAULT_TIMEOUT = 30000
-SLEEP_SHORT = 0.5
-SLEEP_MEDIUM = 1
-SLEEP_LONG = 2
-SLEEP_EXTRA_LONG = 5
+
+# Esperas fijas entre acciones (segundos). ESCALA_ESPERAS permite acortarlas en benchmarks
+ESCALA_ESPERAS = float(os.getenv("ESCALA_ESPERAS", "1"))
+SLEEP_SHORT = 0.5 * ESCALA_ESPERAS
+SLEEP_MEDIUM = 1 * ESCALA_ESPERAS
+SLEEP_LONG = 2 * ESCALA_ESPERAS
+SLEEP_EXTRA_LONG = 5 * ESCALA_ESPERAS
+
+# Registro de contribuyentes adicionales (JSON con rut/clave/nombre) y caché de sesiones
+ARCHIVO_CONTRIBUYENTES = os.getenv("ARCHIVO_CONTRIBUYENTES", "contribuyentes.json")
+SESION_TTL = int(os.getenv("SESION_TTL", "1200"))  # segundos
+
+# Planificador de extracciones: hilos trabajadores, unidades simultáneas por contribuyente
+# y cantidad de períodos por unidad de trabajo (los rangos se dividen en unidades)
+TRABAJADORES_EXTRACCION = int(os.getenv("TRABAJADORES_EXTRACCION", "2"))
+MAX_UNIDADES_POR_CONTRIBUYENTE = int(os.getenv("MAX_UNIDADES_POR_CONTRIBUYENTE", "1"))
+PERIODOS_POR_UNIDAD = int(os.getenv("PERIODOS_POR_UNIDAD", "3"))
+# Procesos trabajadores de la CLI por lotes (0 = hilos en un solo proceso, ver supervisor.py)
+PROCESOS_EXTRACCION = int(os.getenv("PROCESOS_EXTRACCION", "0"))
+# Tope de procesos trabajadores del supervisor (por defecto, los núcleos de la máquina)
+PROCESOS_MAXIMOS = int(os.getenv("PROCESOS_MAXIMOS", str(os.cpu_count() or 1)))
+
+# Máximo de contextos de navegador en paralelo para extracciones por rango de períodos
+MAX_CONTEXTOS_NAVEGADOR = int(os.getenv("MAX_CONTEXTOS_NAVEGADOR", "4"))
+
+# Perfil de lanzamiento de Chromium (estandar, liviano, minimo; ver navegador.py) y flags adicionales
+NAVEGADOR_PERFIL = os.getenv("NAVEGADOR_PERFIL", "estandar")
+NAVEGADOR_ARGS_EXTRA = [a.strip() for a in os.getenv("NAVEGADOR_ARGS_EXTRA", "").split(",") if a.strip()]
+# Presupuesto por contexto, muestreado por CDP: al superarlo el contexto se recicla (0 = sin límite)
+NAVEGADOR_HEAP_MB = float(os.getenv("NAVEGADOR_HEAP_MB", "384"))
+NAVEGADOR_NODOS = int(os.getenv("NAVEGADOR_NODOS", "0"))
+NAVEGADOR_CPU_PORCENTAJE = float(os.getenv("NAVEGADOR_CPU_PORCENTAJE", "0"))
+NAVEGADOR_INTERVALO_MUESTREO = float(os.getenv("NAVEGADOR_INTERVALO_MUESTREO", "5"))
+
+# Limitador adaptativo de solicitudes al SII (token bucket + concurrencia AIMD)
+LIMITE_TASA_INICIAL = float(os.getenv("LIMITE_TASA_INICIAL", "2"))  # solicitudes/segundo
+LIMITE_TASA_MINIMA = float(os.getenv("LIMITE_TASA_MINIMA", "0.2"))
+LIMITE_TASA_MAXIMA = float(os.getenv("LIMITE_TASA_MAXIMA", "10"))
+LIMITE_CONCURRENCIA_INICIAL = int(os.getenv("LIMITE_CONCURRENCIA_INICIAL", "2"))
+LIMITE_CONCURRENCIA_MAXIMA = int(os.getenv("LIMITE_CONCURRENCIA_MAXIMA", "8"))
+LATENCIA_OBJETIVO = float(os.getenv("LATENCIA_OBJETIVO", "10"))  # segundos
+
+# Omitir el detalle de los tipos cuyo resumen (documentos y montos) no cambió desde la
+# última extracción conciliada; sus registros se toman del almacén histórico
+OMITIR_TIPOS_SIN_CAMBIOS = os.getenv("OMITIR_TIPOS_SIN_CAMBIOS", "true").lower() in ("1", "true", "si")
+
+# Ranking aprendido de selectores alternativos (se persiste entre ejecuciones)
+ARCHIVO_SELECTORES = os.getenv("ARCHIVO_SELECTORES", "selectores_aprendidos.json")
+
+# Trazas por trabajo en formato Chrome Trace (también activables por solicitud con "trazar")
+TRAZAS_HABILITADAS = os.getenv("TRAZAS_HABILITADAS", "false").lower() in ("1", "true", "si")
+DIRECTORIO_TRAZAS = os.getenv("DIRECTORIO_TRAZAS", "trazas")
+# Archivos de traza que se conservan en DIRECTORIO_TRAZAS (se eliminan los más antiguos)
+TRAZAS_MAXIMAS = int(os.getenv("TRAZAS_MAXIMAS", "100"))
+
+# Progreso en vivo (GET /progreso/{id}): eventos conservados por trabajo e intervalo mínimo
+# entre eventos de avance de filas/folios
+PROGRESO_MAX_EVENTOS = int(os.getenv("PROGRESO_MAX_EVENTOS", "1000"))
+PROGRESO_INTERVALO = float(os.getenv("PROGRESO_INTERVALO", "0.5"))
+
+# Captura del HTML de detalle, XHR y folios por tipo y período para re-procesar sin navegador
+# (python capturas.py --reprocesar)
+CAPTURA_HABILITADA = os.getenv("CAPTURA_HABILITADA", "false").lower() in ("1", "true", "si")
+DIRECTORIO_CAPTURAS = os.getenv("DIRECTORIO_CAPTURAS", "capturas")
+
+# Precargar extractor (pandas, Playwright) en segundo plano al iniciar la API, en lugar de
+# esperar a la primera extracción. El servidor responde /health antes de que termine.
+PRECARGA_MODULOS = os.getenv("PRECARGA_MODULOS", "true").lower() in ("1", "true", "si")
 
 # Tipos de documento SII
 TIPOS_DOCUMENTO = {
@@ -56,12 +117,52 @@ TIPOS_DOCUMENTO = {
     "112": "Nota de Crédito de Exportación Electrónica"
 }
 
+# Tipos que restan en los totales netos del período (GET /resumen)
+TIPOS_NOTA_CREDITO = {"61", "112"}
+
 # Tipo de documento por defecto
 TIPO_DOCUMENTO_FACTURA = "33"
 
+# Política de resolución de duplicados: "primero", "ultimo" o "mas_completo"
+POLITICAS_DEDUPLICACION = ("primero", "ultimo", "mas_completo")
+POLITICA_DEDUPLICACION = os.getenv("POLITICA_DEDUPLICACION", "primero")
+if POLITICA_DEDUPLICACION not in POLITICAS_DEDUPLICACION:
+    raise ValueError(
+        f"POLITICA_DEDUPLICACION inválida: {POLITICA_DEDUPLICACION}. "
+        f"Opciones: {', '.join(POLITICAS_DEDUPLICACION)}"
+    )
+
+# Registros por lote al normalizar, exportar y guardar en el almacén: el pico de memoria
+# de esas etapas depende del tamaño del lote y no de la cantidad de registros del período
+LOTE_REGISTROS = int(os.getenv("LOTE_REGISTROS", "5000"))
+
+# Intervalo (segundos) de muestreo de la memoria residente del proceso durante cada trabajo
+INTERVALO_MEMORIA = float(os.getenv("INTERVALO_MEMORIA", "0.5"))
+
 # Archivos de salida
 ARCHIVO_JSON = "datos_rcv.json"
 ARCHIVO_EXCEL = "datos_rcv.xlsx"
+ARCHIVO_PARQUET = "datos_rcv.parquet"
+ARCHIVO_CSV = "datos_rcv.csv"
+
+# Versiones publicadas de los archivos de salida (DIRECTORIO_SALIDAS/<hash del contenido>/),
+# reemplazadas con rename atómico; cada contribuyente y cada trabajo de la API tiene su propio
+# puntero y conserva sus SALIDAS_VERSIONES más recientes (mínimo 2)
+DIRECTORIO_SALIDAS = os.getenv("DIRECTORIO_SALIDAS", "salidas")
+SALIDAS_VERSIONES = max(2, int(os.getenv("SALIDAS_VERSIONES", "5")))
+# Trabajos de la API cuyas salidas se pueden descargar por id (GET /descargar/*?id=...)
+SALIDAS_TRABAJOS = int(os.getenv("SALIDAS_TRABAJOS", "100"))
+
+# Base de datos histórica (SQLite) con todas las extracciones por período
+ARCHIVO_DB = os.getenv("RCV_DB", "rcv_historico.db")
+
+# Antigüedad máxima (minutos) de una extracción guardada para responder desde el almacén sin
+# volver al SII (0 para desactivar). "forzar" en POST /extraer ignora el almacén.
+VIGENCIA_EXTRACCION_MINUTOS = int(os.getenv("VIGENCIA_EXTRACCION_MINUTOS", "360"))
+
+# Extracciones programadas (pre-calentamiento): reglas tipo cron por contribuyente y período
+# en SII_PROGRAMACION (JSON) o en el archivo ARCHIVO_PROGRAMACION
+ARCHIVO_PROGRAMACION = os.getenv("ARCHIVO_PROGRAMACION", "programacion.json")
 
 def validar_configuracion():
     """
@@ -0,0 +1,153 @@
+"""
+Registro de contribuyentes (multi-empresa) y caché de sesiones del SII
+
+Las credenciales se leen de:
+- SII_RUT / SII_CLAVE: contribuyente por defecto
+- SII_CONTRIBUYENTES: JSON con una lista [{"rut": ..., "clave": ..., "nombre": ...}]
+- ARCHIVO_CONTRIBUYENTES: archivo JSON con el mismo formato
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from config import RUT, CLAVE, ARCHIVO_CONTRIBUYENTES, SESION_TTL
+
+logger = logging.getLogger("contribuyentes")
+
+_lock = threading.Lock()
+_registro = None
+_sesiones = {}
+
+
+def normalizar_rut(rut):
+    """
+    Deja un RUT sin puntos ni espacios y con guión antes del dígito verificador
+    """
+    if not rut:
+        return ""
+    limpio = str(rut).replace(".", "").replace("-", "").replace(" ", "").upper()
+    if len(limpio) < 2:
+        return limpio
+    return f"{limpio[:-1]}-{limpio[-1]}"
+
+
+def _cargar_registro():
+    """
+    Carga los contribuyentes configurados (variables de entorno y archivo)
+    """
+    registro = {}
+    fuentes = []
+
+    if os.getenv("SII_CONTRIBUYENTES"):
+        try:
+            fuentes.extend(json.loads(os.getenv("SII_CONTRIBUYENTES")))
+        except ValueError as e:
+            logger.error("SII_CONTRIBUYENTES no es un JSON válido: %s", str(e))
+
+    if ARCHIVO_CONTRIBUYENTES and os.path.exists(ARCHIVO_CONTRIBUYENTES):
+        try:
+            with open(ARCHIVO_CONTRIBUYENTES, "r", encoding="utf-8") as f:
+                fuentes.extend(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error("Error al leer %s: %s", ARCHIVO_CONTRIBUYENTES, str(e))
+
+    for entrada in fuentes:
+        rut = normalizar_rut(entrada.get("rut"))
+        if rut and entrada.get("clave"):
+            registro[rut] = {"rut": rut, "clave": entrada["clave"], "nombre": entrada.get("nombre")}
+
+    # El contribuyente de SII_RUT/SII_CLAVE se registra siempre (y es el por defecto)
+    if RUT and CLAVE:
+        rut = normalizar_rut(RUT)
+        registro.setdefault(rut, {"rut": rut, "clave": CLAVE, "nombre": None})
+
+    logger.info("Registro de contribuyentes cargado: %d RUTs", len(registro))
+    return registro
+
+
+def _obtener_registro():
+    global _registro
+    with _lock:
+        if _registro is None:
+            _registro = _cargar_registro()
+        return _registro
+
+
+def rut_por_defecto():
+    """
+    RUT usado cuando una solicitud no especifica contribuyente
+    """
+    if RUT:
+        return normalizar_rut(RUT)
+    registro = _obtener_registro()
+    return next(iter(registro), None)
+
+
+def obtener_credenciales(rut=None):
+    """
+    Obtiene las credenciales de un contribuyente registrado
+
+    Args:
+        rut: RUT del contribuyente, None para el contribuyente por defecto
+
+    Returns:
+        tuple: (rut normalizado, clave)
+
+    Raises:
+        ValueError: Si el RUT no está registrado o no hay credenciales configuradas
+    """
+    rut = normalizar_rut(rut) if rut else rut_por_defecto()
+    if not rut:
+        logger.error("ERROR DE CONFIGURACIÓN: no hay contribuyentes registrados.")
+        raise ValueError("Debe definir SII_RUT/SII_CLAVE o SII_CONTRIBUYENTES en el archivo .env")
+
+    entrada = _obtener_registro().get(rut)
+    if not entrada:
+        raise ValueError(f"El RUT {rut} no está registrado como contribuyente")
+    return entrada["rut"], entrada["clave"]
+
+
+def listar_contribuyentes():
+    """
+    Lista los contribuyentes registrados (sin claves)
+    """
+    return [
+        {"rut": e["rut"], "nombre": e["nombre"]}
+        for e in _obtener_registro().values()
+    ]
+
+
+def obtener_sesion(rut):
+    """
+    Devuelve el estado de sesión (cookies) cacheado de un contribuyente si sigue vigente
+    """
+    rut = normalizar_rut(rut)
+    with _lock:
+        entrada = _sesiones.get(rut)
+        if not entrada:
+            return None
+        if time.monotonic() - entrada["creada"] > SESION_TTL:
+            logger.debug("Sesión cacheada de %s*** expirada", rut[:7])
+            del _sesiones[rut]
+            return None
+        return entrada["estado"]
+
+
+def guardar_sesion(rut, estado_sesion):
+    """
+    Cachea el estado de sesión (storage_state de Playwright) de un contribuyente
+    """
+    rut = normalizar_rut(rut)
+    with _lock:
+        _sesiones[rut] = {"estado": estado_sesion, "creada": time.monotonic()}
+    logger.debug("Sesión de %s*** guardada en caché", rut[:7])
+
+
+def invalidar_sesion(rut):
+    """
+    Elimina la sesión cacheada de un contribuyente
+    """
+    with _lock:
+        _sesiones.pop(normalizar_rut(rut), None)
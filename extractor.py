@@ -1,195 +1,1015 @@
 """
 Módulo de extracción y orquestación del scraping
 """
+import os
 import time
 import logging
-import pandas as pd
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from playwright.sync_api import sync_playwright
 
 from config import (
-    RUT, CLAVE, AMBIENTE,
-    ARCHIVO_JSON, ARCHIVO_EXCEL, DEFAULT_TIMEOUT,
-    validar_configuracion
+    AMBIENTE, TIPOS_DOCUMENTO,
+    ARCHIVO_JSON, ARCHIVO_EXCEL, ARCHIVO_PARQUET, ARCHIVO_CSV, DEFAULT_TIMEOUT,
+    POLITICA_DEDUPLICACION, MAX_CONTEXTOS_NAVEGADOR, OMITIR_TIPOS_SIN_CAMBIOS, CAPTURA_HABILITADA
 )
 from scraper import (
-    login_sii, navegar_a_rcv, obtener_tipos_documento_disponibles, 
-    navegar_a_detalle_tipo, extraer_datos_tablas, volver_a_resumen
+    login_sii, navegar_a_rcv, seleccionar_periodo, obtener_resumen_tipos,
+    navegar_a_detalle_tipo, extraer_datos_tablas, volver_a_resumen, PeriodoNoSeleccionado
+)
+from procesador import (
+    eliminar_duplicados, lotes_tipados, columnas_de, calcular_agregados, sumar_agregados, RegistrosPorPeriodo
+)
+from almacen import (
+    guardar_extraccion, guardar_resumen, guardar_agregados, obtener_resumen, obtener_registros, periodo_vigente, version_actual,
+    ultima_extraccion
+)
+from conciliacion import conciliar, tipos_sin_cambios
+from capturas import (
+    capturar_tipo, captura_actual, guardar_resumen_capturado, existe_captura, listar_capturas,
+    reproducir_tipo, leer_resumen_capturado, registrar_extraccion, leer_extracciones_capturadas
+)
+from periodos import validar_periodo, periodos_en_rango, formatear_periodo, parsear_periodo
+from contribuyentes import obtener_credenciales, obtener_sesion, guardar_sesion, invalidar_sesion
+from metricas import medir, contar, resumen_actual, usar_resumen
+from trazas import traza_actual, usar_traza
+from progreso import progreso_actual, usar_progreso, reportar, sumar, emitir
+from salidas import clave_contenido, publicar, ambito_rut, ambito_trabajo
+from navegador import MonitorContexto, argumentos_lanzamiento, perfil_actual
+from guardador import (
+    guardar_datos_json, guardar_registros_excel, guardar_lotes
 )
-from procesador import eliminar_duplicados
-from guardador import guardar_datos_json, guardar_datos_excel
 
 logger = logging.getLogger("extractor")
 
 
-def ejecutar_scraping(mes=None, anio=None, tipos_documento=None):
+def _lanzar_navegador(p):
+    headless = AMBIENTE != "DEV"
+    logger.info("Iniciando navegador Chromium (headless=%s, perfil=%s)...", headless, perfil_actual())
+    return p.chromium.launch(headless=headless, args=argumentos_lanzamiento())
+
+
+# Navegador que conserva cada hilo del planificador entre unidades de trabajo
+_hilo = threading.local()
+
+
+@contextmanager
+def _navegador(conservar=False):
+    """
+    Navegador para una extracción. Con conservar=True el hilo lo lanza una sola vez y lo
+    reutiliza en las unidades siguientes (cada contribuyente sigue en su propio contexto)
+    hasta cerrar_navegador_del_hilo(); si no, se lanza y se cierra en cada uso.
+    """
+    if not conservar:
+        with sync_playwright() as p:
+            browser = _lanzar_navegador(p)
+            try:
+                yield browser
+            finally:
+                browser.close()
+        return
+
+    abierto = getattr(_hilo, "navegador", None)
+    if abierto is None or not abierto[1].is_connected():
+        cerrar_navegador_del_hilo()
+        _hilo.navegador = abrir_navegador()
+    yield _hilo.navegador[1]
+
+
+def cerrar_navegador_del_hilo():
+    """
+    Cierra el navegador conservado por el hilo actual, si lo hay (ej: al vaciarse la cola del planificador)
+    """
+    abierto = getattr(_hilo, "navegador", None)
+    _hilo.navegador = None
+    if abierto is None:
+        return
+    p, browser = abierto
+    try:
+        browser.close()
+    except Exception as e:
+        logger.debug("Error al cerrar el navegador del hilo: %s", str(e))
+    try:
+        p.stop()
+    except Exception as e:
+        logger.debug("Error al detener Playwright: %s", str(e))
+
+
+def _nueva_pagina(contexto):
+    page = contexto.new_page()
+    page.set_default_timeout(DEFAULT_TIMEOUT)
+    logger.debug("Página creada con timeout de %d ms", DEFAULT_TIMEOUT)
+    return page
+
+
+def _login(page, rut, clave):
+    logger.info("Iniciando proceso de login en SII...")
+    reportar(fase="login")
+    with medir("login"):
+        login_exitoso = login_sii(page, rut, clave)
+    if not login_exitoso:
+        logger.error("Login fallido: credenciales incorrectas")
+        raise Exception("Credenciales incorrectas. Verifica tu RUT y contraseña.")
+
+
+def _abrir_sesion(browser, rut, clave):
+    """
+    Abre un contexto de navegador aislado para el contribuyente, reutilizando
+    su sesión cacheada si existe o iniciando sesión y cacheándola si no
+
+    Returns:
+        tuple: (contexto, página, bool indicando si se reutilizó la sesión)
+    """
+    estado_sesion = obtener_sesion(rut)
+    contar(
+        "rcv_cache_sesion_total", ayuda="Consultas a la caché de sesiones por contribuyente",
+        resultado="hit" if estado_sesion else "miss"
+    )
+    if estado_sesion:
+        logger.info("Reutilizando sesión cacheada de %s***", rut[:7])
+        contexto = browser.new_context(storage_state=estado_sesion)
+        return contexto, _nueva_pagina(contexto), True
+
+    contexto = browser.new_context()
+    page = _nueva_pagina(contexto)
+    _login(page, rut, clave)
+    guardar_sesion(rut, contexto.storage_state())
+    return contexto, page, False
+
+
+def _entrar_a_rcv(browser, rut, clave, mes, anio):
+    """
+    Abre la sesión del contribuyente y navega al RCV en el período indicado.
+    Si la sesión cacheada ya no es válida, inicia sesión nuevamente.
+
+    Returns:
+        tuple: (contexto, página en el resumen del RCV)
+    """
+    contexto, page, reutilizada = _abrir_sesion(browser, rut, clave)
+    logger.info("Navegando al módulo RCV...")
+    reportar(fase="navegar_a_rcv", periodo=formatear_periodo(mes, anio))
+    try:
+        with medir("navegar_a_rcv"):
+            navegar_a_rcv(page, mes, anio)
+        return contexto, page
+    except PeriodoNoSeleccionado:
+        # La sesión llegó al RCV: solo falló la selección del período, no se vuelve a iniciar sesión
+        contexto.close()
+        raise
+    except Exception as e:
+        if not reutilizada:
+            raise
+        logger.warning("Sesión cacheada de %s*** no válida (%s), iniciando sesión nuevamente", rut[:7], str(e))
+        contar("rcv_reintentos_total", ayuda="Reintentos y caminos de respaldo", operacion="sesion_cacheada")
+        invalidar_sesion(rut)
+        contexto.close()
+
+    contexto, page, _ = _abrir_sesion(browser, rut, clave)
+    try:
+        with medir("navegar_a_rcv"):
+            navegar_a_rcv(page, mes, anio)
+    except Exception:
+        contexto.close()
+        raise
+    return contexto, page
+
+
+class _SesionRCV:
+    """
+    Contexto y página de un contribuyente en el RCV, con telemetría CDP del renderer.
+    Si el contexto excede el presupuesto (ver navegador.py) se recicla: se cierra, se
+    abre otro con la sesión cacheada y se vuelve al período y al detalle del tipo en curso.
+    """
+
+    def __init__(self, browser, rut, clave, mes, anio):
+        self.browser, self.rut, self.clave = browser, rut, clave
+        self.mes, self.anio = mes, anio
+        self.tipo = None  # tipo cuyo detalle está abierto
+        self._abrir()
+
+    def _abrir(self):
+        self.contexto, self.page = _entrar_a_rcv(self.browser, self.rut, self.clave, self.mes, self.anio)
+        self.monitor = MonitorContexto(self.contexto, self.page)
+
+    def cerrar(self):
+        self.monitor.cerrar()
+        try:
+            self.contexto.close()
+        except Exception as e:
+            logger.debug("Error al cerrar el contexto: %s", str(e))
+
+    def reciclar_si_excede(self, mes=None, anio=None):
+        """
+        Recicla el contexto si excede el presupuesto; con mes y anio la nueva página queda en ese período.
+        La captura en curso del tipo pasa a la nueva página.
+
+        Returns:
+            bool: True si se recicló
+
+        Raises:
+            Exception: Si la nueva página no llega al período o al detalle del tipo en curso; el
+                tipo no puede seguir extrayéndose en una página que no muestra su detalle
+        """
+        motivo = self.monitor.excede_presupuesto()
+        if motivo is None:
+            return False
+        logger.warning("Reciclando contexto de %s*** (%s)", self.rut[:7], motivo)
+        contar(
+            "rcv_navegador_reciclajes_total", ayuda="Contextos reciclados por exceder el presupuesto",
+            motivo=motivo.split()[0]
+        )
+        if mes is not None:
+            self.mes, self.anio = mes, anio
+        with medir("reciclaje_contexto"):
+            try:
+                guardar_sesion(self.rut, self.contexto.storage_state())
+            except Exception as e:
+                logger.debug("No se pudo guardar la sesión antes de reciclar: %s", str(e))
+            captura = captura_actual()
+            if captura is not None:
+                # Las respuestas de la página anterior se leen antes de cerrar su contexto
+                captura.soltar()
+            self.cerrar()
+            self._abrir()
+            if captura is not None:
+                captura.escuchar(self.page)
+            if self.tipo is not None:
+                navegar_a_detalle_tipo(self.page, self.tipo)
+        return True
+
+    def renovar_pagina(self, page):
+        """
+        Página a usar para el siguiente folio (extraer_datos_tablas)
+        """
+        self.reciclar_si_excede()
+        return self.page
+
+
+def _extraer_tipos(sesion, rut, mes, anio, tipos_documento, forzar=False):
+    """
+    Extrae los registros de todos los tipos solicitados del período cargado en la página.
+    Los tipos cuyo resumen coincide con la última extracción conciliada se toman del
+    almacén histórico sin abrir su detalle (salvo con forzar=True).
+
+    Returns:
+        tuple: (lista de registros, lista de tipos procesados, resumen por tipo del SII,
+                lista de tipos cuyo detalle se extrajo); registros y tipos son None si no
+                hay tipos que procesar
+    """
+    periodo = f"{mes:02d}/{anio}"
+    # Obtener tipos de documentos disponibles y sus totales de la tabla de resumen
+    logger.info("Obteniendo tipos de documentos disponibles...")
+    reportar(fase="descubrimiento_tipos", periodo=formatear_periodo(mes, anio), tipo=None)
+    with medir("descubrimiento_tipos"):
+        resumen = obtener_resumen_tipos(sesion.page)
+    tipos_disponibles = [fila["tipo"] for fila in resumen]
+    guardar_resumen_capturado(rut, mes, anio, resumen)
+
+    if not tipos_disponibles:
+        logger.warning("No se encontraron tipos de documentos disponibles para el período %s", periodo)
+        return None, None, resumen, []
+
+    # Si el usuario especificó tipos, filtrar solo los que están disponibles
+    if tipos_documento is not None:
+        tipos_a_procesar = [td for td in tipos_documento if td in tipos_disponibles]
+        tipos_no_disponibles = [td for td in tipos_documento if td not in tipos_disponibles]
+
+        if tipos_no_disponibles:
+            logger.warning("Los siguientes tipos NO están disponibles para el período: %s", ', '.join(tipos_no_disponibles))
+
+        if not tipos_a_procesar:
+            logger.warning("Ninguno de los tipos especificados está disponible para el período %s", periodo)
+            return None, None, resumen, []
+
+        logger.info("Procesando tipos especificados que están disponibles: %s", ', '.join(tipos_a_procesar))
+    else:
+        # Si no se especificaron tipos, usar todos los disponibles
+        tipos_a_procesar = tipos_disponibles
+        logger.info("Procesando TODOS los tipos disponibles: %s", ', '.join(tipos_a_procesar))
+
+    # Los tipos que el resumen informa sin documentos no se abren
+    sin_documentos = [
+        fila["tipo"] for fila in resumen
+        if fila["documentos"] == 0 and fila["tipo"] in tipos_a_procesar
+    ]
+    if sin_documentos:
+        logger.info("Omitiendo tipos sin documentos en el resumen: %s", ', '.join(sin_documentos))
+        contar(
+            "rcv_tipos_omitidos_total", len(sin_documentos),
+            ayuda="Tipos cuyo detalle no se abrió", motivo="sin_documentos"
+        )
+        tipos_a_procesar = [td for td in tipos_a_procesar if td not in sin_documentos]
+        if not tipos_a_procesar:
+            logger.info("El período %s no tiene documentos en los tipos solicitados", periodo)
+            return None, None, resumen, []
+
+    # Los tipos cuyo resumen no cambió desde la última extracción conciliada salen del almacén
+    todos_los_datos = []
+    sin_cambios, almacenados = [], {}
+    if OMITIR_TIPOS_SIN_CAMBIOS and not forzar:
+        try:
+            sin_cambios = tipos_sin_cambios(resumen, obtener_resumen(rut, mes, anio), tipos_a_procesar)
+            # En modo captura, los tipos sin archivo se extraen igual para poder reproducirlos
+            if CAPTURA_HABILITADA:
+                sin_cambios = [td for td in sin_cambios if existe_captura(rut, mes, anio, td)]
+            almacenados = {
+                tipo_doc: obtener_registros(rut, formatear_periodo(mes, anio), tipo_doc) for tipo_doc in sin_cambios
+            }
+        except Exception as e:
+            logger.error("Error al consultar la instantánea del resumen: %s", str(e))
+            sin_cambios, almacenados = [], {}
+        for tipo_doc, registros in almacenados.items():
+            todos_los_datos.extend(registros)
+            emitir("registros", periodo=formatear_periodo(mes, anio), tipo=tipo_doc, origen="almacen", registros=registros)
+    if sin_cambios:
+        logger.info("Tipos sin cambios respecto de la última extracción (desde almacén): %s", ', '.join(sin_cambios))
+        contar(
+            "rcv_tipos_omitidos_total", len(sin_cambios),
+            ayuda="Tipos cuyo detalle no se abrió", motivo="sin_cambios"
+        )
+    tipos_detalle = [td for td in tipos_a_procesar if td not in sin_cambios]
+
+    # Extraer datos para cada tipo de documento con cambios
+    total_tipos = len(tipos_detalle)
+    sumar("folios_total", sum(fila["documentos"] or 0 for fila in resumen if fila["tipo"] in tipos_detalle))
+
+    for idx, tipo_doc in enumerate(tipos_detalle, 1):
+        logger.info("="*60)
+        logger.info("Procesando tipo %d/%d: %s - %s", idx, total_tipos, tipo_doc, TIPOS_DOCUMENTO.get(tipo_doc, 'Desconocido'))
+        logger.info("="*60)
+
+        # Navegar al detalle del tipo de documento
+        logger.info("Navegando al detalle del tipo %s...", tipo_doc)
+        reportar(fase="detalle_tipo", tipo=tipo_doc, tipo_indice=idx, tipos_total=total_tipos)
+        # Si el detalle no se abre el tipo queda sin registros: la conciliación lo marca con
+        # diferencias y sus registros almacenados no se reemplazan (ver _procesar_datos)
+        try:
+            with capturar_tipo(sesion.page, rut, mes, anio, tipo_doc) as captura:
+                with medir("detalle_tipo", tipo=tipo_doc):
+                    navegar_a_detalle_tipo(sesion.page, tipo_doc)
+                sesion.tipo = tipo_doc
+                if captura is not None:
+                    captura.html = sesion.page.content()
+
+                # Extraer datos (el contexto puede reciclarse entre folios)
+                logger.info("Extrayendo datos del tipo %s...", tipo_doc)
+                with medir("extraccion_tipo", tipo=tipo_doc):
+                    datos_extraidos = extraer_datos_tablas(sesion.page, renovar=sesion.renovar_pagina)
+        except Exception as e:
+            logger.error("Tipo %s omitido: no se pudo extraer su detalle (%s)", tipo_doc, str(e))
+            contar("rcv_tipos_fallidos_total", ayuda="Tipos cuyo detalle no se pudo extraer")
+            datos_extraidos = []
+        finally:
+            sesion.tipo = None
+        contar("rcv_registros_total", len(datos_extraidos), ayuda="Registros procesados por etapa", etapa="extraidos")
+
+        # Agregar tipo de documento a cada registro
+        for registro in datos_extraidos:
+            registro['Tipo Documento'] = tipo_doc
+            registro['Nombre Tipo Documento'] = TIPOS_DOCUMENTO.get(tipo_doc, 'Desconocido')
+
+        todos_los_datos.extend(datos_extraidos)
+        logger.info("Extraídos %d registros del tipo %s", len(datos_extraidos), tipo_doc)
+        sumar("filas", len(datos_extraidos))
+        emitir("registros", periodo=formatear_periodo(mes, anio), tipo=tipo_doc, origen="sii", registros=datos_extraidos)
+
+        # Volver a la pantalla de resumen antes de continuar con el siguiente tipo
+        # (excepto en el último tipo); un contexto reciclado ya queda en el resumen
+        if idx < total_tipos and not sesion.reciclar_si_excede():
+            logger.info("Volviendo a resumen antes de procesar siguiente tipo...")
+            with medir("volver_a_resumen"):
+                volver_a_resumen(sesion.page)
+
+    return todos_los_datos, tipos_a_procesar, resumen, tipos_detalle
+
+
+def _procesar_datos(rut, datos_extraidos, mes, anio, tipos_a_procesar, resumen_sii=None, tipos_detalle=None,
+                    fecha_captura=None, guardar=True):
+    """
+    Deduplica, normaliza, concilia contra el resumen y guarda en el almacén histórico
+    los registros de un período
+
+    Args:
+        resumen_sii: Resumen por tipo leído de la pantalla del RCV (documentos y montos)
+        tipos_detalle: Tipos cuyo detalle se extrajo (el resto se tomó del almacén)
+        fecha_captura: Fecha de las capturas re-procesadas; se guarda como fecha de la extracción
+            y los registros se agregan sin reemplazar ni eliminar los almacenados
+        guardar: Actualizar el almacén histórico
+
+    Returns:
+        dict: Datos completos del período
+    """
+    logger.info("Procesando datos finales...")
+    logger.info("Total de registros antes de eliminar duplicados: %d", len(datos_extraidos))
+    reportar(fase="procesamiento", tipo=None)
+
+    estadisticas_dedup = {}
+    with medir("deduplicacion"):
+        registros_unicos = eliminar_duplicados(datos_extraidos, POLITICA_DEDUPLICACION, estadisticas_dedup)
+    contar("rcv_registros_total", len(registros_unicos), ayuda="Registros procesados por etapa", etapa="unicos")
+
+    # Crear estructura de datos
+    datos_completos = {
+        "fecha_extraccion": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rut": rut,
+        "periodo": {
+            "mes": mes,
+            "anio": anio
+        },
+        "tipos_documento_procesados": tipos_a_procesar,
+        "datos": registros_unicos,
+    }
+    if fecha_captura:
+        datos_completos["fecha_extraccion"] = fecha_captura
+    datos_completos["deduplicacion"] = estadisticas_dedup
+    datos_completos["resumen_sii"] = resumen_sii or []
+
+    # Conciliar conteos y montos del resumen con el detalle
+    if tipos_detalle is None:
+        tipos_detalle = tipos_a_procesar
+    with medir("conciliacion"):
+        conciliacion = conciliar(resumen_sii, registros_unicos, tipos_a_procesar)
+    conciliacion["sin_cambios"] = [td for td in tipos_a_procesar if td not in tipos_detalle]
+    datos_completos["conciliacion"] = conciliacion
+
+    # Solo reemplazan (y eliminan) registros almacenados los tipos cuyo detalle cuadra con el
+    # resumen: un detalle que falló o quedó truncado no borra lo que ya estaba guardado
+    conciliados = {fila["tipo"] for fila in conciliacion["tipos"] if fila["estado"] == "ok"}
+    tipos_reemplazados = [td for td in tipos_detalle if td in conciliados]
+    no_reemplazados = [td for td in tipos_detalle if td not in conciliados]
+    # Solo una extracción que cubre y concilia todos los tipos con documentos del resumen
+    # responde después consultas sin tipos desde el almacén (almacen.periodo_vigente)
+    con_documentos = {fila["tipo"] for fila in resumen_sii or [] if fila["documentos"] != 0}
+    completa = bool(resumen_sii) and con_documentos <= conciliados
+    if fecha_captura:
+        tipos_reemplazados, completa = [], False
+    if no_reemplazados and guardar and not fecha_captura:
+        logger.warning(
+            "Tipos sin conciliar (se agregan registros sin eliminar los almacenados): %s", ', '.join(no_reemplazados)
+        )
+
+    # Normalizar montos, fechas y RUTs (vectorizado) por lotes de LOTE_REGISTROS: se cuentan
+    # los inválidos y se acumulan los agregados sin armar un DataFrame con todo el período
+    invalidos, agregados = 0, {}
+    with medir("normalizacion"):
+        for df_lote in lotes_tipados(datos_completos["datos"]):
+            if df_lote.empty:
+                continue
+            invalidos += int((~df_lote["Registro Valido"]).sum())
+            sumar_agregados(agregados, calcular_agregados(df_lote))
+    if datos_completos["datos"]:
+        datos_completos["registros_invalidos"] = invalidos
+    if not guardar:
+        return datos_completos
+
+    # Guardar en el almacén histórico (upsert en una sola transacción)
+    try:
+        with medir("almacen"):
+            guardar_extraccion(
+                rut, mes, anio, datos_completos["datos"],
+                tipos_documento=tipos_a_procesar,
+                fecha_extraccion=datos_completos["fecha_extraccion"],
+                tipos_reemplazados=tipos_reemplazados,
+                completa=completa
+            )
+            guardar_resumen(rut, mes, anio, conciliacion, fecha_extraccion=datos_completos["fecha_extraccion"])
+        if not fecha_captura:
+            # Las capturas de esta ejecución quedan asociadas a la extracción que las guardó
+            registrar_extraccion(rut, mes, anio, tipos_detalle, datos_completos["fecha_extraccion"])
+        # Totales por tipo, proveedor y día para GET /resumen. Los tipos que no reemplazaron sus
+        # registros (detalle fallido, sin conciliar o reproducido desde capturas) conservan los
+        # almacenados: sus agregados se recalculan desde el almacén y no desde esta extracción
+        with medir("agregados"):
+            completos = set(tipos_reemplazados) | set(conciliacion["sin_cambios"])
+            recalcular = [td for td in tipos_a_procesar if td not in completos]
+            agregados = {clave: valores for clave, valores in agregados.items() if clave[0] in completos}
+            for tipo in recalcular:
+                almacenados = obtener_registros(rut, formatear_periodo(mes, anio), tipo)
+                for df_lote in lotes_tipados(almacenados):
+                    if not df_lote.empty:
+                        sumar_agregados(agregados, calcular_agregados(df_lote))
+            guardar_agregados(
+                rut, mes, anio, [(*clave, *valores) for clave, valores in agregados.items()], tipos_a_procesar,
+                fecha_extraccion=datos_completos["fecha_extraccion"]
+            )
+        # Versión del feed de cambios (GET /cambios) que incluye esta extracción
+        datos_completos["version"] = version_actual(rut, formatear_periodo(mes, anio))
+    except Exception as e:
+        logger.error("Error al guardar en almacén histórico: %s", str(e))
+
+    return datos_completos
+
+
+def desde_almacen(rut, mes, anio, tipos_documento):
+    """
+    Arma el resultado de un período desde el almacén si tiene una extracción vigente
+    (ej: pre-calentada por el programador) que cubre los tipos pedidos
+
+    Returns:
+        dict: Datos completos del período o None si hay que extraerlo del SII
+    """
+    try:
+        extraccion = periodo_vigente(rut, mes, anio, tipos_documento)
+        if extraccion is None:
+            return None
+        tipos = tipos_documento or extraccion["tipos_documento"]
+        registros = [
+            r for r in obtener_registros(rut, formatear_periodo(mes, anio))
+            if str(r.get("Tipo Documento")) in tipos
+        ]
+        instantanea = obtener_resumen(rut, mes, anio)
+    except Exception as e:
+        logger.error("Error al consultar el almacén para %02d/%d: %s", mes, anio, str(e))
+        return None
+
+    logger.info(
+        "Período %02d/%d vigente en el almacén (extraído %s): %d registros sin consultar el SII",
+        mes, anio, extraccion["fecha_extraccion"], len(registros)
+    )
+    contar("rcv_periodos_desde_almacen_total", ayuda="Períodos respondidos desde una extracción vigente")
+    reportar(fase="almacen_vigente", periodo=formatear_periodo(mes, anio), tipo=None)
+    resumen_sii = [
+        {"tipo": tipo, "descripcion": TIPOS_DOCUMENTO.get(tipo, "Desconocido"),
+         "documentos": fila["documentos"], "montos": fila["montos"]}
+        for tipo, fila in sorted(instantanea.items()) if tipo in tipos
+    ]
+    return {
+        "fecha_extraccion": extraccion["fecha_extraccion"],
+        "rut": rut,
+        "periodo": {"mes": mes, "anio": anio},
+        "tipos_documento_procesados": list(tipos),
+        "datos": registros,
+        "desde_almacen": True,
+        "resumen_sii": resumen_sii,
+        "conciliacion": conciliar(resumen_sii, registros, tipos),
+    }
+
+
+def _exportar_archivos(datos_completos, trabajo_id=None):
+    """
+    Publica una versión de JSON, Excel, Parquet y CSV (ver salidas.py) como la actual del
+    contribuyente y, si se indica, del trabajo. Excel se escribe fila a fila y Parquet/CSV
+    lote a lote, de modo que la memoria adicional depende de LOTE_REGISTROS. Si el
+    contenido no cambió no se reescribe ningún archivo.
+    """
+    reportar(fase="exportacion")
+    with medir("exportacion", formato="version"):
+        clave = clave_contenido(datos_completos)
+
+    def escribir(directorio):
+        # Guardar en JSON
+        with medir("exportacion", formato="json"):
+            if not guardar_datos_json(datos_completos, os.path.join(directorio, ARCHIVO_JSON)):
+                return False
+        if not datos_completos["datos"]:
+            return True
+
+        # Guardar en Excel
+        with medir("exportacion", formato="excel"):
+            if not guardar_registros_excel(
+                datos_completos["datos"], os.path.join(directorio, ARCHIVO_EXCEL), columnas_de(datos_completos["datos"])
+            ):
+                return False
+
+        # Guardar en formatos columnares tipados (una pasada de normalización para ambos)
+        with medir("exportacion", formato="parquet_csv"):
+            filas = guardar_lotes(
+                lotes_tipados(datos_completos["datos"]),
+                os.path.join(directorio, ARCHIVO_PARQUET), os.path.join(directorio, ARCHIVO_CSV)
+            )
+        return filas is not None
+
+    ambitos = [ambito_rut(datos_completos.get("rut"))]
+    if trabajo_id:
+        ambitos.append(ambito_trabajo(trabajo_id))
+    publicar(clave, escribir, ambitos)
+
+
+def exportar_trabajo(trabajo_id, rut, resultados):
+    """
+    Publica en un solo juego de archivos los resultados de todas las unidades de un trabajo
+    (un rango partido en bloques de PERIODOS_POR_UNIDAD queda completo, no solo el último bloque)
+
+    Args:
+        trabajo_id: Id del trabajo del planificador
+        rut: RUT del contribuyente
+        resultados: Resultados de las unidades (un período o un rango cada uno)
+
+    Returns:
+        dict: Resultado combinado, o None si no hay resultados
+    """
+    resultados = [r for r in resultados if r]
+    if not resultados:
+        return None
+    if len(resultados) == 1:
+        datos_completos = resultados[0]
+    else:
+        # Cada unidad es un período suelto o un bloque contiguo de un rango
+        rangos = [
+            r if "rango" in r else _combinar_periodos(
+                rut, formatear_periodo(r["periodo"]["mes"], r["periodo"]["anio"]),
+                formatear_periodo(r["periodo"]["mes"], r["periodo"]["anio"]), [r]
+            )
+            for r in resultados
+        ]
+        rangos.sort(key=lambda r: r["rango"]["desde"])
+        datos_completos = {
+            "fecha_extraccion": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "rut": rut,
+            "rango": {"desde": rangos[0]["rango"]["desde"], "hasta": max(r["rango"]["hasta"] for r in rangos)},
+            "periodos": [p for r in rangos for p in r["periodos"]],
+            "tipos_documento_procesados": sorted({t for r in rangos for t in r["tipos_documento_procesados"]}),
+            "datos": RegistrosPorPeriodo(grupo for r in rangos for grupo in r["datos"].grupos),
+        }
+    _exportar_archivos(datos_completos, trabajo_id)
+    return datos_completos
+
+
+def ejecutar_scraping(mes=None, anio=None, tipos_documento=None, desde=None, hasta=None, contextos=1, rut=None,
+                      forzar=False, exportar=True, conservar_navegador=False):
     """
     Ejecuta el proceso de scraping completo
-    
+
     Args:
         mes: Mes para filtrar (1-12). Si es None, usa el mes actual
         anio: Año para filtrar (ej: 2025). Si es None, usa el año actual
         tipos_documento: Lista de códigos de tipos de documento (ej: ["33", "39"]), None para TODOS los tipos
-    
+        desde: Período inicial "YYYY-MM". Si se indica, se extrae el rango desde-hasta
+        hasta: Período final "YYYY-MM" (por defecto igual a desde)
+        contextos: Cantidad de contextos de navegador para repartir un rango de períodos
+        rut: RUT del contribuyente registrado, None para el contribuyente por defecto
+        forzar: Extraer desde el SII el detalle de todos los tipos, aunque el período esté
+            vigente en el almacén o su resumen no haya cambiado
+        exportar: Publicar los archivos de salida del contribuyente (la API publica los del
+            trabajo completo al terminar su última unidad, ver exportar_trabajo)
+        conservar_navegador: Reutilizar el navegador del hilo entre llamadas (hilos del planificador)
+
     Returns:
         dict: Datos extraídos y procesados
     """
+    if desde or hasta:
+        return ejecutar_scraping_rango(
+            desde or hasta, hasta or desde, tipos_documento, contextos, rut, forzar, exportar, conservar_navegador
+        )
+
     logger.info("Ejecutando en modo: %s", AMBIENTE)
-    
+
     # Si no se proporcionan mes y año, usar los actuales
-    from datetime import datetime
     if mes is None:
         mes = datetime.now().month
         logger.info("Mes no especificado, usando mes actual: %d", mes)
     if anio is None:
         anio = datetime.now().year
         logger.info("Año no especificado, usando año actual: %d", anio)
-    
+
     # Validar mes y año
-    if not (1 <= mes <= 12):
-        raise ValueError("El mes debe estar entre 1 y 12")
-    
-    if not (2000 <= anio <= 2100):
-        raise ValueError("El año debe estar entre 2000 y 2100")
-    
-    # Validar configuración
-    validar_configuracion()
-    
-    # Importar TIPOS_DOCUMENTO para mostrar nombres
-    from config import TIPOS_DOCUMENTO
-    
+    validar_periodo(mes, anio)
+
+    # Obtener credenciales del contribuyente
+    rut, clave = obtener_credenciales(rut)
+
     # Mostrar información de la consulta
     periodo = f"{mes:02d}/{anio}"
-    logger.info("Período a consultar: %s", periodo)
-    
-    with sync_playwright() as p:
-        # Configurar navegador
-        headless = AMBIENTE != "DEV"
-        logger.info("Iniciando navegador Chromium (headless=%s)...", headless)
-        
-        # Args necesarios para que Chromium funcione en Cloud Run
-        chromium_args = [
-            "--no-sandbox",
-            "--disable-dev-shm-usage",
-            "--disable-gpu",
-            "--disable-setuid-sandbox",
-            "--disable-extensions",
-            "--disable-background-networking",
-            "--disable-default-apps",
-            "--disable-sync",
-            "--no-first-run",
-        ]
-        
-        browser = p.chromium.launch(
-            headless=headless,
-            args=chromium_args,
+    logger.info("Período a consultar: %s (RUT: %s***)", periodo, rut[:7])
+
+    # Responder desde el almacén si el período ya tiene una extracción reciente
+    datos_completos = None if forzar else desde_almacen(rut, mes, anio, tipos_documento)
+    if datos_completos:
+        if exportar:
+            _exportar_archivos(datos_completos)
+        return datos_completos
+
+    with _navegador(conservar_navegador) as browser:
+        # Login (o sesión cacheada) y navegación al RCV en el período
+        sesion = _SesionRCV(browser, rut, clave, mes, anio)
+        try:
+            datos_extraidos, tipos_a_procesar, resumen_sii, tipos_detalle = _extraer_tipos(
+                sesion, rut, mes, anio, tipos_documento, forzar
+            )
+        finally:
+            sesion.cerrar()
+
+    # Procesar y guardar datos
+    if datos_extraidos:
+        datos_completos = _procesar_datos(
+            rut, datos_extraidos, mes, anio, tipos_a_procesar, resumen_sii, tipos_detalle
         )
-        page = browser.new_page()
-        page.set_default_timeout(DEFAULT_TIMEOUT)
-        logger.debug("Página creada con timeout de %d ms", DEFAULT_TIMEOUT)
-        
-        # Login en el SII
-        logger.info("Iniciando proceso de login en SII...")
-        login_exitoso = login_sii(page, RUT, CLAVE)
-        if not login_exitoso:
-            logger.error("Login fallido: credenciales incorrectas")
-            raise Exception("Credenciales incorrectas. Verifica tu RUT y contraseña.")
-        
-        # Navegar al RCV y seleccionar período
-        logger.info("Navegando al módulo RCV...")
-        navegar_a_rcv(page, mes, anio)
-        
-        # Obtener tipos de documentos disponibles de la tabla de resumen
-        logger.info("Obteniendo tipos de documentos disponibles...")
-        tipos_disponibles = obtener_tipos_documento_disponibles(page)
-        
-        if not tipos_disponibles:
-            logger.warning("No se encontraron tipos de documentos disponibles para el período %s", periodo)
+        if exportar:
+            _exportar_archivos(datos_completos)
+
+        logger.info("Total de registros únicos guardados: %d", len(datos_completos['datos']))
+        logger.info("Extracción completada exitosamente")
+        return datos_completos
+    else:
+        logger.warning("No se extrajeron datos de ninguna tabla")
+        return None
+
+
+def _extraer_periodos(browser, rut, clave, periodos, tipos_documento, forzar=False):
+    """
+    Extrae una secuencia de períodos reutilizando la misma sesión autenticada.
+    Cada período se guarda en el almacén histórico apenas termina.
+
+    Args:
+        browser: Navegador donde se abre el contexto del contribuyente
+        rut: RUT del contribuyente
+        clave: Clave del contribuyente
+        periodos: Lista de (mes, anio)
+        tipos_documento: Tipos a procesar o None para todos
+        forzar: Extraer el detalle aunque el resumen no haya cambiado
+
+    Returns:
+        list: Lista de dicts con los datos completos de cada período extraído
+    """
+    resultados = []
+    sesion = None
+    try:
+        for mes, anio in periodos:
+            periodo = f"{mes:02d}/{anio}"
+            logger.info("#"*60)
+            logger.info("Período %s", periodo)
+            logger.info("#"*60)
+
+            # Cambiar de período desde el resumen; si falla, recargar el módulo RCV. Un contexto
+            # reciclado por exceder el presupuesto ya se abre en el período nuevo. Si el portal
+            # no confirma el período, este se omite: nada se guarda bajo un período no aplicado
+            try:
+                if sesion is None:
+                    sesion = _SesionRCV(browser, rut, clave, mes, anio)
+                elif not sesion.reciclar_si_excede(mes, anio):
+                    reportar(fase="cambio_periodo", periodo=formatear_periodo(mes, anio), tipo=None)
+                    with medir("cambio_periodo"):
+                        volver_a_resumen(sesion.page)
+                        periodo_aplicado = seleccionar_periodo(sesion.page, mes, anio)
+                    if not periodo_aplicado:
+                        logger.info("Recargando módulo RCV para cambiar al período %s", periodo)
+                        contar("rcv_reintentos_total", ayuda="Reintentos y caminos de respaldo", operacion="cambio_periodo")
+                        with medir("navegar_a_rcv"):
+                            navegar_a_rcv(sesion.page, mes, anio)
+                    sesion.mes, sesion.anio = mes, anio
+            except PeriodoNoSeleccionado as e:
+                logger.error("Período %s omitido: %s", periodo, str(e))
+                contar("rcv_periodos_omitidos_total", ayuda="Períodos omitidos por no poder seleccionarlos en el portal")
+                # El siguiente período parte de un contexto nuevo (con la sesión cacheada)
+                if sesion is not None:
+                    sesion.cerrar()
+                    sesion = None
+                continue
+
+            datos_extraidos, tipos_a_procesar, resumen_sii, tipos_detalle = _extraer_tipos(
+                sesion, rut, mes, anio, tipos_documento, forzar
+            )
+            if not datos_extraidos:
+                logger.warning("Período %s sin datos", periodo)
+                continue
+
+            datos_completos = _procesar_datos(
+                rut, datos_extraidos, mes, anio, tipos_a_procesar, resumen_sii, tipos_detalle
+            )
+            resultados.append(datos_completos)
+            logger.info("Período %s completado: %d registros", periodo, len(datos_completos["datos"]))
+    finally:
+        if sesion is not None:
+            sesion.cerrar()
+    return resultados
+
+
+def _extraer_periodos_en_navegador(rut, clave, periodos, tipos_documento, forzar=False, resumen=None, traza=None,
+                                   progreso=None):
+    """
+    Extrae períodos en un navegador propio (para usar desde un hilo) reutilizando
+    la sesión cacheada del contribuyente
+    """
+    with usar_resumen(resumen), usar_traza(traza), usar_progreso(progreso), sync_playwright() as p:
+        browser = _lanzar_navegador(p)
+        try:
+            return _extraer_periodos(browser, rut, clave, periodos, tipos_documento, forzar)
+        finally:
             browser.close()
-            return None
-        
-        # Si el usuario especificó tipos, filtrar solo los que están disponibles
-        if tipos_documento is not None:
-            tipos_a_procesar = [td for td in tipos_documento if td in tipos_disponibles]
-            tipos_no_disponibles = [td for td in tipos_documento if td not in tipos_disponibles]
-            
-            if tipos_no_disponibles:
-                logger.warning("Los siguientes tipos NO están disponibles para el período: %s", ', '.join(tipos_no_disponibles))
-            
-            if not tipos_a_procesar:
-                logger.warning("Ninguno de los tipos especificados está disponible para el período %s", periodo)
-                browser.close()
-                return None
-            
-            logger.info("Procesando tipos especificados que están disponibles: %s", ', '.join(tipos_a_procesar))
+
+
+def _extraer_rango_del_sii(rut, clave, periodos, tipos_documento, contextos, forzar, conservar_navegador=False):
+    """
+    Extrae los períodos desde el SII con un único navegador, repartidos en contextos si contextos > 1
+
+    Returns:
+        list: Lista de dicts con los datos completos de cada período extraído
+    """
+    with _navegador(conservar_navegador) as browser:
+        if contextos == 1:
+            return _extraer_periodos(browser, rut, clave, periodos, tipos_documento, forzar)
+
+        # Iniciar sesión una vez; cada hilo usa su propio driver con la sesión cacheada
+        if not obtener_sesion(rut):
+            contexto, _, _ = _abrir_sesion(browser, rut, clave)
+            contexto.close()
+        grupos = [periodos[i::contextos] for i in range(contextos)]
+        with ThreadPoolExecutor(max_workers=contextos) as executor:
+            futuros = [
+                executor.submit(
+                    _extraer_periodos_en_navegador, rut, clave, grupo, tipos_documento, forzar,
+                    resumen_actual(), traza_actual(), progreso_actual()
+                )
+                for grupo in grupos
+            ]
+            return [r for futuro in futuros for r in futuro.result()]
+
+
+def abrir_navegador():
+    """
+    Inicia Playwright y un navegador que el proceso conserva entre unidades de trabajo
+    (procesos trabajadores de supervisor.py)
+
+    Returns:
+        tuple: (playwright, navegador); cerrar con navegador.close() y playwright.stop()
+    """
+    p = sync_playwright().start()
+    return p, _lanzar_navegador(p)
+
+
+def extraer_periodo_sin_procesar(browser, rut, mes, anio, tipos_documento=None, forzar=False):
+    """
+    Extrae los registros de un período sin deduplicarlos ni guardarlos, para que
+    otro proceso los procese (ver procesar_extraccion)
+
+    Returns:
+        tuple: (registros, tipos procesados, resumen por tipo del SII, tipos cuyo detalle se extrajo)
+    """
+    rut, clave = obtener_credenciales(rut)
+    sesion = _SesionRCV(browser, rut, clave, mes, anio)
+    try:
+        return _extraer_tipos(sesion, rut, mes, anio, tipos_documento, forzar)
+    finally:
+        sesion.cerrar()
+
+
+def procesar_extraccion(rut, mes, anio, datos_extraidos, tipos_a_procesar, resumen_sii=None, tipos_detalle=None):
+    """
+    Deduplica, concilia, normaliza y guarda en el almacén una extracción hecha en otro proceso
+
+    Returns:
+        dict: Datos completos del período
+    """
+    return _procesar_datos(rut, datos_extraidos, mes, anio, tipos_a_procesar, resumen_sii, tipos_detalle)
+
+
+def ejecutar_scraping_rango(desde, hasta, tipos_documento=None, contextos=1, rut=None, forzar=False, exportar=True,
+                            conservar_navegador=False):
+    """
+    Extrae un rango de períodos con un único login, cambiando de período desde
+    la pantalla de resumen. Con contextos > 1 los períodos se reparten entre
+    varios contextos de navegador que comparten la sesión autenticada.
+
+    Args:
+        desde: Período inicial "YYYY-MM"
+        hasta: Período final "YYYY-MM"
+        tipos_documento: Lista de códigos de tipos de documento, None para todos
+        contextos: Cantidad de contextos de navegador en paralelo
+        rut: RUT del contribuyente registrado, None para el contribuyente por defecto
+        forzar: Extraer desde el SII el detalle de todos los tipos, aunque el período esté
+            vigente en el almacén o su resumen no haya cambiado
+        exportar: Publicar ARCHIVO_JSON/EXCEL/PARQUET/CSV del contribuyente (la CLI por lotes
+            escribe sus propios archivos y la API publica los del trabajo completo)
+        conservar_navegador: Reutilizar el navegador del hilo entre llamadas (hilos del planificador)
+
+    Returns:
+        dict: Resumen por período y datos de todos los períodos
+    """
+    logger.info("Ejecutando en modo: %s", AMBIENTE)
+    rut, clave = obtener_credenciales(rut)
+
+    # Los períodos con una extracción vigente se responden desde el almacén
+    resultados, periodos = [], []
+    for mes, anio in periodos_en_rango(desde, hasta):
+        vigente = None if forzar else desde_almacen(rut, mes, anio, tipos_documento)
+        if vigente:
+            resultados.append(vigente)
         else:
-            # Si no se especificaron tipos, usar todos los disponibles
-            tipos_a_procesar = tipos_disponibles
-            logger.info("Procesando TODOS los tipos disponibles: %s", ', '.join(tipos_a_procesar))
-        
-        # Extraer datos para cada tipo de documento disponible
-        todos_los_datos = []
-        total_tipos = len(tipos_a_procesar)
-        
-        for idx, tipo_doc in enumerate(tipos_a_procesar, 1):
-            logger.info("="*60)
-            logger.info("Procesando tipo %d/%d: %s - %s", idx, total_tipos, tipo_doc, TIPOS_DOCUMENTO.get(tipo_doc, 'Desconocido'))
-            logger.info("="*60)
-            
-            # Navegar al detalle del tipo de documento
-            logger.info("Navegando al detalle del tipo %s...", tipo_doc)
-            navegar_a_detalle_tipo(page, tipo_doc)
-            
-            # Extraer datos
-            logger.info("Extrayendo datos del tipo %s...", tipo_doc)
-            datos_extraidos = extraer_datos_tablas(page)
-            
-            # Agregar tipo de documento a cada registro
-            for registro in datos_extraidos:
-                registro['Tipo Documento'] = tipo_doc
-                registro['Nombre Tipo Documento'] = TIPOS_DOCUMENTO.get(tipo_doc, 'Desconocido')
-            
-            todos_los_datos.extend(datos_extraidos)
-            logger.info("Extraídos %d registros del tipo %s", len(datos_extraidos), tipo_doc)
-            
-            # Volver a la pantalla de resumen antes de continuar con el siguiente tipo
-            # (excepto en el último tipo)
-            if idx < total_tipos:
-                logger.info("Volviendo a resumen antes de procesar siguiente tipo...")
-                volver_a_resumen(page)
-        
-        datos_extraidos = todos_los_datos
-        
-        # Procesar y guardar datos
-        if datos_extraidos:
-            logger.info("Procesando datos finales...")
-            logger.info("Total de registros antes de eliminar duplicados: %d", len(datos_extraidos))
-            
-            # Crear estructura de datos
-            datos_completos = {
-                "fecha_extraccion": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "periodo": {
-                    "mes": mes,
-                    "anio": anio
-                },
-                "tipos_documento_procesados": tipos_a_procesar,
-                "datos": eliminar_duplicados(datos_extraidos)
+            periodos.append((mes, anio))
+
+    contextos = max(1, min(int(contextos or 1), MAX_CONTEXTOS_NAVEGADOR, len(periodos) or 1))
+    logger.info(
+        "Rango a consultar: %s a %s (%d períodos desde el SII, %d desde el almacén, %d contextos, RUT: %s***)",
+        desde, hasta, len(periodos), len(resultados), contextos, rut[:7]
+    )
+
+    if periodos:
+        resultados.extend(
+            _extraer_rango_del_sii(rut, clave, periodos, tipos_documento, contextos, forzar, conservar_navegador)
+        )
+
+    if not resultados:
+        logger.warning("No se extrajeron datos en el rango %s a %s", desde, hasta)
+        return None
+
+    datos_completos = _combinar_periodos(rut, desde, hasta, resultados)
+    if exportar:
+        _exportar_archivos(datos_completos)
+
+    logger.info("Total de registros únicos guardados: %d", len(datos_completos['datos']))
+    logger.info("Extracción de rango completada exitosamente")
+    return datos_completos
+
+
+def _combinar_periodos(rut, desde, hasta, resultados):
+    """
+    Une los resultados de varios períodos en un único resultado de rango. Los registros no
+    se copian: reciben la columna "Periodo" en su lugar y el rango los recorre período a
+    período (RegistrosPorPeriodo)
+    """
+    resultados.sort(key=lambda r: (r["periodo"]["anio"], r["periodo"]["mes"]))
+    for r in resultados:
+        periodo = formatear_periodo(r["periodo"]["mes"], r["periodo"]["anio"])
+        for registro in r["datos"]:
+            registro["Periodo"] = periodo
+    return {
+        "fecha_extraccion": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rut": rut,
+        "rango": {"desde": desde, "hasta": hasta},
+        "periodos": [
+            {
+                **r["periodo"],
+                "tipos_documento_procesados": r["tipos_documento_procesados"],
+                "total_registros": len(r["datos"]),
+                "resumen_sii": r["resumen_sii"],
+                "conciliacion": r["conciliacion"],
+                "desde_almacen": r.get("desde_almacen", False)
             }
-            
-            # Guardar en JSON
-            logger.info("Guardando datos en JSON: %s", ARCHIVO_JSON)
-            guardar_datos_json(datos_completos, ARCHIVO_JSON)
-            
-            # Guardar en Excel
-            if datos_completos["datos"]:
-                df_final = pd.DataFrame(datos_completos["datos"])
-                logger.info("Guardando datos en Excel: %s", ARCHIVO_EXCEL)
-                guardar_datos_excel([df_final], ARCHIVO_EXCEL)
-            
-            logger.info("Total de registros únicos guardados: %d", len(datos_completos['datos']))
-            logger.info("Extracción completada exitosamente")
-            return datos_completos
-        else:
-            logger.warning("No se extrajeron datos de ninguna tabla")
-            return None
-        
-        browser.close()
+            for r in resultados
+        ],
+        "tipos_documento_procesados": sorted({t for r in resultados for t in r["tipos_documento_procesados"]}),
+        "datos": RegistrosPorPeriodo(r["datos"] for r in resultados)
+    }
+
+
+def reprocesar_capturas(rut=None, desde=None, hasta=None, exportar=True, guardar=False):
+    """
+    Re-procesa los períodos capturados (CAPTURA_HABILITADA) sin navegador: vuelve a
+    parsear las tablas con la lógica actual, deduplica, concilia y exporta
+
+    Args:
+        rut: RUT del contribuyente (None para todos los capturados)
+        desde: Período inicial "YYYY-MM" (None sin límite)
+        hasta: Período final "YYYY-MM" (None sin límite)
+        exportar: Escribir los archivos de salida con el resultado combinado
+        guardar: Actualizar también el almacén histórico, con la fecha de la captura y sin
+            eliminar registros; se omiten los períodos cuya última extracción no es la que
+            guardó las capturas (o que no la tienen registrada)
+
+    Returns:
+        dict: Resultado combinado de los períodos re-procesados, o None si no hay capturas
+    """
+    capturas = listar_capturas(rut, desde, hasta)
+    if not capturas:
+        logger.warning("No hay capturas para re-procesar (DIRECTORIO_CAPTURAS)")
+        return None
+
+    inicio = time.perf_counter()
+    resultados = []
+    for captura in capturas:
+        mes, anio = parsear_periodo(captura["periodo"])
+        datos, metadatos = [], {}
+        with medir("reproduccion"):
+            for tipo_doc in captura["tipos"]:
+                registros = reproducir_tipo(captura["rut"], mes, anio, tipo_doc, metadatos)
+                for registro in registros:
+                    registro['Tipo Documento'] = tipo_doc
+                    registro['Nombre Tipo Documento'] = TIPOS_DOCUMENTO.get(tipo_doc, 'Desconocido')
+                datos.extend(registros)
+        logger.info("Período %s de %s***: %d registros reproducidos", captura["periodo"], captura["rut"][:7], len(datos))
+        fecha_captura = metadatos.get("fecha_captura")
+        persistir = guardar
+        if guardar:
+            # La extracción que guardó las capturas registra su fecha después de tomarlas: solo
+            # una extracción distinta y posterior tiene datos más nuevos que los reproducidos
+            propias = leer_extracciones_capturadas(captura["rut"], mes, anio)
+            propia = max(propias.values()) if all(t in propias for t in captura["tipos"]) else None
+            ultima = ultima_extraccion(captura["rut"], mes, anio)
+            if ultima is not None and (propia is None or ultima["fecha_extraccion"] > propia):
+                logger.warning(
+                    "Período %s de %s***: el almacén tiene una extracción posterior a la de la captura (%s, captura %s), "
+                    "no se guarda", captura["periodo"], captura["rut"][:7], ultima["fecha_extraccion"],
+                    propia or "sin extracción registrada"
+                )
+                persistir = False
+        datos_completos = _procesar_datos(
+            captura["rut"], datos, mes, anio, captura["tipos"],
+            leer_resumen_capturado(captura["rut"], mes, anio),
+            fecha_captura=fecha_captura, guardar=persistir
+        )
+        resultados.append(datos_completos)
+
+    ruts = {captura["rut"] for captura in capturas}
+    periodos = [captura["periodo"] for captura in capturas]
+    datos_completos = _combinar_periodos(
+        ruts.pop() if len(ruts) == 1 else None, min(periodos), max(periodos), resultados
+    )
+    if exportar:
+        _exportar_archivos(datos_completos)
+    logger.info(
+        "Re-procesados %d períodos (%d registros) desde capturas en %.2fs",
+        len(resultados), len(datos_completos["datos"]), time.perf_counter() - inicio
+    )
+    return datos_completos
@@ -3,22 +3,35 @@ Módulo de exportación de datos
 """
 import json
 import logging
+from collections.abc import Sequence
 import pandas as pd
 
 logger = logging.getLogger("guardador")
 
 
+def _lista_json(valor):
+    # Secuencias que no son listas (ej: los registros de un rango, RegistrosPorPeriodo)
+    if isinstance(valor, Sequence) and not isinstance(valor, (str, bytes)):
+        return list(valor)
+    raise TypeError(f"Object of type {type(valor).__name__} is not JSON serializable")
+
+
 def guardar_datos_json(datos, nombre_archivo="datos_rcv.json"):
     """
     Guarda los datos en un archivo JSON
+
+    Returns:
+        bool: True si se guardó
     """
     try:
         logger.info("Guardando datos en JSON: %s", nombre_archivo)
         with open(nombre_archivo, 'w', encoding='utf-8') as f:
-            json.dump(datos, f, ensure_ascii=False, indent=2)
+            json.dump(datos, f, ensure_ascii=False, indent=2, default=_lista_json)
         logger.info("Datos guardados exitosamente en: %s", nombre_archivo)
+        return True
     except Exception as e:
         logger.error("Error al guardar JSON: %s", str(e))
+        return False
 
 
 def guardar_datos_excel(dataframes, nombre_archivo="datos_rcv.xlsx"):
@@ -34,3 +47,90 @@ def guardar_datos_excel(dataframes, nombre_archivo="datos_rcv.xlsx"):
         logger.info("Datos guardados exitosamente en Excel: %s", nombre_archivo)
     except Exception as e:
         logger.error("Error al guardar Excel: %s", str(e))
+
+
+def guardar_datos_parquet(df, nombre_archivo="datos_rcv.parquet"):
+    """
+    Guarda un DataFrame tipado en formato Parquet (columnar, comprimido)
+    """
+    try:
+        logger.info("Guardando datos en Parquet: %s", nombre_archivo)
+        df.to_parquet(nombre_archivo, engine="pyarrow", index=False, compression="snappy")
+        logger.info("Datos guardados exitosamente en Parquet: %s", nombre_archivo)
+    except Exception as e:
+        logger.error("Error al guardar Parquet: %s", str(e))
+
+
+def guardar_datos_csv(df, nombre_archivo="datos_rcv.csv"):
+    """
+    Guarda un DataFrame tipado en CSV (montos como enteros, fechas ISO 8601)
+    """
+    try:
+        logger.info("Guardando datos en CSV: %s", nombre_archivo)
+        df.to_csv(nombre_archivo, index=False, encoding="utf-8", date_format="%Y-%m-%dT%H:%M:%S")
+        logger.info("Datos guardados exitosamente en CSV: %s", nombre_archivo)
+    except Exception as e:
+        logger.error("Error al guardar CSV: %s", str(e))
+
+
+def guardar_registros_excel(registros, nombre_archivo="datos_rcv.xlsx", columnas=None):
+    """
+    Guarda registros (lista de dicts) en Excel fila a fila con openpyxl en modo
+    write-only, sin armar un DataFrame con todo el período
+
+    Returns:
+        bool: True si se guardó
+    """
+    from openpyxl import Workbook
+
+    try:
+        logger.info("Guardando datos en Excel: %s", nombre_archivo)
+        columnas = columnas or list(dict.fromkeys(clave for registro in registros for clave in registro))
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet("Tabla_1")
+        hoja.append(columnas)
+        for registro in registros:
+            hoja.append([registro.get(columna) for columna in columnas])
+        libro.save(nombre_archivo)
+        logger.info("Datos guardados exitosamente en Excel: %s", nombre_archivo)
+        return True
+    except Exception as e:
+        logger.error("Error al guardar Excel: %s", str(e))
+        return False
+
+
+def guardar_lotes(lotes, archivo_parquet=None, archivo_csv=None):
+    """
+    Escribe DataFrames tipados lote a lote en Parquet y/o CSV en una sola pasada,
+    sin juntar los lotes en memoria (todos los row groups usan el esquema del primero)
+
+    Returns:
+        int: Filas escritas (None si falló)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    escritor, esquema, filas = None, None, 0
+    try:
+        logger.info("Guardando datos por lotes en %s", ", ".join(filter(None, (archivo_parquet, archivo_csv))))
+        for indice, df in enumerate(lotes):
+            if archivo_parquet:
+                tabla = pa.Table.from_pandas(df, schema=esquema, preserve_index=False)
+                if escritor is None:
+                    esquema = tabla.schema
+                    escritor = pq.ParquetWriter(archivo_parquet, esquema, compression="snappy")
+                escritor.write_table(tabla)
+            if archivo_csv:
+                df.to_csv(
+                    archivo_csv, mode="w" if indice == 0 else "a", header=indice == 0, index=False,
+                    encoding="utf-8", date_format="%Y-%m-%dT%H:%M:%S"
+                )
+            filas += len(df)
+        logger.info("Datos guardados exitosamente por lotes (%d filas)", filas)
+    except Exception as e:
+        logger.error("Error al guardar por lotes: %s", str(e))
+        filas = None
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return filas
@@ -0,0 +1,196 @@
+"""
+Limitador adaptativo de solicitudes al portal del SII
+
+Combina un token bucket (tasa de solicitudes por segundo) con un límite de
+concurrencia AIMD: cada solicitud exitosa y rápida aumenta los límites de forma
+aditiva y cada señal de congestión (timeout, HTTP 429/5xx o latencia alta) los
+reduce de forma multiplicativa. Todas las navegaciones y clics de scraper.py
+pasan por la instancia compartida `limitador`.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from config import (
+    LIMITE_TASA_INICIAL, LIMITE_TASA_MINIMA, LIMITE_TASA_MAXIMA,
+    LIMITE_CONCURRENCIA_INICIAL, LIMITE_CONCURRENCIA_MAXIMA, LATENCIA_OBJETIVO
+)
+
+logger = logging.getLogger("limitador")
+
+
+class Permiso:
+    """
+    Permiso de una solicitud en curso; permite marcar congestión antes de liberarlo
+    """
+
+    def __init__(self, operacion):
+        self.operacion = operacion
+        self.inicio = time.monotonic()
+        self.congestionado = False
+
+    def congestion(self):
+        self.congestionado = True
+
+
+class LimitadorAdaptativo:
+    """
+    Token bucket + límite de concurrencia con ajuste AIMD
+
+    Args:
+        tasa: Solicitudes por segundo iniciales
+        tasa_minima: Piso de la tasa al reducir
+        tasa_maxima: Techo de la tasa al aumentar
+        concurrencia: Solicitudes simultáneas iniciales
+        concurrencia_maxima: Techo de solicitudes simultáneas
+        latencia_objetivo: Latencia (segundos) sobre la cual se considera congestión
+        factor_reduccion: Factor multiplicativo aplicado ante congestión
+    """
+
+    def __init__(self, tasa=2.0, tasa_minima=0.2, tasa_maxima=10.0, concurrencia=2,
+                 concurrencia_maxima=8, latencia_objetivo=5.0, factor_reduccion=0.5):
+        self._condicion = threading.Condition()
+        self._tasa = float(tasa)
+        self._tasa_minima = float(tasa_minima)
+        self._tasa_maxima = float(tasa_maxima)
+        self._capacidad = max(1.0, self._tasa)
+        self._tokens = self._capacidad
+        self._ultima_recarga = time.monotonic()
+        self._limite = float(concurrencia)
+        self._limite_maximo = float(concurrencia_maxima)
+        self._en_uso = 0
+        self._latencia_objetivo = latencia_objetivo
+        self._factor = factor_reduccion
+        self._latencia_media = None
+        self._exitos = 0
+        self._congestiones = 0
+        self._reducciones = 0
+        self._espera_total = 0.0
+        self._semaforo_global = None  # cupos compartidos entre procesos (ver repartir)
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self._capacidad, self._tokens + (ahora - self._ultima_recarga) * self._tasa)
+        self._ultima_recarga = ahora
+
+    def _adquirir(self):
+        inicio = time.monotonic()
+        with self._condicion:
+            while True:
+                self._recargar()
+                if self._en_uso < int(self._limite) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._en_uso += 1
+                    break
+                if self._en_uso >= int(self._limite):
+                    self._condicion.wait()
+                else:
+                    self._condicion.wait((1 - self._tokens) / self._tasa)
+            self._espera_total += time.monotonic() - inicio
+
+    def _liberar(self, latencia, congestionado):
+        with self._condicion:
+            self._en_uso -= 1
+            if self._latencia_media is None:
+                self._latencia_media = latencia
+            else:
+                self._latencia_media = 0.8 * self._latencia_media + 0.2 * latencia
+
+            if congestionado or latencia > self._latencia_objetivo:
+                # Reducción multiplicativa
+                self._congestiones += 1
+                self._reducciones += 1
+                self._limite = max(1.0, self._limite * self._factor)
+                self._tasa = max(self._tasa_minima, self._tasa * self._factor)
+                self._tokens = min(self._tokens, 0.0)
+                logger.warning(
+                    "Congestión detectada (latencia %.2fs): concurrencia %.1f, tasa %.2f/s",
+                    latencia, self._limite, self._tasa
+                )
+            else:
+                # Aumento aditivo (un permiso más por cada ventana completa de éxitos)
+                self._exitos += 1
+                self._limite = min(self._limite_maximo, self._limite + 1.0 / self._limite)
+                self._tasa = min(self._tasa_maxima, self._tasa + 0.1 / self._tasa)
+            self._capacidad = max(1.0, self._tasa)
+            self._condicion.notify_all()
+
+    @contextmanager
+    def permiso(self, operacion="solicitud"):
+        """
+        Espera un permiso (token y cupo de concurrencia) para una solicitud al portal
+
+        Args:
+            operacion: Nombre de la operación, para logs
+        """
+        self._adquirir()
+        if self._semaforo_global is not None:
+            inicio = time.monotonic()
+            self._semaforo_global.acquire()
+            with self._condicion:
+                self._espera_total += time.monotonic() - inicio
+        permiso = Permiso(operacion)
+        try:
+            yield permiso
+        finally:
+            if self._semaforo_global is not None:
+                self._semaforo_global.release()
+            latencia = time.monotonic() - permiso.inicio
+            logger.debug("Solicitud '%s' completada en %.3fs", operacion, latencia)
+            self._liberar(latencia, permiso.congestionado)
+
+    def repartir(self, indice, partes, semaforo_global=None):
+        """
+        Deja en este limitador la parte indice (0 a partes - 1) de los límites. Cada proceso
+        trabajador del supervisor recibe una parte: la tasa se divide en partes iguales y la
+        concurrencia (actual y máxima) en cuotas enteras que suman el límite, de modo que la
+        carga total sobre el SII no crece con la cantidad de procesos. Con más partes que
+        concurrencia cada proceso conserva un cupo propio y semaforo_global (un semáforo de
+        multiprocessing compartido por los procesos) acota las solicitudes simultáneas de todos.
+        """
+        def cuota(total):
+            total = int(total)
+            return total // partes + (1 if indice < total % partes else 0)
+
+        with self._condicion:
+            factor = 1 / partes
+            self._tasa *= factor
+            self._tasa_minima *= factor
+            self._tasa_maxima *= factor
+            self._capacidad = max(1.0, self._tasa)
+            self._tokens = min(self._tokens, self._capacidad)
+            self._limite = float(max(1, cuota(self._limite)))
+            self._limite_maximo = float(max(self._limite, cuota(self._limite_maximo)))
+            self._semaforo_global = semaforo_global
+            self._condicion.notify_all()
+
+    def estado(self):
+        """
+        Límites actuales y estadísticas del limitador
+        """
+        with self._condicion:
+            self._recargar()
+            return {
+                "concurrencia_limite": int(self._limite),
+                "concurrencia_en_uso": self._en_uso,
+                "tasa_por_segundo": round(self._tasa, 3),
+                "tokens_disponibles": round(self._tokens, 3),
+                "latencia_media": round(self._latencia_media, 3) if self._latencia_media is not None else None,
+                "latencia_objetivo": self._latencia_objetivo,
+                "solicitudes_exitosas": self._exitos,
+                "congestiones": self._congestiones,
+                "reducciones": self._reducciones,
+                "espera_total_segundos": round(self._espera_total, 3),
+            }
+
+
+# Instancia compartida por todas las navegaciones del proceso
+limitador = LimitadorAdaptativo(
+    tasa=LIMITE_TASA_INICIAL,
+    tasa_minima=LIMITE_TASA_MINIMA,
+    tasa_maxima=LIMITE_TASA_MAXIMA,
+    concurrencia=LIMITE_CONCURRENCIA_INICIAL,
+    concurrencia_maxima=LIMITE_CONCURRENCIA_MAXIMA,
+    latencia_objetivo=LATENCIA_OBJETIVO,
+)
@@ -4,9 +4,9 @@ API REST para extracción automática de datos
 """
 import sys
 import logging
-from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 
-from extractor import ejecutar_scraping
+from config import LOG_NIVEL, LOG_FORMATO, LOG_REGISTROS_POR_SEGUNDO
+from bitacora import configurar_logging
 from api_server import iniciar_servidor
 
 logger = logging.getLogger("rcv_scrap")
@@ -16,18 +16,21 @@ def main():
     """
     Función principal - inicia el servidor API REST
     """
+    configurar_logging(LOG_NIVEL, LOG_FORMATO, por_segundo=LOG_REGISTROS_POR_SEGUNDO)
     logger.info("Iniciando RCV Scrap...")
     
+    # extractor (Playwright, pandas) se importa en la primera extracción, no al arrancar
     try:
-        iniciar_servidor(ejecutar_scraping)
-    
-    except PlaywrightTimeoutError as e:
-        logger.error("ERROR DE TIMEOUT: La operación tardó demasiado tiempo")
-        logger.error("Detalle: %s", str(e))
-        logger.info("Intenta nuevamente o verifica tu conexión a internet")
-        sys.exit(1)
+        iniciar_servidor()
     
     except Exception as e:
+        # Si el error viene de Playwright, el módulo ya está cargado
+        playwright = sys.modules.get("playwright.sync_api")
+        if playwright is not None and isinstance(e, playwright.TimeoutError):
+            logger.error("ERROR DE TIMEOUT: La operación tardó demasiado tiempo")
+            logger.error("Detalle: %s", str(e))
+            logger.info("Intenta nuevamente o verifica tu conexión a internet")
+            sys.exit(1)
         logger.error("ERROR INESPERADO: %s", type(e).__name__)
         logger.error("Detalle: %s", str(e))
         logger.info("Por favor, revisa el error y contacta al administrador si persiste")
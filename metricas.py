@@ -0,0 +1,305 @@
+"""
+Métricas de tiempos por fase y contadores de la extracción
+
+Mantiene histogramas y contadores en memoria, los expone en formato de texto
+Prometheus (GET /metrics) y acumula un resumen por trabajo que se publica en
+GET /estado. No depende de librerías externas.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from config import INTERVALO_MEMORIA
+from trazas import span
+
+logger = logging.getLogger("metricas")
+
+# Buckets en segundos: desde operaciones de DOM (ms) hasta extracciones completas (minutos)
+BUCKETS_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_histogramas = {}  # (nombre, etiquetas) -> {"buckets": [...], "suma": float, "conteo": int}
+_contadores = {}  # (nombre, etiquetas) -> valor
+_ayudas = {}
+_medidores = {}  # nombre -> (ayuda, funcion que retorna {etiquetas: valor} o un número)
+_local = threading.local()
+
+
+def _clave_etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatear_etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas) + (list(extra) if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def resumen_actual():
+    """
+    Resumen del trabajo asociado al hilo actual (o None)
+    """
+    return getattr(_local, "resumen", None)
+
+
+@contextmanager
+def usar_resumen(resumen):
+    """
+    Asocia un diccionario de resumen de trabajo al hilo actual. Las fases medidas
+    y los contadores dentro del bloque se acumulan también en ese diccionario.
+    """
+    anterior = resumen_actual()
+    _local.resumen = resumen
+    try:
+        yield resumen
+    finally:
+        _local.resumen = anterior
+
+
+def copiar_resumen(resumen):
+    """
+    Copia consistente de un resumen de trabajo (para serializarlo mientras se actualiza)
+    """
+    with _lock:
+        return {
+            clave: {k: dict(v) if isinstance(v, dict) else v for k, v in valor.items()}
+            for clave, valor in resumen.items()
+        }
+
+
+def observar(fase, segundos, **etiquetas):
+    """
+    Registra la duración de una fase en el histograma rcv_fase_duracion_segundos
+    """
+    etiquetas["fase"] = fase
+    clave = ("rcv_fase_duracion_segundos", _clave_etiquetas(etiquetas))
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = {"buckets": [0] * len(BUCKETS_SEGUNDOS), "suma": 0.0, "conteo": 0}
+        for i, limite in enumerate(BUCKETS_SEGUNDOS):
+            if segundos <= limite:
+                histograma["buckets"][i] += 1
+        histograma["suma"] += segundos
+        histograma["conteo"] += 1
+
+        resumen = resumen_actual()
+        if resumen is not None:
+            fases = resumen.setdefault("fases", {})
+            entrada = fases.setdefault(fase, {"conteo": 0, "total_segundos": 0.0, "max_segundos": 0.0})
+            entrada["conteo"] += 1
+            entrada["total_segundos"] = round(entrada["total_segundos"] + segundos, 4)
+            entrada["max_segundos"] = round(max(entrada["max_segundos"], segundos), 4)
+
+
+@contextmanager
+def medir(fase, **etiquetas):
+    """
+    Mide la duración de un bloque como una fase de la extracción (y la registra
+    como span si el hilo tiene una traza activa)
+
+    Ejemplo:
+        with medir("login"):
+            login_sii(page, rut, clave)
+    """
+    inicio = time.perf_counter()
+    try:
+        with span(fase, **etiquetas):
+            yield
+    finally:
+        observar(fase, time.perf_counter() - inicio, **etiquetas)
+
+
+def memoria_rss():
+    """
+    Memoria residente actual del proceso en bytes (/proc/self/statm; fuera de Linux,
+    el pico de getrusage)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        import sys
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico if sys.platform == "darwin" else pico * 1024
+
+
+@contextmanager
+def medir_memoria(intervalo=INTERVALO_MEMORIA):
+    """
+    Muestrea la memoria residente del proceso cada intervalo segundos mientras dura el
+    bloque y acumula en el resumen del hilo "memoria": {"rss_inicial_mb", "rss_pico_mb"}.
+    La RSS es del proceso: con varios trabajos simultáneos el pico incluye a los demás.
+    """
+    resumen = resumen_actual()
+    muestras = {"pico": memoria_rss()}
+    inicial = muestras["pico"]
+    detener = threading.Event()
+
+    def muestrear():
+        while not detener.wait(intervalo):
+            muestras["pico"] = max(muestras["pico"], memoria_rss())
+
+    hilo = threading.Thread(target=muestrear, name="memoria", daemon=True)
+    hilo.start()
+    try:
+        yield muestras
+    finally:
+        detener.set()
+        hilo.join()
+        muestras["pico"] = max(muestras["pico"], memoria_rss())
+        if resumen is not None:
+            with _lock:
+                memoria = resumen.setdefault("memoria", {"rss_inicial_mb": round(inicial / 2**20, 1), "rss_pico_mb": 0.0})
+                memoria["rss_pico_mb"] = max(memoria["rss_pico_mb"], round(muestras["pico"] / 2**20, 1))
+
+
+def registrar_maximos(seccion, **valores):
+    """
+    Conserva en el resumen del hilo el máximo de cada valor (ej: telemetría del navegador)
+    """
+    resumen = resumen_actual()
+    if resumen is None:
+        return
+    with _lock:
+        maximos = resumen.setdefault(seccion, {})
+        for clave, valor in valores.items():
+            if valor is not None and (maximos.get(clave) is None or valor > maximos[clave]):
+                maximos[clave] = valor
+
+
+def contar(nombre, valor=1, ayuda=None, **etiquetas):
+    """
+    Incrementa un contador (ej: rcv_reintentos_total, rcv_registros_total)
+    """
+    clave = (nombre, _clave_etiquetas(etiquetas))
+    with _lock:
+        if ayuda:
+            _ayudas.setdefault(nombre, ayuda)
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+        resumen = resumen_actual()
+        if resumen is not None:
+            contadores = resumen.setdefault("contadores", {})
+            sufijo = ",".join(f"{k}={v}" for k, v in sorted(etiquetas.items()))
+            nombre_resumen = f"{nombre}[{sufijo}]" if sufijo else nombre
+            contadores[nombre_resumen] = contadores.get(nombre_resumen, 0) + valor
+
+
+def retirar_metricas():
+    """
+    Retira los histogramas y contadores acumulados en el proceso (ej: un trabajador del
+    supervisor, que los envía al proceso principal con cada unidad)
+
+    Returns:
+        dict: {"histogramas", "contadores", "ayudas"} para incorporar_metricas
+    """
+    with _lock:
+        metricas = {"histogramas": dict(_histogramas), "contadores": dict(_contadores), "ayudas": dict(_ayudas)}
+        _histogramas.clear()
+        _contadores.clear()
+    return metricas
+
+
+def incorporar_metricas(metricas, resumen=None):
+    """
+    Suma las métricas retiradas en otro proceso (retirar_metricas) a las de este proceso y,
+    si hay uno, su resumen de trabajo al resumen del hilo actual
+    """
+    destino = resumen_actual()
+    with _lock:
+        for clave, histograma in metricas["histogramas"].items():
+            actual = _histogramas.setdefault(clave, {"buckets": [0] * len(BUCKETS_SEGUNDOS), "suma": 0.0, "conteo": 0})
+            actual["buckets"] = [a + b for a, b in zip(actual["buckets"], histograma["buckets"])]
+            actual["suma"] += histograma["suma"]
+            actual["conteo"] += histograma["conteo"]
+        for clave, valor in metricas["contadores"].items():
+            _contadores[clave] = _contadores.get(clave, 0) + valor
+        for nombre, ayuda in metricas["ayudas"].items():
+            _ayudas.setdefault(nombre, ayuda)
+
+        if destino is None or not resumen:
+            return
+        for fase, entrada in resumen.get("fases", {}).items():
+            actual = destino.setdefault("fases", {}).setdefault(
+                fase, {"conteo": 0, "total_segundos": 0.0, "max_segundos": 0.0}
+            )
+            actual["conteo"] += entrada["conteo"]
+            actual["total_segundos"] = round(actual["total_segundos"] + entrada["total_segundos"], 4)
+            actual["max_segundos"] = max(actual["max_segundos"], entrada["max_segundos"])
+        for nombre, valor in resumen.get("contadores", {}).items():
+            contadores = destino.setdefault("contadores", {})
+            contadores[nombre] = contadores.get(nombre, 0) + valor
+        # Memoria y telemetría del navegador son máximos por sección
+        for seccion, valores in resumen.items():
+            if seccion in ("fases", "contadores"):
+                continue
+            maximos = destino.setdefault(seccion, {})
+            for clave, valor in valores.items():
+                if valor is not None and (maximos.get(clave) is None or valor > maximos[clave]):
+                    maximos[clave] = valor
+
+
+def registrar_medidor(nombre, ayuda, funcion):
+    """
+    Registra un gauge calculado al momento de exponer las métricas
+
+    Args:
+        funcion: Callable que retorna un número o un dict {etiquetas(tuple): valor}
+    """
+    with _lock:
+        _medidores[nombre] = (ayuda, funcion)
+
+
+def exponer():
+    """
+    Genera el texto de exposición en formato Prometheus
+    """
+    lineas = []
+    with _lock:
+        histogramas = {k: {"buckets": list(v["buckets"]), "suma": v["suma"], "conteo": v["conteo"]} for k, v in _histogramas.items()}
+        contadores = dict(_contadores)
+        ayudas = dict(_ayudas)
+        medidores = dict(_medidores)
+
+    if histogramas:
+        lineas.append("# HELP rcv_fase_duracion_segundos Duración de cada fase de la extracción")
+        lineas.append("# TYPE rcv_fase_duracion_segundos histogram")
+        for (nombre, etiquetas), h in sorted(histogramas.items()):
+            for limite, acumulado in zip(BUCKETS_SEGUNDOS, h["buckets"]):
+                lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas, [('le', limite)])} {acumulado}")
+            lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas, [('le', '+Inf')])} {h['conteo']}")
+            lineas.append(f"{nombre}_sum{_formatear_etiquetas(etiquetas)} {h['suma']:.6f}")
+            lineas.append(f"{nombre}_count{_formatear_etiquetas(etiquetas)} {h['conteo']}")
+
+    nombres_contadores = sorted({nombre for nombre, _ in contadores})
+    for nombre in nombres_contadores:
+        lineas.append(f"# HELP {nombre} {ayudas.get(nombre, nombre)}")
+        lineas.append(f"# TYPE {nombre} counter")
+        for (n, etiquetas), valor in sorted(contadores.items()):
+            if n == nombre:
+                lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {valor}")
+
+    for nombre, (ayuda, funcion) in sorted(medidores.items()):
+        try:
+            valores = funcion()
+        except Exception as e:
+            logger.debug("Error al calcular medidor %s: %s", nombre, str(e))
+            continue
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} gauge")
+        if isinstance(valores, dict):
+            for etiquetas, valor in valores.items():
+                lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {valor}")
+        elif valores is not None:
+            lineas.append(f"{nombre} {valores}")
+
+    return "\n".join(lineas) + "\n"
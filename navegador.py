@@ -0,0 +1,195 @@
+"""
+Perfiles de lanzamiento de Chromium y presupuesto de recursos por contexto
+
+Cada contexto de navegador del extractor tiene un MonitorContexto que consulta
+por CDP (Performance.getMetrics) el heap de JavaScript, los nodos del DOM y el
+tiempo de CPU del hilo principal del renderer, como máximo cada
+NAVEGADOR_INTERVALO_MUESTREO segundos (una consulta al driver por muestra).
+Si una muestra supera el presupuesto (NAVEGADOR_HEAP_MB, NAVEGADOR_NODOS o
+NAVEGADOR_CPU_PORCENTAJE sostenido), el extractor recicla el contexto a mitad
+del trabajo: lo cierra, abre otro con la sesión cacheada y vuelve al período y
+al tipo en curso, conservando los registros ya extraídos.
+
+Los perfiles (NAVEGADOR_PERFIL) agregan flags a los que Chromium necesita en
+Cloud Run; benchmark.py --perfiles compara su consumo y velocidad.
+"""
+import time
+import logging
+import itertools
+import threading
+
+from config import (
+    NAVEGADOR_PERFIL, NAVEGADOR_ARGS_EXTRA, NAVEGADOR_HEAP_MB, NAVEGADOR_NODOS,
+    NAVEGADOR_CPU_PORCENTAJE, NAVEGADOR_INTERVALO_MUESTREO
+)
+from metricas import registrar_maximos
+
+logger = logging.getLogger("navegador")
+
+# Args necesarios para que Chromium funcione en Cloud Run
+CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-setuid-sandbox",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+]
+
+_LIVIANO = [
+    # Un solo proceso renderer y sin aislamiento por sitio: menos procesos por contexto
+    "--renderer-process-limit=1",
+    "--disable-site-isolation-trials",
+    # Sin caché de páginas anteriores (back/forward) ni servicios en segundo plano
+    "--disable-features=BackForwardCache,Translate,MediaRouter,OptimizationHints",
+    # Límite del heap de V8 por encima del presupuesto por defecto, para reciclar antes de un OOM
+    "--js-flags=--max-old-space-size=512",
+    "--blink-settings=imagesEnabled=false",
+]
+
+PERFILES = {
+    "estandar": [],
+    "liviano": _LIVIANO,
+    # Experimental: navegador y renderer en un mismo proceso; un fallo del renderer cierra el navegador
+    "minimo": _LIVIANO + ["--single-process", "--no-zygote"],
+}
+
+# Muestras consecutivas sobre NAVEGADOR_CPU_PORCENTAJE para considerar el consumo sostenido
+MUESTRAS_CPU_SOSTENIDO = 3
+
+_perfil = NAVEGADOR_PERFIL
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_ultimas = {}  # id del monitor -> última muestra (contextos abiertos)
+
+
+def seleccionar_perfil(nombre):
+    """
+    Cambia el perfil de los próximos lanzamientos (ej: benchmark.py --perfiles)
+    """
+    global _perfil
+    if nombre not in PERFILES:
+        raise ValueError(f"Perfil de navegador desconocido: {nombre} (disponibles: {', '.join(PERFILES)})")
+    _perfil = nombre
+
+
+def perfil_actual():
+    return _perfil
+
+
+def argumentos_lanzamiento(perfil=None):
+    """
+    Flags de Chromium del perfil (por defecto el actual) más NAVEGADOR_ARGS_EXTRA
+    """
+    perfil = perfil or _perfil
+    if perfil not in PERFILES:
+        raise ValueError(f"Perfil de navegador desconocido: {perfil} (disponibles: {', '.join(PERFILES)})")
+    return CHROMIUM_ARGS + PERFILES[perfil] + NAVEGADOR_ARGS_EXTRA
+
+
+def muestras_actuales():
+    """
+    Última muestra de cada contexto abierto: {id: muestra}
+    """
+    with _lock:
+        return {id_monitor: dict(muestra) for id_monitor, muestra in _ultimas.items()}
+
+
+class MonitorContexto:
+    """
+    Telemetría CDP y presupuesto de recursos de la página de un contexto
+
+    Args:
+        contexto: BrowserContext de Playwright
+        page: Página del contexto a muestrear
+        intervalo: Segundos mínimos entre muestras
+    """
+
+    def __init__(self, contexto, page, intervalo=NAVEGADOR_INTERVALO_MUESTREO):
+        self.id = next(_ids)
+        self.intervalo = intervalo
+        self._ultima_muestra = time.monotonic()
+        self._anterior = None  # (Timestamp, TaskDuration) de la muestra previa
+        self._excesos_cpu = 0
+        try:
+            self._sesion = contexto.new_cdp_session(page)
+            self._sesion.send("Performance.enable")
+        except Exception as e:
+            # Sin CDP (ej: otro navegador) el contexto funciona sin presupuesto
+            logger.debug("Telemetría CDP no disponible: %s", str(e))
+            self._sesion = None
+
+    def muestrear(self):
+        """
+        Consulta las métricas del renderer
+
+        Returns:
+            dict: heap_bytes, heap_usado_bytes, nodos, documentos, listeners y
+                cpu_porcentaje (tiempo de tareas del hilo principal / tiempo transcurrido)
+        """
+        valores = {m["name"]: m["value"] for m in self._sesion.send("Performance.getMetrics")["metrics"]}
+        muestra = {
+            "heap_bytes": int(valores.get("JSHeapTotalSize", 0)),
+            "heap_usado_bytes": int(valores.get("JSHeapUsedSize", 0)),
+            "nodos": int(valores.get("Nodes", 0)),
+            "documentos": int(valores.get("Documents", 0)),
+            "listeners": int(valores.get("JSEventListeners", 0)),
+            "cpu_porcentaje": None,
+        }
+        marca, tareas = valores.get("Timestamp"), valores.get("TaskDuration")
+        if self._anterior is not None and marca is not None and marca > self._anterior[0]:
+            muestra["cpu_porcentaje"] = round(100 * (tareas - self._anterior[1]) / (marca - self._anterior[0]), 1)
+        self._anterior = (marca, tareas)
+
+        with _lock:
+            _ultimas[self.id] = muestra
+        registrar_maximos(
+            "navegador",
+            heap_pico_mb=round(muestra["heap_bytes"] / 2**20, 1),
+            nodos_pico=muestra["nodos"],
+            cpu_pico_porcentaje=muestra["cpu_porcentaje"],
+        )
+        return muestra
+
+    def excede_presupuesto(self):
+        """
+        Toma una muestra si pasó el intervalo y la compara con el presupuesto
+
+        Returns:
+            str: Motivo si el contexto debe reciclarse, None si no
+        """
+        if self._sesion is None or time.monotonic() - self._ultima_muestra < self.intervalo:
+            return None
+        self._ultima_muestra = time.monotonic()
+        try:
+            muestra = self.muestrear()
+        except Exception as e:
+            logger.debug("No se pudo muestrear el contexto %d: %s", self.id, str(e))
+            return None
+
+        heap_mb = muestra["heap_bytes"] / 2**20
+        if NAVEGADOR_HEAP_MB and heap_mb > NAVEGADOR_HEAP_MB:
+            return f"heap {heap_mb:.0f} MB > {NAVEGADOR_HEAP_MB:.0f} MB"
+        if NAVEGADOR_NODOS and muestra["nodos"] > NAVEGADOR_NODOS:
+            return f"nodos {muestra['nodos']} > {NAVEGADOR_NODOS}"
+        if NAVEGADOR_CPU_PORCENTAJE and muestra["cpu_porcentaje"] is not None:
+            if muestra["cpu_porcentaje"] > NAVEGADOR_CPU_PORCENTAJE:
+                self._excesos_cpu += 1
+            else:
+                self._excesos_cpu = 0
+            if self._excesos_cpu >= MUESTRAS_CPU_SOSTENIDO:
+                return f"cpu {muestra['cpu_porcentaje']:.0f}% > {NAVEGADOR_CPU_PORCENTAJE:.0f}%"
+        return None
+
+    def cerrar(self):
+        with _lock:
+            _ultimas.pop(self.id, None)
+        if self._sesion is not None:
+            try:
+                self._sesion.detach()
+            except Exception:
+                pass
+            self._sesion = None
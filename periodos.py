@@ -0,0 +1,51 @@
+"""
+Utilidades de períodos tributarios (mes/año)
+"""
+
+
+def validar_periodo(mes, anio):
+    """
+    Valida mes y año de un período
+    """
+    if not (1 <= mes <= 12):
+        raise ValueError("El mes debe estar entre 1 y 12")
+
+    if not (2000 <= anio <= 2100):
+        raise ValueError("El año debe estar entre 2000 y 2100")
+
+
+def formatear_periodo(mes, anio):
+    """
+    Formatea un período como "YYYY-MM"
+    """
+    return f"{int(anio):04d}-{int(mes):02d}"
+
+
+def parsear_periodo(texto):
+    """
+    Convierte "YYYY-MM" en (mes, anio)
+    """
+    try:
+        anio, mes = (int(parte) for parte in texto.split("-"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Período inválido '{texto}'. Usa el formato YYYY-MM")
+    validar_periodo(mes, anio)
+    return mes, anio
+
+
+def periodos_en_rango(desde, hasta):
+    """
+    Lista los períodos (mes, anio) entre desde y hasta, ambos "YYYY-MM" e inclusive
+    """
+    mes, anio = parsear_periodo(desde)
+    mes_fin, anio_fin = parsear_periodo(hasta)
+    if (anio, mes) > (anio_fin, mes_fin):
+        raise ValueError("El período 'desde' debe ser anterior o igual a 'hasta'")
+
+    periodos = []
+    while (anio, mes) <= (anio_fin, mes_fin):
+        periodos.append((mes, anio))
+        mes += 1
+        if mes > 12:
+            mes, anio = 1, anio + 1
+    return periodos
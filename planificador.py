@@ -0,0 +1,286 @@
+"""
+Planificador justo de extracciones multi-contribuyente
+
+Cada trabajo se divide en unidades (uno o pocos períodos). Las unidades se
+encolan por contribuyente y los trabajadores las toman en round-robin entre
+contribuyentes, de modo que un backfill largo de un RUT no bloquea al resto.
+"""
+import uuid
+import logging
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime
+
+from metricas import usar_resumen, copiar_resumen, medir, medir_memoria
+from trazas import Traza, usar_traza, ruta_traza
+from progreso import Progreso, usar_progreso
+
+logger = logging.getLogger("planificador")
+
+
+class Trabajo:
+    """
+    Trabajo de extracción de un contribuyente, compuesto por una o más unidades
+    """
+
+    def __init__(self, rut, parametros, unidades, trazar=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.rut = rut
+        self.parametros = parametros
+        self.unidades_total = len(unidades)
+        self.unidades_completadas = 0
+        self.unidades_ejecutadas = 0  # completadas se incrementa recién después de al_terminar
+        self.estado = "en_cola"
+        self.mensaje = "Extracción en cola"
+        self.fecha_creacion = datetime.now().isoformat()
+        self.fecha_inicio = None
+        self.fecha_fin = None
+        self.total_registros = 0
+        self.errores = []
+        self.metricas = {}
+        self.traza = Traza(self.id) if trazar else None
+        self.traza_exportada = False
+        self.progreso = Progreso(self.id)
+        self.resultados = []  # resultados de las unidades, hasta que el trabajo termina
+
+    def como_dict(self):
+        return {
+            "id": self.id,
+            "rut": self.rut,
+            "estado": self.estado,
+            "mensaje": self.mensaje,
+            "fecha_creacion": self.fecha_creacion,
+            "fecha_inicio": self.fecha_inicio,
+            "fecha_fin": self.fecha_fin,
+            "total_registros": self.total_registros,
+            "error": "; ".join(self.errores) if self.errores else None,
+            "periodo": self.parametros.get("periodo"),
+            "tipos_documento": self.parametros.get("tipos_documento"),
+            "origen": self.parametros.get("origen", "api"),
+            "unidades_total": self.unidades_total,
+            "unidades_completadas": self.unidades_completadas,
+            "metricas": copiar_resumen(self.metricas),
+            "traza_disponible": self.traza_exportada,
+            "progreso": self.progreso.estado(),
+        }
+
+
+class PlanificadorJusto:
+    """
+    Reparte la capacidad de los trabajadores entre contribuyentes en round-robin
+
+    Args:
+        ejecutar_unidad: Función que ejecuta una unidad: ejecutar_unidad(rut, **kwargs) -> dict | None
+        trabajadores: Cantidad de hilos trabajadores
+        max_por_contribuyente: Máximo de unidades simultáneas de un mismo contribuyente
+        historial: Cantidad de trabajos terminados que se conservan para consulta
+        al_terminar: Función al_terminar(trabajo, resultados) que se llama cuando termina la
+            última unidad de un trabajo, antes de marcarlo completado (ej: publicar sus salidas)
+        al_quedar_inactivo: Función que cada trabajador llama antes de esperar una unidad con
+            la cola vacía (ej: cerrar el navegador que conserva entre unidades)
+    """
+
+    def __init__(self, ejecutar_unidad, trabajadores=1, max_por_contribuyente=1, historial=100, al_terminar=None,
+                 al_quedar_inactivo=None):
+        self._ejecutar_unidad = ejecutar_unidad
+        self._al_terminar = al_terminar
+        self._al_quedar_inactivo = al_quedar_inactivo
+        self._trabajadores = max(1, trabajadores)
+        self._max_por_contribuyente = max(1, max_por_contribuyente)
+        self._historial = historial
+        self._condicion = threading.Condition()
+        self._colas = OrderedDict()  # rut -> deque[(trabajo, kwargs)]
+        self._activos = {}  # rut -> unidades en ejecución
+        self._trabajos = OrderedDict()
+        self._hilos = []
+
+    def _iniciar_hilos(self):
+        while len(self._hilos) < self._trabajadores:
+            hilo = threading.Thread(
+                target=self._bucle, name=f"planificador-{len(self._hilos) + 1}", daemon=True
+            )
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def enviar(self, rut, unidades, parametros=None, trazar=False):
+        """
+        Encola un trabajo
+
+        Args:
+            rut: RUT del contribuyente
+            unidades: Lista de kwargs, uno por unidad de trabajo
+            parametros: Datos descriptivos del trabajo (periodo, tipos_documento)
+            trazar: Registrar una traza de spans del trabajo (exportada al terminar cada unidad)
+
+        Returns:
+            Trabajo: El trabajo encolado
+        """
+        trabajo = Trabajo(rut, parametros or {}, unidades, trazar)
+        with self._condicion:
+            self._trabajos[trabajo.id] = trabajo
+            self._podar_historial()
+            cola = self._colas.setdefault(rut, deque())
+            for kwargs in unidades:
+                cola.append((trabajo, kwargs))
+            self._iniciar_hilos()
+            self._condicion.notify_all()
+        logger.info(
+            "Trabajo %s encolado para %s*** (%d unidades, %d en cola)",
+            trabajo.id, rut[:7], len(unidades), self.pendientes()
+        )
+        return trabajo
+
+    def _podar_historial(self):
+        terminados = [t for t in self._trabajos.values() if t.estado in ("completado", "error")]
+        for trabajo in terminados[:max(0, len(terminados) - self._historial)]:
+            del self._trabajos[trabajo.id]
+
+    def _siguiente(self):
+        """
+        Toma la siguiente unidad en round-robin entre contribuyentes (con el lock tomado)
+        """
+        for rut in list(self._colas):
+            cola = self._colas[rut]
+            if not cola:
+                del self._colas[rut]
+                continue
+            if self._activos.get(rut, 0) >= self._max_por_contribuyente:
+                continue
+            unidad = cola.popleft()
+            # Mover el contribuyente al final para el próximo turno
+            self._colas.move_to_end(rut)
+            if not cola:
+                del self._colas[rut]
+            self._activos[rut] = self._activos.get(rut, 0) + 1
+            return rut, unidad
+        return None
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                siguiente = self._siguiente()
+            if siguiente is None and self._al_quedar_inactivo is not None:
+                try:
+                    self._al_quedar_inactivo()
+                except Exception as e:
+                    logger.error("Error al liberar recursos del trabajador: %s", str(e))
+            with self._condicion:
+                while siguiente is None:
+                    siguiente = self._siguiente()
+                    if siguiente is None:
+                        self._condicion.wait()
+            rut, (trabajo, kwargs) = siguiente
+            self._ejecutar(rut, trabajo, kwargs)
+
+    def _ejecutar(self, rut, trabajo, kwargs):
+        with self._condicion:
+            if trabajo.estado == "en_cola":
+                trabajo.estado = "ejecutando"
+                trabajo.mensaje = "Extracción en proceso..."
+                trabajo.fecha_inicio = datetime.now().isoformat()
+        registros, error, resultado = 0, None, None
+        try:
+            with usar_resumen(trabajo.metricas), usar_traza(trabajo.traza), usar_progreso(trabajo.progreso), \
+                    medir("unidad_trabajo"), medir_memoria():
+                resultado = self._ejecutar_unidad(rut, **kwargs)
+            if resultado:
+                registros = len(resultado.get("datos", []))
+        except Exception as e:
+            logger.error("Error en trabajo %s (%s): %s", trabajo.id, kwargs, str(e))
+            error = str(e)
+        finally:
+            with self._condicion:
+                trabajo.total_registros += registros
+                if error:
+                    trabajo.errores.append(error)
+                if resultado and self._al_terminar is not None:
+                    trabajo.resultados.append(resultado)
+                trabajo.unidades_ejecutadas += 1
+                ultima = trabajo.unidades_ejecutadas >= trabajo.unidades_total
+            if ultima and self._al_terminar is not None:
+                self._terminar(trabajo)
+            if trabajo.traza is not None:
+                self._exportar_traza(trabajo)
+            with self._condicion:
+                self._activos[rut] -= 1
+                trabajo.unidades_completadas += 1
+                if trabajo.unidades_completadas >= trabajo.unidades_total:
+                    trabajo.fecha_fin = datetime.now().isoformat()
+                    if trabajo.errores:
+                        trabajo.estado = "error"
+                        trabajo.mensaje = "Error durante la extracción"
+                    else:
+                        trabajo.estado = "completado"
+                        trabajo.mensaje = "Extracción completada exitosamente"
+                unidades_completadas = trabajo.unidades_completadas
+                self._condicion.notify_all()
+            trabajo.progreso.emitir(
+                "unidad", unidades_completadas=unidades_completadas, unidades_total=trabajo.unidades_total,
+                registros=registros, error=error
+            )
+            if unidades_completadas >= trabajo.unidades_total:
+                # La traza completa ya está exportada: no se retiene en memoria con el historial
+                trabajo.traza = None
+                trabajo.progreso.cerrar(
+                    trabajo.estado, total_registros=trabajo.total_registros, error="; ".join(trabajo.errores) or None
+                )
+
+    def _terminar(self, trabajo):
+        resultados, trabajo.resultados = trabajo.resultados, []
+        try:
+            with usar_resumen(trabajo.metricas), usar_traza(trabajo.traza), usar_progreso(trabajo.progreso):
+                self._al_terminar(trabajo, resultados)
+        except Exception as e:
+            logger.error("Error al terminar el trabajo %s: %s", trabajo.id, str(e))
+            with self._condicion:
+                trabajo.errores.append(str(e))
+
+    def _exportar_traza(self, trabajo):
+        try:
+            trabajo.traza.exportar(ruta_traza(trabajo.id))
+            trabajo.traza_exportada = True
+        except Exception as e:
+            logger.error("Error al exportar la traza del trabajo %s: %s", trabajo.id, str(e))
+
+    def obtener(self, trabajo_id):
+        with self._condicion:
+            trabajo = self._trabajos.get(trabajo_id)
+            return trabajo.como_dict() if trabajo else None
+
+    def progreso(self, trabajo_id):
+        """
+        Canal de progreso en vivo de un trabajo (o None)
+        """
+        with self._condicion:
+            trabajo = self._trabajos.get(trabajo_id)
+            return trabajo.progreso if trabajo else None
+
+    def ultimo(self):
+        with self._condicion:
+            if not self._trabajos:
+                return None
+            return next(reversed(self._trabajos.values())).como_dict()
+
+    def listar(self, rut=None):
+        with self._condicion:
+            return [t.como_dict() for t in self._trabajos.values() if rut is None or t.rut == rut]
+
+    def pendientes(self):
+        with self._condicion:
+            return sum(len(cola) for cola in self._colas.values())
+
+    def en_curso(self, rut):
+        """
+        Indica si el contribuyente tiene unidades en cola o en ejecución
+        """
+        with self._condicion:
+            return bool(self._colas.get(rut)) or self._activos.get(rut, 0) > 0
+
+    def estadisticas(self):
+        with self._condicion:
+            return {
+                "trabajadores": self._trabajadores,
+                "max_por_contribuyente": self._max_por_contribuyente,
+                "unidades_en_cola": {rut: len(cola) for rut, cola in self._colas.items()},
+                "unidades_activas": {rut: n for rut, n in self._activos.items() if n},
+            }
@@ -0,0 +1,470 @@
+"""
+Portal SII simulado para benchmarks y pruebas sin conexión
+
+Reproduce, con la misma estructura de selectores que usa scraper.py, el login
+de Mi SII, la pantalla de resumen del RCV con enlaces #detalle/{tipo}, las
+tablas de detalle (tamaño configurable por tipo) y el modal de cada folio.
+Los datos del detalle y del modal se entregan por XHR, y cada respuesta puede
+retrasarse para simular la latencia del SII.
+
+Uso:
+    python portal_simulado.py --puerto 8765 --documentos 33:200,61:10 --latencia 0.05
+
+y luego apuntar el scraper al portal:
+    SII_URL_LOGIN=http://127.0.0.1:8765/cgi_misii/siihome.cgi
+    SII_URL_RCV=http://127.0.0.1:8765/consdcvinternetui
+"""
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import date
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger("portal_simulado")
+
+NOMBRES_TIPOS = {
+    "33": "Factura Electrónica",
+    "34": "Factura No Afecta o Exenta Electrónica",
+    "46": "Factura de Compra Electrónica",
+    "56": "Nota de Débito Electrónica",
+    "61": "Nota de Crédito Electrónica",
+}
+
+COLUMNAS_DETALLE = [
+    "Nro", "Tipo Doc", "RUT Proveedor", "Folio", "Fecha Docto", "Fecha Recepcion",
+    "Monto Exento", "Monto Neto", "Monto IVA Recuperable", "Monto Total",
+]
+
+# Folios de igual largo para que a:has-text("{folio}") no coincida con otro folio
+FOLIO_INICIAL = 100000
+
+_PAGINA_LOGIN = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Mi SII</title></head>
+<body>
+<h1>Servicio de Impuestos Internos</h1>
+<a href="#" id="ingresar" onclick="document.getElementById('formulario').style.display='block'; return false;">Ingresar a Mi SII</a>
+<form id="formulario" method="post" action="/cgi_misii/login" style="display:none">
+  <input type="text" name="rutcntr" placeholder="RUT">
+  <input type="password" name="clave" placeholder="Clave">
+  <button id="bt_ingresar" type="submit">Ingresar</button>
+</form>
+%(mensaje)s
+</body></html>
+"""
+
+_PAGINA_HOME = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Mi SII</title></head>
+<body><h1>Bienvenido a Mi SII</h1><p>Sesión iniciada</p></body></html>
+"""
+
+_PAGINA_RCV = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Registro de Compras y Ventas</title>
+<style>.modal{position:fixed;top:20%%;left:30%%;background:#fff;border:1px solid #000;padding:1em}</style>
+</head>
+<body>
+<div id="inicio">
+  <button class="btn btn-default btn-xs-block btn-block" onclick="iniciar()">Ingresar al Registro</button>
+</div>
+<div id="app"></div>
+<script>
+var estado = {mes: "%(mes)02d", anio: "%(anio)d"};
+
+function pedir(url) {
+  return fetch(url, {credentials: "same-origin"}).then(function (r) { return r.json(); });
+}
+
+function opciones(valores, actual) {
+  return valores.map(function (v) {
+    return '<option value="' + v + '"' + (v === actual ? ' selected' : '') + '>' + v + '</option>';
+  }).join('');
+}
+
+function iniciar() {
+  document.getElementById('inicio').remove();
+  mostrarResumen();
+}
+
+function mostrarResumen() {
+  var meses = [], anios = [];
+  for (var m = 1; m <= 12; m++) meses.push(('0' + m).slice(-2));
+  for (var a = %(anio)d - 5; a <= %(anio)d; a++) anios.push(String(a));
+  pedir('/api/resumen?mes=' + estado.mes + '&anio=' + estado.anio).then(function (resumen) {
+    var filas = resumen.map(function (r) {
+      return '<tr><td><a href="#detalle/' + r.tipo + '">' + r.tipo + ' ' + r.nombre + '</a></td>' +
+             '<td>' + r.documentos + '</td><td>' + r.monto_total + '</td></tr>';
+    }).join('');
+    document.getElementById('app').innerHTML =
+      '<select id="periodoMes">' + opciones(meses, estado.mes) + '</select>' +
+      '<select id="periodoAnho">' + opciones(anios, estado.anio) + '</select>' +
+      '<button class="btn" onclick="consultar()">Consultar</button>' +
+      '<h3>Resúmenes por tipo de documento</h3>' +
+      '<table><tr><th>Tipo Documento</th><th>Total Documentos</th><th>Monto Total</th></tr>' + filas + '</table>';
+  });
+}
+
+function consultar() {
+  estado.mes = document.getElementById('periodoMes').value;
+  estado.anio = document.getElementById('periodoAnho').value;
+  mostrarResumen();
+}
+
+function mostrarDetalle(tipo) {
+  pedir('/api/detalle?tipo=' + tipo + '&mes=' + estado.mes + '&anio=' + estado.anio).then(function (detalle) {
+    var encabezado = '<tr>' + detalle.columnas.map(function (c) { return '<th>' + c + '</th>'; }).join('') + '</tr>';
+    var filas = detalle.filas.map(function (fila) {
+      return '<tr>' + fila.map(function (valor, i) {
+        if (detalle.columnas[i] === 'Folio') {
+          return '<td><a href="javascript:void(0)" onclick="verFolio(\\'' + tipo + '\\', \\'' + valor + '\\')">' + valor + '</a></td>';
+        }
+        return '<td>' + valor + '</td>';
+      }).join('') + '</tr>';
+    }).join('');
+    document.getElementById('app').innerHTML =
+      '<button class="btn" onclick="location.hash=\\'#resumen\\'">Volver</button>' +
+      '<table>' + encabezado + filas + '</table>';
+  });
+}
+
+function verFolio(tipo, folio) {
+  pedir('/api/folio?tipo=' + tipo + '&folio=' + folio + '&mes=' + estado.mes + '&anio=' + estado.anio).then(function (doc) {
+    var modal = document.createElement('div');
+    modal.className = 'modal';
+    modal.id = 'modal-folio';
+    modal.innerHTML = '<div class="modal-header"><button onclick="cerrarModal()">Cerrar</button></div>' +
+      '<p>Folio ' + doc.folio + '</p><p>Razón Social: ' + doc.razon_social + '</p>';
+    document.body.appendChild(modal);
+  });
+}
+
+function cerrarModal() {
+  var modal = document.getElementById('modal-folio');
+  if (modal) modal.remove();
+}
+
+document.addEventListener('keydown', function (e) { if (e.key === 'Escape') cerrarModal(); });
+
+window.addEventListener('hashchange', function () {
+  var hash = location.hash;
+  if (hash.indexOf('#detalle/') === 0) {
+    mostrarDetalle(hash.split('/')[1]);
+  } else {
+    mostrarResumen();
+  }
+});
+</script>
+</body></html>
+"""
+
+
+def _digito_verificador(numero):
+    suma, factor = 0, 2
+    for digito in reversed(str(numero)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: "0", 10: "K"}.get(resto, str(resto))
+
+
+def _formatear_monto(valor):
+    return f"{valor:,}".replace(",", ".")
+
+
+def generar_documentos(tipo, mes, anio, cantidad):
+    """
+    Genera filas deterministas para un tipo y período (misma semilla, mismos datos)
+
+    Returns:
+        list: Filas en el orden de COLUMNAS_DETALLE
+    """
+    generador = random.Random(f"{tipo}-{anio}-{mes}")
+    filas = []
+    for i in range(cantidad):
+        numero_rut = generador.randint(76000000, 79999999)
+        neto = generador.randint(1000, 5000000)
+        iva = round(neto * 0.19)
+        dia = generador.randint(1, 28)
+        filas.append([
+            str(i + 1),
+            tipo,
+            f"{numero_rut}-{_digito_verificador(numero_rut)}",
+            str(FOLIO_INICIAL + i),
+            f"{dia:02d}/{int(mes):02d}/{anio}",
+            f"{min(dia + 1, 28):02d}/{int(mes):02d}/{anio}",
+            "0",
+            _formatear_monto(neto),
+            _formatear_monto(iva),
+            _formatear_monto(neto + iva),
+        ])
+    return filas
+
+
+class PortalSimulado:
+    """
+    Servidor HTTP local que imita el portal del SII
+
+    Args:
+        rut: RUT aceptado en el login
+        clave: Clave aceptada en el login
+        documentos_por_tipo: Dict {tipo: cantidad de documentos por período}
+        latencia: Segundos de espera antes de cada respuesta
+        variacion: Segundos adicionales aleatorios (0..variacion) por respuesta
+        host: Interfaz de escucha
+        puerto: Puerto (0 para uno libre)
+    """
+
+    def __init__(self, rut="76123456-0", clave="clave", documentos_por_tipo=None, latencia=0.0,
+                 variacion=0.0, host="127.0.0.1", puerto=0):
+        self.rut = rut
+        self.clave = clave
+        self.documentos_por_tipo = dict(documentos_por_tipo or {"33": 20})
+        self.latencia = latencia
+        self.variacion = variacion
+        self._host = host
+        self._puerto = puerto
+        self._servidor = None
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._solicitudes = {}
+        self._sesiones = set()
+
+    @property
+    def url_base(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    @property
+    def url_login(self):
+        return f"{self.url_base}/cgi_misii/siihome.cgi"
+
+    @property
+    def url_rcv(self):
+        return f"{self.url_base}/consdcvinternetui"
+
+    def configurar(self, documentos_por_tipo=None, latencia=None, variacion=None):
+        """
+        Cambia el tamaño de los datos o la latencia sin reiniciar el servidor
+        """
+        with self._lock:
+            if documentos_por_tipo is not None:
+                self.documentos_por_tipo = dict(documentos_por_tipo)
+            if latencia is not None:
+                self.latencia = latencia
+            if variacion is not None:
+                self.variacion = variacion
+
+    def registrar_solicitud(self, ruta):
+        with self._lock:
+            self._solicitudes[ruta] = self._solicitudes.get(ruta, 0) + 1
+
+    def estadisticas(self):
+        """
+        Cantidad de solicitudes atendidas por ruta
+        """
+        with self._lock:
+            return {"total": sum(self._solicitudes.values()), "por_ruta": dict(self._solicitudes)}
+
+    def reiniciar_estadisticas(self):
+        with self._lock:
+            self._solicitudes.clear()
+
+    def esperar_latencia(self):
+        with self._lock:
+            espera = self.latencia + (random.uniform(0, self.variacion) if self.variacion else 0)
+        if espera > 0:
+            time.sleep(espera)
+
+    def crear_sesion(self):
+        token = f"{random.getrandbits(64):016x}"
+        with self._lock:
+            self._sesiones.add(token)
+        return token
+
+    def sesion_valida(self, token):
+        with self._lock:
+            return token in self._sesiones
+
+    def iniciar(self):
+        """
+        Inicia el servidor en un hilo daemon
+
+        Returns:
+            str: URL base del portal
+        """
+        portal = self
+
+        class Manejador(_ManejadorPortal):
+            pass
+
+        Manejador.portal = portal
+        self._servidor = ThreadingHTTPServer((self._host, self._puerto), Manejador)
+        self._servidor.daemon_threads = True
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, name="portal-simulado", daemon=True)
+        self._hilo.start()
+        logger.info("Portal simulado escuchando en %s", self.url_base)
+        return self.url_base
+
+    def detener(self):
+        if self._servidor:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+            logger.info("Portal simulado detenido")
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *args):
+        self.detener()
+
+
+class _ManejadorPortal(BaseHTTPRequestHandler):
+    portal = None
+
+    def log_message(self, formato, *args):
+        logger.debug("%s - %s", self.address_string(), formato % args)
+
+    def _responder(self, cuerpo, tipo="text/html; charset=utf-8", estado=200, cabeceras=None):
+        datos = cuerpo.encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(datos)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _redirigir(self, destino, cabeceras=None):
+        self.send_response(303)
+        self.send_header("Location", destino)
+        self.send_header("Content-Length", "0")
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+
+    def _autenticado(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return "sesion_sii" in cookie and self.portal.sesion_valida(cookie["sesion_sii"].value)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parametros = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.portal.registrar_solicitud(url.path)
+        self.portal.esperar_latencia()
+
+        if url.path == "/cgi_misii/siihome.cgi":
+            if self._autenticado():
+                return self._responder(_PAGINA_HOME)
+            return self._responder(_PAGINA_LOGIN % {"mensaje": ""})
+
+        if url.path == "/consdcvinternetui":
+            if not self._autenticado():
+                return self._redirigir("/cgi_misii/siihome.cgi")
+            hoy = date.today()
+            return self._responder(_PAGINA_RCV % {"mes": hoy.month, "anio": hoy.year})
+
+        if url.path.startswith("/api/"):
+            if not self._autenticado():
+                return self._responder(json.dumps({"detalle": "sesión expirada"}), "application/json", 401)
+            return self._api(url.path, parametros)
+
+        self._responder("No encontrado", "text/plain; charset=utf-8", 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.portal.registrar_solicitud(url.path)
+        self.portal.esperar_latencia()
+        if url.path != "/cgi_misii/login":
+            return self._responder("No encontrado", "text/plain; charset=utf-8", 404)
+
+        largo = int(self.headers.get("Content-Length") or 0)
+        formulario = {k: v[0] for k, v in parse_qs(self.rfile.read(largo).decode("utf-8")).items()}
+        if formulario.get("rutcntr") != self.portal.rut or formulario.get("clave") != self.portal.clave:
+            mensaje = "<p class='alerta'>La contraseña es incorrecta para el RUT ingresado</p>"
+            return self._responder(_PAGINA_LOGIN % {"mensaje": mensaje})
+
+        token = self.portal.crear_sesion()
+        self._redirigir("/cgi_misii/siihome.cgi", {"Set-Cookie": f"sesion_sii={token}; Path=/; HttpOnly"})
+
+    def _api(self, ruta, parametros):
+        mes, anio = parametros.get("mes", "01"), parametros.get("anio", "2025")
+        with self.portal._lock:
+            documentos = dict(self.portal.documentos_por_tipo)
+
+        if ruta == "/api/resumen":
+            resumen = []
+            for tipo, cantidad in sorted(documentos.items(), key=lambda t: int(t[0])):
+                filas = generar_documentos(tipo, mes, anio, cantidad)
+                total = sum(int(f[-1].replace(".", "")) for f in filas)
+                resumen.append({
+                    "tipo": tipo,
+                    "nombre": NOMBRES_TIPOS.get(tipo, f"Documento {tipo}"),
+                    "documentos": cantidad,
+                    "monto_total": _formatear_monto(total),
+                })
+            return self._responder(json.dumps(resumen), "application/json")
+
+        if ruta == "/api/detalle":
+            tipo = parametros.get("tipo", "")
+            filas = generar_documentos(tipo, mes, anio, documentos.get(tipo, 0))
+            return self._responder(json.dumps({"columnas": COLUMNAS_DETALLE, "filas": filas}), "application/json")
+
+        if ruta == "/api/folio":
+            folio = parametros.get("folio", "")
+            indice = int(folio) - FOLIO_INICIAL if folio.isdigit() else -1
+            return self._responder(json.dumps({
+                "folio": folio,
+                "razon_social": f"Proveedor Simulado {parametros.get('tipo', '')}-{indice:05d} SpA",
+            }), "application/json")
+
+        self._responder(json.dumps({"detalle": "ruta desconocida"}), "application/json", 404)
+
+
+def parsear_documentos(texto):
+    """
+    Convierte "33:200,61:10" en {"33": 200, "61": 10}
+    """
+    documentos = {}
+    for parte in texto.split(","):
+        if parte.strip():
+            tipo, _, cantidad = parte.partition(":")
+            documentos[tipo.strip()] = int(cantidad or 0)
+    return documentos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Portal SII simulado para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--rut", default="76123456-0")
+    parser.add_argument("--clave", default="clave")
+    parser.add_argument("--documentos", default="33:20", help="Documentos por tipo, ej: 33:200,61:10")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de espera por respuesta")
+    parser.add_argument("--variacion", type=float, default=0.0, help="Segundos aleatorios adicionales")
+    args = parser.parse_args()
+
+    portal = PortalSimulado(
+        rut=args.rut, clave=args.clave, documentos_por_tipo=parsear_documentos(args.documentos),
+        latencia=args.latencia, variacion=args.variacion, host=args.host, puerto=args.puerto
+    )
+    portal.iniciar()
+    logger.info("Login: %s | RCV: %s", portal.url_login, portal.url_rcv)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        portal.detener()
+
+
+if __name__ == "__main__":
+    # Solo al ejecutarlo como script: el portal no depende del resto del proyecto
+    from config import LOG_NIVEL, LOG_FORMATO, LOG_REGISTROS_POR_SEGUNDO
+    from bitacora import configurar_logging
+
+    configurar_logging(LOG_NIVEL, LOG_FORMATO, por_segundo=LOG_REGISTROS_POR_SEGUNDO)
+    main()
@@ -1,63 +1,465 @@
 """
 Módulo de procesamiento y limpieza de datos
 """
+import hashlib
 import logging
+from bisect import bisect_right
+from collections.abc import Sequence
+from itertools import accumulate, chain, islice
+import numpy as np
 import pandas as pd
 
+from config import LOTE_REGISTROS, POLITICAS_DEDUPLICACION
+
 logger = logging.getLogger("procesador")
 
 
+def _valor_presente(value):
+    # pd.isna descarta None, NaN, NaT y pd.NA (value == value falla con pd.NA)
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return False
+    return value != "" and value != "NaN"
+
+
 def limpiar_registro(registro):
     """
     Limpia un registro eliminando claves con valores vacíos, NaN o None
     """
-    registro_limpio = {}
-    for key, value in registro.items():
-        # Verificar si el valor no es NaN, None, vacío o "NaN" como string
-        if pd.notna(value) and value != "" and value != "NaN":
-            registro_limpio[key] = value
-    return registro_limpio
+    return {key: value for key, value in registro.items() if _valor_presente(value)}
+
+
+def _columna_rut_emisor(registro):
+    for columna in registro:
+        if "RUT" in columna.upper():
+            return columna
+    return None
+
+
+def _hash_clave(*partes):
+    """
+    Hash compacto (8 bytes) de las partes de una clave
+    """
+    return hashlib.blake2b("\x1f".join(partes).encode("utf-8"), digest_size=8).digest()
+
+
+def _clave_registro(registro, columna_rut):
+    """
+    Calcula la clave compuesta (RUT emisor, tipo de documento, folio) de un registro.
+    Los registros sin folio usan el hash de su contenido completo, de modo que solo
+    se eliminan si son idénticos.
+    
+    Returns:
+        tuple: (clave hasheada, bool indicando si el registro tiene folio)
+    """
+    folio = registro.get("Folio")
+    if folio:
+        rut = registro.get(columna_rut, "") if columna_rut else ""
+        rut = str(rut).replace(".", "").replace("-", "").replace(" ", "").upper()
+        return _hash_clave(rut, str(registro.get("Tipo Documento", "")), str(folio).strip()), True
+    contenido = sorted((str(k), str(v)) for k, v in registro.items())
+    return _hash_clave("sin_folio", *(f"{k}={v}" for k, v in contenido)), False
+
+
+def _limpiar_en_lugar(registro):
+    """
+    Elimina del propio registro las claves con valores vacíos (sin crear otro diccionario)
+    """
+    vacias = [key for key, value in registro.items() if not _valor_presente(value)]
+    for key in vacias:
+        del registro[key]
+    return registro
 
 
-def eliminar_duplicados(datos):
+def deduplicar(datos, politica="primero"):
     """
-    Elimina registros duplicados basándose en Folio únicamente
+    Elimina registros duplicados usando la clave compuesta (RUT emisor, tipo de
+    documento, folio) en tiempo lineal. Las claves se guardan como hashes de 8 bytes
+    para mantener bajo el uso de memoria con cientos de miles de registros, y los
+    registros se limpian en el lugar: la lista resultante comparte los diccionarios
+    de datos en vez de copiarlos.
+    
+    Args:
+        datos: Lista de diccionarios con los registros
+        politica: Cómo resolver registros con la misma clave:
+            "primero" conserva el primero, "ultimo" el último y
+            "mas_completo" el que tenga más campos con datos
+        
+    Returns:
+        tuple: (lista de registros únicos limpios, dict con estadísticas de colisiones)
+    """
+    if politica not in POLITICAS_DEDUPLICACION:
+        raise ValueError(f"Política de deduplicación inválida: {politica}. Opciones: {', '.join(POLITICAS_DEDUPLICACION)}")
+    
+    estadisticas = {
+        "politica": politica,
+        "registros_entrada": len(datos) if datos else 0,
+        "registros_unicos": 0,
+        "registros_vacios": 0,
+        "registros_sin_folio": 0,
+        "duplicados_eliminados": 0,
+        "claves_en_conflicto": 0,
+        "conflictos_con_diferencias": 0,
+        "reemplazos": 0
+    }
+    if not datos:
+        return [], estadisticas
+    
+    columna_rut = None
+    indices = {}  # clave -> posición en registros_unicos
+    claves_en_conflicto = set()
+    registros_unicos = []
+    
+    for registro in datos:
+        registro_limpio = _limpiar_en_lugar(registro)
+        if not registro_limpio:
+            estadisticas["registros_vacios"] += 1
+            continue
+        
+        if columna_rut is None:
+            columna_rut = _columna_rut_emisor(registro_limpio)
+        clave, tiene_folio = _clave_registro(registro_limpio, columna_rut)
+        if not tiene_folio:
+            estadisticas["registros_sin_folio"] += 1
+        
+        posicion = indices.get(clave)
+        if posicion is None:
+            indices[clave] = len(registros_unicos)
+            registros_unicos.append(registro_limpio)
+            continue
+        
+        estadisticas["duplicados_eliminados"] += 1
+        claves_en_conflicto.add(clave)
+        existente = registros_unicos[posicion]
+        if existente != registro_limpio:
+            estadisticas["conflictos_con_diferencias"] += 1
+        
+        if politica == "ultimo" or (
+            politica == "mas_completo" and len(registro_limpio) > len(existente)
+        ):
+            registros_unicos[posicion] = registro_limpio
+            estadisticas["reemplazos"] += 1
+    
+    estadisticas["registros_unicos"] = len(registros_unicos)
+    estadisticas["claves_en_conflicto"] = len(claves_en_conflicto)
+    return registros_unicos, estadisticas
+
+
+def eliminar_duplicados(datos, politica="primero", estadisticas=None):
+    """
+    Elimina registros duplicados por (RUT emisor, tipo de documento, folio)
+    
+    Args:
+        datos: Lista de diccionarios con los registros
+        politica: Política de conflicto ("primero", "ultimo" o "mas_completo")
+        estadisticas: Diccionario opcional donde se copian las estadísticas de colisiones
     """
     try:
         if not datos:
             logger.debug("No hay datos para procesar duplicados")
             return []
         
-        registros_iniciales = len(datos)
-        logger.info("Procesando %d registros para eliminar duplicados...", registros_iniciales)
-        
-        # Usar un diccionario para rastrear folios únicos
-        folios_vistos = {}
-        registros_unicos = []
+        logger.info("Procesando %d registros para eliminar duplicados (política: %s)...", len(datos), politica)
+        registros_unicos, resultado = deduplicar(datos, politica)
         
-        for registro in datos:
-            folio = registro.get('Folio')
-            if folio and folio not in folios_vistos:
-                # Limpiar el registro antes de agregarlo
-                registro_limpio = limpiar_registro(registro)
-                if registro_limpio:  # Solo agregar si tiene datos después de limpiar
-                    registros_unicos.append(registro_limpio)
-                    folios_vistos[folio] = True
+        if resultado["duplicados_eliminados"] > 0:
+            logger.warning(
+                "%d registros duplicados eliminados (%d claves en conflicto, %d con diferencias, %d reemplazos)",
+                resultado["duplicados_eliminados"], resultado["claves_en_conflicto"],
+                resultado["conflictos_con_diferencias"], resultado["reemplazos"]
+            )
+        if resultado["registros_vacios"] > 0:
+            logger.debug("%d registros vacíos descartados", resultado["registros_vacios"])
         
-        registros_finales = len(registros_unicos)
-        duplicados_eliminados = registros_iniciales - registros_finales
-        
-        if duplicados_eliminados > 0:
-            logger.warning("%d registros duplicados eliminados", duplicados_eliminados)
-        
-        logger.info("%d registros únicos obtenidos", registros_finales)
+        logger.info("%d registros únicos obtenidos", resultado["registros_unicos"])
+        if estadisticas is not None:
+            estadisticas.update(resultado)
         
         return registros_unicos
+    except ValueError:
+        raise
     except Exception as e:
         logger.error("Error al eliminar duplicados: %s", str(e))
         return datos
 
 
+def _es_columna_monto(columna):
+    return columna.startswith("Monto") or columna.startswith("Valor")
+
+
+def _es_columna_fecha(columna):
+    return columna.startswith("Fecha")
+
+
+def _es_columna_rut(columna):
+    return "RUT" in columna.upper()
+
+
+def _convertir_montos(serie):
+    """
+    Convierte montos en formato chileno ("1.234.567", "-1.234") a enteros de 64 bits.
+    Los textos de más de 18 dígitos (fuera de int64) quedan como inválidos
+    """
+    texto = serie.astype("string").str.strip().str.replace(".", "", regex=False)
+    validos = texto.str.fullmatch(r"-?0*\d{1,18}").fillna(False).astype(bool)
+    montos = pd.Series(pd.NA, index=serie.index, dtype="Int64")
+    montos[validos] = texto[validos].astype("int64")
+    return montos
+
+
+def _convertir_fechas(serie):
+    """
+    Convierte fechas "dd/mm/yyyy" (con hora opcional) a datetime64
+    """
+    texto = serie.astype("string").str.strip()
+    fechas = pd.to_datetime(texto, format="%d/%m/%Y %H:%M:%S", errors="coerce")
+    sin_hora = fechas.isna()
+    if sin_hora.any():
+        fechas[sin_hora] = pd.to_datetime(texto[sin_hora], format="%d/%m/%Y", errors="coerce")
+    return fechas
+
+
+# Pesos del módulo 11 para un cuerpo de RUT rellenado a 9 dígitos (de izquierda a derecha)
+_PESOS_RUT = np.array([4, 3, 2, 7, 6, 5, 4, 3, 2], dtype=np.int64)
+
+
+def _canonicalizar_ruts(serie):
+    """
+    Canonicaliza RUTs en cualquier formato ("12.345.678-5", "123456785", "12345678 k")
+    a "12345678-5" y valida el dígito verificador de forma vectorizada.
+    
+    Returns:
+        tuple: (Serie con RUTs canónicos, Serie booleana con RUTs válidos)
+    """
+    limpio = serie.astype("string").str.upper().str.replace(r"[^0-9K]", "", regex=True)
+    cuerpo = limpio.str[:-1]
+    dv = limpio.str[-1:]
+    
+    formato_ok = (cuerpo.str.len().between(1, 9) & cuerpo.str.isdigit()).fillna(False).to_numpy(dtype=bool)
+    validos = np.zeros(len(serie), dtype=bool)
+    
+    if formato_ok.any():
+        cuerpos = cuerpo[formato_ok].str.pad(9, side="left", fillchar="0").to_numpy(dtype="S9")
+        digitos = np.frombuffer(cuerpos.tobytes(), dtype=np.uint8).reshape(-1, 9).astype(np.int64) - 48
+        resto = 11 - (digitos @ _PESOS_RUT) % 11
+        esperado = np.where(resto == 11, "0", np.where(resto == 10, "K", resto.astype(str)))
+        validos[formato_ok] = esperado == dv[formato_ok].to_numpy(dtype=str)
+    
+    canonico = (cuerpo.str.lstrip("0") + "-" + dv).where(formato_ok)
+    return canonico, pd.Series(validos, index=serie.index)
+
+
+def normalizar_datos(datos, marcar_invalidos=True, columnas=None):
+    """
+    Normaliza en bloque (vectorizado) los registros extraídos: montos con separador
+    de miles a enteros, fechas a datetime64, RUTs a formato canónico con validación
+    del dígito verificador. Las filas con valores no interpretables se marcan.
+    
+    Args:
+        datos: Lista de diccionarios con los registros
+        marcar_invalidos: Si es True agrega las columnas "Registro Valido" y
+            "Errores Normalizacion"
+        columnas: Columnas del resultado (por defecto las de los registros); fija el
+            esquema cuando se normaliza por lotes
+        
+    Returns:
+        DataFrame: Datos con tipos fijos
+    """
+    df = pd.DataFrame(datos, columns=columnas)
+    if df.empty:
+        return df
+    
+    errores = pd.Series("", index=df.index, dtype="string")
+    
+    for columna in df.columns:
+        original = df[columna]
+        presente = original.notna() & (original.astype("string").str.strip() != "")
+        
+        if _es_columna_monto(columna):
+            df[columna] = _convertir_montos(original)
+            invalido = presente & df[columna].isna()
+        elif _es_columna_fecha(columna):
+            df[columna] = _convertir_fechas(original)
+            invalido = presente & df[columna].isna()
+        elif _es_columna_rut(columna):
+            canonico, validos = _canonicalizar_ruts(original)
+            df[columna] = canonico.astype("string")
+            invalido = presente & ~validos
+        elif columna in ("Tipo Documento", "Nombre Tipo Documento"):
+            df[columna] = original.astype("category")
+            continue
+        else:
+            df[columna] = original.astype("string")
+            continue
+        
+        if marcar_invalidos and invalido.any():
+            errores = errores.mask(invalido.fillna(False), errores + columna + ";")
+    
+    if marcar_invalidos:
+        df["Registro Valido"] = errores == ""
+        df["Errores Normalizacion"] = errores.str.rstrip(";").replace("", pd.NA)
+        invalidos = int((~df["Registro Valido"]).sum())
+        if invalidos:
+            logger.warning("%d registros con valores no interpretables", invalidos)
+    
+    logger.debug("DataFrame normalizado: %s", dict(df.dtypes.astype(str)))
+    return df
+
+
+def columnas_de(datos):
+    """
+    Columnas de una lista de registros en orden de aparición (como pd.DataFrame)
+    """
+    columnas = {}
+    for registro in datos:
+        for columna in registro:
+            if columna not in columnas:
+                columnas[columna] = None
+    return list(columnas)
+
+
+class RegistrosPorPeriodo(Sequence):
+    """
+    Registros de varios períodos vistos como una sola secuencia, sin copiarlos a una
+    lista nueva: cada grupo es la lista de registros de un período
+
+    Args:
+        grupos: Listas de registros, en el orden en que se recorren
+    """
+
+    def __init__(self, grupos):
+        self.grupos = [grupo for grupo in grupos if grupo]
+        self._inicios = list(accumulate((len(grupo) for grupo in self.grupos), initial=0))
+
+    def __len__(self):
+        return self._inicios[-1]
+
+    def __iter__(self):
+        return chain.from_iterable(self.grupos)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            inicio, fin, paso = indice.indices(len(self))
+            if paso != 1 or inicio >= fin:
+                return [self[i] for i in range(inicio, fin, paso)]
+            # Un lote (lotes_tipados) recorre solo los grupos que lo contienen
+            grupo = bisect_right(self._inicios, inicio) - 1
+            primero = islice(self.grupos[grupo], inicio - self._inicios[grupo], None)
+            return list(islice(chain(primero, *self.grupos[grupo + 1:]), fin - inicio))
+        if indice < 0:
+            indice += len(self)
+        if not 0 <= indice < len(self):
+            raise IndexError("índice de registro fuera de rango")
+        grupo = bisect_right(self._inicios, indice) - 1
+        return self.grupos[grupo][indice - self._inicios[grupo]]
+
+
+def lotes_tipados(datos, tamano=LOTE_REGISTROS, marcar_invalidos=True):
+    """
+    Normaliza los registros de a tamano (todos los lotes con las mismas columnas y tipos),
+    para procesar y exportar sin armar un DataFrame con todos los registros
+
+    Yields:
+        DataFrame: Lote normalizado
+    """
+    columnas = columnas_de(datos)
+    if not datos:
+        # Un lote vacío para que los escritores igual generen el archivo
+        yield normalizar_datos([], marcar_invalidos, columnas)
+    for inicio in range(0, len(datos), tamano):
+        yield normalizar_datos(datos[inicio:inicio + tamano], marcar_invalidos, columnas)
+
+
+def tipar_dataframe(datos):
+    """
+    Construye un DataFrame con esquema tipado a partir de los registros extraídos:
+    montos como Int64, fechas como datetime64, tipo de documento como categoría
+    y el resto de las columnas como texto.
+    
+    Args:
+        datos: Lista de diccionarios con los registros
+        
+    Returns:
+        DataFrame: Datos con tipos fijos, listo para formatos columnares
+    """
+    return normalizar_datos(datos, marcar_invalidos=False)
+
+
+# Columnas de montos agregadas y fragmentos con que se reconocen (como en almacen)
+_MONTOS_AGREGADOS = {
+    "monto_neto": ("MONTO", "NETO"),
+    "monto_iva": ("IVA",),
+    "monto_total": ("MONTO", "TOTAL"),
+}
+
+
+def _buscar_columna_df(df, *fragmentos):
+    for columna in df.columns:
+        nombre = str(columna).upper()
+        if all(f in nombre for f in fragmentos):
+            return columna
+    return None
+
+
+def calcular_agregados(df):
+    """
+    Calcula de forma vectorizada los totales de un período por tipo de documento,
+    por tipo y RUT del proveedor y por tipo y día del documento
+    
+    Args:
+        df: DataFrame normalizado (normalizar_datos) con la columna "Tipo Documento"
+        
+    Returns:
+        list: Tuplas (tipo_documento, dimension, clave, documentos, monto_neto, monto_iva, monto_total)
+              con dimension "tipo", "proveedor" o "dia"
+    """
+    if df.empty or "Tipo Documento" not in df.columns:
+        return []
+    
+    base = pd.DataFrame({"tipo": df["Tipo Documento"].astype(str)})
+    columna_rut = _buscar_columna_df(df, "RUT")
+    base["proveedor"] = df[columna_rut].astype("string").fillna("sin_rut") if columna_rut else "sin_rut"
+    columna_fecha = _buscar_columna_df(df, "FECHA DOC")
+    if columna_fecha is not None and pd.api.types.is_datetime64_any_dtype(df[columna_fecha]):
+        base["dia"] = df[columna_fecha].dt.strftime("%Y-%m-%d").fillna("sin_fecha")
+    else:
+        base["dia"] = "sin_fecha"
+    for nombre, fragmentos in _MONTOS_AGREGADOS.items():
+        columna = _buscar_columna_df(df, *fragmentos)
+        base[nombre] = df[columna].astype("Int64") if columna is not None else pd.Series(pd.NA, index=df.index, dtype="Int64")
+    
+    filas = []
+    for dimension, claves in (("tipo", ["tipo"]), ("proveedor", ["tipo", "proveedor"]), ("dia", ["tipo", "dia"])):
+        grupos = base.groupby(claves, sort=True, observed=True)
+        totales = grupos[list(_MONTOS_AGREGADOS)].sum(min_count=1)
+        totales["documentos"] = grupos.size()
+        for indice, fila in totales.iterrows():
+            tipo, clave = (indice, indice) if dimension == "tipo" else indice
+            filas.append((
+                tipo, dimension, str(clave), int(fila["documentos"]),
+                *(None if pd.isna(fila[m]) else int(fila[m]) for m in _MONTOS_AGREGADOS)
+            ))
+    return filas
+
+
+def sumar_agregados(acumulado, filas):
+    """
+    Acumula filas de calcular_agregados de varios lotes por (tipo, dimensión, clave)
+
+    Returns:
+        dict: {(tipo, dimension, clave): [documentos, monto_neto, monto_iva, monto_total]}
+    """
+    for tipo, dimension, clave, documentos, *montos in filas:
+        actual = acumulado.get((tipo, dimension, clave))
+        if actual is None:
+            acumulado[(tipo, dimension, clave)] = [documentos, *montos]
+            continue
+        actual[0] += documentos
+        for indice, monto in enumerate(montos, 1):
+            if monto is not None:
+                actual[indice] = monto if actual[indice] is None else actual[indice] + monto
+    return acumulado
+
+
 def mostrar_datos_ordenados(datos_tabla, numero_tabla):
     """
     Muestra los datos en formato tabular ordenado usando pandas
@@ -79,7 +481,9 @@ def mostrar_datos_ordenados(datos_tabla, numero_tabla):
         logger.info("TABLA %d - Total de registros: %d", numero_tabla, len(df))
         logger.info("="*80)
         logger.info("Columnas: %s", ', '.join(df.columns.tolist()))
-        logger.debug("\n%s", df.to_string(index=True))
+        # to_string recorre todo el DataFrame: solo si DEBUG está habilitado
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n%s", df.to_string(index=True))
         logger.info("="*80)
         
         return df
@@ -0,0 +1,286 @@
+"""
+Programador de extracciones (pre-calentamiento del almacén)
+
+Ejecuta extracciones según reglas tipo cron por contribuyente y período, en
+horarios de baja demanda, para que las solicitudes interactivas de POST
+/extraer se respondan desde el almacén histórico (ver
+almacen.periodo_vigente). Las extracciones programadas se encolan en el
+mismo planificador que las interactivas, por lo que respetan sus límites de
+concurrencia y el limitador de solicitudes al SII.
+
+Las reglas se leen de SII_PROGRAMACION (JSON) y de ARCHIVO_PROGRAMACION:
+
+    [{"rut": "76123456-7", "cron": "30 5 * * 1-5", "periodos": ["actual", "anterior"]},
+     {"rut": "*", "cron": "0 3 1 * *", "periodos": ["-2"], "tipos_documento": ["33"]}]
+
+"rut" acepta "*" (todos los contribuyentes registrados) y "periodos" acepta
+"actual", "anterior", desplazamientos en meses ("-2") o períodos fijos "YYYY-MM".
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from config import ARCHIVO_PROGRAMACION
+from contribuyentes import listar_contribuyentes, normalizar_rut
+from periodos import formatear_periodo
+from almacen import periodo_vigente
+from metricas import contar
+
+logger = logging.getLogger("programador")
+
+_NOMBRES_PERIODO = {"actual": 0, "anterior": -1}
+
+
+def _campo_cron(expresion, minimo, maximo):
+    """
+    Valores de un campo cron ("*", "5", "1-5", "*/15", "0,30", "10-50/10")
+    """
+    valores = set()
+    for parte in expresion.split(","):
+        rango, _, paso = parte.partition("/")
+        paso = int(paso) if paso else 1
+        if rango == "*":
+            inicio, fin = minimo, maximo
+        elif "-" in rango:
+            inicio, fin = (int(v) for v in rango.split("-", 1))
+        else:
+            inicio = int(rango)
+            fin = maximo if paso > 1 else inicio
+        if inicio < minimo or fin > maximo or inicio > fin or paso < 1:
+            raise ValueError(f"Campo cron fuera de rango: '{parte}' ({minimo}-{maximo})")
+        valores.update(range(inicio, fin + 1, paso))
+    return valores
+
+
+class ExpresionCron:
+    """
+    Expresión cron de 5 campos: minuto hora día-del-mes mes día-de-la-semana (0 o 7 = domingo)
+    """
+
+    def __init__(self, expresion):
+        campos = expresion.split()
+        if len(campos) != 5:
+            raise ValueError(f"La expresión cron debe tener 5 campos: '{expresion}'")
+        self.expresion = expresion
+        self.minutos = _campo_cron(campos[0], 0, 59)
+        self.horas = _campo_cron(campos[1], 0, 23)
+        self.dias = _campo_cron(campos[2], 1, 31)
+        self.meses = _campo_cron(campos[3], 1, 12)
+        self.dias_semana = {d % 7 for d in _campo_cron(campos[4], 0, 7)}
+        self._dia_libre = campos[2] == "*"
+        self._semana_libre = campos[4] == "*"
+
+    def coincide(self, fecha):
+        if fecha.minute not in self.minutos or fecha.hour not in self.horas or fecha.month not in self.meses:
+            return False
+        dia = fecha.day in self.dias
+        semana = (fecha.weekday() + 1) % 7 in self.dias_semana
+        # Como en cron: si se restringen ambos campos de día basta con que coincida uno
+        if self._dia_libre or self._semana_libre:
+            return dia and semana
+        return dia or semana
+
+    def proxima(self, desde, horizonte_dias=31):
+        """
+        Próximo minuto (posterior a desde) que coincide con la expresión, o None
+        """
+        fecha = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = fecha + timedelta(days=horizonte_dias)
+        while fecha < limite:
+            if self.coincide(fecha):
+                return fecha
+            fecha += timedelta(minutes=1)
+        return None
+
+
+def periodo_relativo(nombre, fecha):
+    """
+    Resuelve un período de una regla ("actual", "anterior", "-2", "2025-03") a (mes, anio)
+    """
+    nombre = str(nombre).strip().lower()
+    if nombre in _NOMBRES_PERIODO or (nombre.lstrip("+-").isdigit() and len(nombre) < 4):
+        desplazamiento = _NOMBRES_PERIODO.get(nombre)
+        if desplazamiento is None:
+            desplazamiento = int(nombre)
+        indice = fecha.year * 12 + fecha.month - 1 + desplazamiento
+        return indice % 12 + 1, indice // 12
+    anio, mes = nombre.split("-")
+    return int(mes), int(anio)
+
+
+class Regla:
+    """
+    Regla de pre-calentamiento: qué períodos extraer de qué contribuyente y cuándo
+    """
+
+    def __init__(self, rut, cron, periodos=("actual", "anterior"), tipos_documento=None):
+        self.rut = "*" if rut == "*" else normalizar_rut(rut)
+        self.cron = ExpresionCron(cron)
+        self.periodos = list(periodos)
+        self.tipos_documento = tipos_documento
+        self.ultima_ejecucion = None
+        # Validar los períodos al cargar la regla
+        for periodo in self.periodos:
+            periodo_relativo(periodo, datetime.now())
+
+    def ruts(self):
+        if self.rut != "*":
+            return [self.rut]
+        return [c["rut"] for c in listar_contribuyentes()]
+
+    def como_dict(self):
+        proxima = self.cron.proxima(datetime.now())
+        return {
+            "rut": self.rut,
+            "cron": self.cron.expresion,
+            "periodos": self.periodos,
+            "tipos_documento": self.tipos_documento,
+            "ultima_ejecucion": self.ultima_ejecucion,
+            "proxima_ejecucion": proxima.isoformat() if proxima else None,
+        }
+
+
+def cargar_reglas():
+    """
+    Lee las reglas configuradas (SII_PROGRAMACION y ARCHIVO_PROGRAMACION)
+    """
+    fuentes = []
+    if os.getenv("SII_PROGRAMACION"):
+        try:
+            fuentes.extend(json.loads(os.getenv("SII_PROGRAMACION")))
+        except ValueError as e:
+            logger.error("SII_PROGRAMACION no es un JSON válido: %s", str(e))
+
+    if ARCHIVO_PROGRAMACION and os.path.exists(ARCHIVO_PROGRAMACION):
+        try:
+            with open(ARCHIVO_PROGRAMACION, "r", encoding="utf-8") as f:
+                fuentes.extend(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error("Error al leer %s: %s", ARCHIVO_PROGRAMACION, str(e))
+
+    reglas = []
+    for entrada in fuentes:
+        try:
+            reglas.append(Regla(
+                entrada["rut"], entrada["cron"],
+                entrada.get("periodos", ("actual", "anterior")), entrada.get("tipos_documento")
+            ))
+        except (KeyError, ValueError) as e:
+            logger.error("Regla de programación inválida %s: %s", entrada, str(e))
+    logger.info("Programación cargada: %d reglas", len(reglas))
+    return reglas
+
+
+class Programador:
+    """
+    Hilo que evalúa las reglas una vez por minuto y encola en el planificador los
+    períodos que no tienen una extracción vigente
+
+    Args:
+        planificador: PlanificadorJusto donde se encolan las extracciones
+        reglas: Lista de Regla (por defecto las configuradas)
+    """
+
+    def __init__(self, planificador, reglas=None):
+        self._planificador = planificador
+        self.reglas = cargar_reglas() if reglas is None else reglas
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+        self._ultimo_minuto = None
+        self._estadisticas = {"disparos": 0, "periodos_encolados": 0, "periodos_vigentes": 0, "omitidos_en_curso": 0}
+
+    def iniciar(self):
+        if not self.reglas or self._hilo is not None:
+            return
+        self._hilo = threading.Thread(target=self._bucle, name="programador", daemon=True)
+        self._hilo.start()
+        logger.info("Programador iniciado con %d reglas", len(self.reglas))
+
+    def detener(self):
+        self._detener.set()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            ahora = datetime.now().replace(second=0, microsecond=0)
+            if ahora != self._ultimo_minuto:
+                self._ultimo_minuto = ahora
+                self.evaluar(ahora)
+            # Despertar al inicio del minuto siguiente
+            self._detener.wait(60 - time.time() % 60 + 0.05)
+
+    def evaluar(self, fecha):
+        """
+        Dispara las reglas que coinciden con fecha (precisión de minutos)
+
+        Returns:
+            list: Trabajos encolados
+        """
+        trabajos = []
+        for regla in self.reglas:
+            if not regla.cron.coincide(fecha):
+                continue
+            with self._lock:
+                regla.ultima_ejecucion = fecha.isoformat()
+                self._estadisticas["disparos"] += 1
+            for rut in regla.ruts():
+                trabajo = self._disparar(regla, rut, fecha)
+                if trabajo is not None:
+                    trabajos.append(trabajo)
+        return trabajos
+
+    def _disparar(self, regla, rut, fecha):
+        # No acumular trabajos si el contribuyente todavía tiene extracciones pendientes
+        if self._planificador.en_curso(rut):
+            logger.info("Regla '%s' omitida para %s***: tiene extracciones en curso", regla.cron.expresion, rut[:7])
+            with self._lock:
+                self._estadisticas["omitidos_en_curso"] += 1
+            return None
+
+        unidades = []
+        for nombre in regla.periodos:
+            mes, anio = periodo_relativo(nombre, fecha)
+            try:
+                vigente = periodo_vigente(rut, mes, anio, regla.tipos_documento)
+            except Exception as e:
+                logger.error("Error al consultar la vigencia de %02d/%d: %s", mes, anio, str(e))
+                vigente = None
+            if vigente:
+                logger.info("Período %02d/%d de %s*** al día (%s)", mes, anio, rut[:7], vigente["fecha_extraccion"])
+                contar("rcv_programador_periodos_total", ayuda="Períodos evaluados por el programador", resultado="vigente")
+                with self._lock:
+                    self._estadisticas["periodos_vigentes"] += 1
+                continue
+            unidades.append({"mes": mes, "anio": anio, "tipos_documento": regla.tipos_documento})
+
+        if not unidades:
+            return None
+        contar(
+            "rcv_programador_periodos_total", len(unidades),
+            ayuda="Períodos evaluados por el programador", resultado="encolado"
+        )
+        with self._lock:
+            self._estadisticas["periodos_encolados"] += len(unidades)
+        periodos = [formatear_periodo(u["mes"], u["anio"]) for u in unidades]
+        logger.info("Pre-calentando %s para %s***", ", ".join(periodos), rut[:7])
+        return self._planificador.enviar(
+            rut,
+            unidades,
+            parametros={
+                "periodo": {"periodos": periodos},
+                "tipos_documento": regla.tipos_documento,
+                "origen": "programado"
+            }
+        )
+
+    def estado(self):
+        with self._lock:
+            estadisticas = dict(self._estadisticas)
+        return {
+            "activo": self._hilo is not None and not self._detener.is_set(),
+            "reglas": [regla.como_dict() for regla in self.reglas],
+            **estadisticas,
+        }
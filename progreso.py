@@ -0,0 +1,186 @@
+"""
+Progreso en vivo de los trabajos de extracción
+
+Cada trabajo tiene un canal de Progreso asociado al hilo que lo ejecuta
+(igual que el resumen de métricas y la traza). El extractor y el scraper
+reportan la fase, el tipo i/n, las filas extraídas y los folios enriquecidos;
+el canal calcula el ETA y guarda los eventos en un buffer acotado que
+GET /progreso/{id} transmite como Server-Sent Events. Los registros de cada
+tipo también se publican apenas se extraen.
+
+Sin un canal activo en el hilo las funciones de reporte no hacen nada.
+"""
+import time
+import threading
+from collections import deque
+
+from config import PROGRESO_MAX_EVENTOS, PROGRESO_INTERVALO
+
+
+class _EstadoHilo(threading.local):
+    progreso = None
+
+
+_local = _EstadoHilo()
+
+
+class Progreso:
+    """
+    Canal de eventos de progreso de un trabajo
+
+    Args:
+        nombre: Nombre del canal (ej: id del trabajo)
+        capacidad: Cantidad máxima de eventos que se conservan para clientes que se conectan tarde
+    """
+
+    def __init__(self, nombre, capacidad=PROGRESO_MAX_EVENTOS):
+        self.nombre = nombre
+        self._lock = threading.Lock()
+        self._eventos = deque(maxlen=capacidad)
+        self._secuencia = 0
+        self._cerrado = False
+        self._ultima_publicacion = 0.0
+        self._inicio_folios = None
+        self._estado = {
+            "fase": None,
+            "periodo": None,
+            "tipo": None,
+            "tipo_indice": 0,
+            "tipos_total": 0,
+            "filas": 0,
+            "folios": 0,
+            "folios_total": 0,
+            "eta_segundos": None,
+        }
+
+    def _publicar(self, evento, datos):
+        """
+        Agrega un evento al buffer (con el lock tomado)
+        """
+        self._secuencia += 1
+        self._eventos.append({"id": self._secuencia, "evento": evento, "ts": round(time.time(), 3), **datos})
+        self._ultima_publicacion = time.monotonic()
+
+    def _calcular_eta(self):
+        estado = self._estado
+        if not self._inicio_folios or not estado["folios"] or estado["folios_total"] <= estado["folios"]:
+            return None
+        ritmo = (time.monotonic() - self._inicio_folios) / estado["folios"]
+        return round(ritmo * (estado["folios_total"] - estado["folios"]), 1)
+
+    def emitir(self, evento, **datos):
+        """
+        Publica un evento arbitrario (ej: "registros", "unidad")
+        """
+        with self._lock:
+            self._publicar(evento, datos)
+
+    def reportar(self, **cambios):
+        """
+        Actualiza el estado (fase, tipo, totales) y publica un evento "progreso"
+        """
+        with self._lock:
+            self._estado.update(cambios)
+            self._estado["eta_segundos"] = self._calcular_eta()
+            self._publicar("progreso", dict(self._estado))
+
+    def sumar(self, campo, cantidad=1):
+        """
+        Incrementa un contador del estado ("filas", "folios", "folios_total"). Los eventos
+        "progreso" resultantes se publican como máximo cada PROGRESO_INTERVALO segundos.
+        """
+        with self._lock:
+            if campo == "folios" and self._inicio_folios is None:
+                self._inicio_folios = time.monotonic()
+            self._estado[campo] += cantidad
+            if time.monotonic() - self._ultima_publicacion >= PROGRESO_INTERVALO:
+                self._estado["eta_segundos"] = self._calcular_eta()
+                self._publicar("progreso", dict(self._estado))
+
+    def cerrar(self, estado, **datos):
+        """
+        Publica el evento final del trabajo; los clientes terminan la transmisión al recibirlo
+        """
+        with self._lock:
+            self._estado["eta_segundos"] = None
+            self._publicar("fin", {"estado": estado, **self._estado, **datos})
+            self._cerrado = True
+            # El canal se conserva en el historial: no retener los registros publicados, solo su cantidad
+            for indice, evento in enumerate(self._eventos):
+                if isinstance(evento.get("registros"), list):
+                    evento = dict(evento, total_registros=len(evento["registros"]))
+                    del evento["registros"]
+                    self._eventos[indice] = evento
+
+    def estado(self):
+        """
+        Último estado de progreso
+        """
+        with self._lock:
+            return dict(self._estado)
+
+    def eventos_desde(self, ultimo_id=0):
+        """
+        Eventos posteriores a ultimo_id
+
+        Returns:
+            tuple: (lista de eventos, bool indicando si el canal está cerrado)
+        """
+        with self._lock:
+            if self._secuencia <= ultimo_id:
+                return [], self._cerrado
+            return [e for e in self._eventos if e["id"] > ultimo_id], self._cerrado
+
+
+def progreso_actual():
+    """
+    Canal de progreso asociado al hilo actual (o None)
+    """
+    return _local.progreso
+
+
+class usar_progreso:
+    """
+    Asocia un canal de progreso al hilo actual durante el bloque (None lo desactiva)
+    """
+
+    __slots__ = ("progreso", "anterior")
+
+    def __init__(self, progreso):
+        self.progreso = progreso
+
+    def __enter__(self):
+        self.anterior = _local.progreso
+        _local.progreso = self.progreso
+        return self.progreso
+
+    def __exit__(self, *args):
+        _local.progreso = self.anterior
+        return False
+
+
+def reportar(**cambios):
+    """
+    Actualiza el progreso del trabajo del hilo actual (sin efecto si no hay canal)
+    """
+    progreso = _local.progreso
+    if progreso is not None:
+        progreso.reportar(**cambios)
+
+
+def sumar(campo, cantidad=1):
+    """
+    Incrementa un contador del progreso del hilo actual
+    """
+    progreso = _local.progreso
+    if progreso is not None:
+        progreso.sumar(campo, cantidad)
+
+
+def emitir(evento, **datos):
+    """
+    Publica un evento en el canal del hilo actual
+    """
+    progreso = _local.progreso
+    if progreso is not None:
+        progreso.emitir(evento, **datos)
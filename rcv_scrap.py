@@ -0,0 +1,318 @@
+"""
+CLI por lotes de RCV Scrap (sin servidor HTTP)
+
+Ejecuta extracciones de uno o varios contribuyentes y rangos de períodos con
+el mismo motor que la API (planificador justo, sesión cacheada, limitador,
+almacén histórico) y escribe un archivo por contribuyente y período en un
+directorio de salida (<salida>/<rut>/<YYYY-MM>.<formato>). Pensado para
+backfills nocturnos sin levantar la API:
+
+    python -m rcv_scrap extraer --rut 76123456-7 --desde 2024-01 --hasta 2025-12 \\
+        --tipos 33,61 --trabajadores 4 --formato parquet --salida salida
+
+Con --procesos N las unidades (contribuyente, período y tipo) se reparten
+entre N procesos trabajadores con su propio navegador (ver supervisor.py).
+
+El progreso se muestra en stderr. El código de salida es 1 si alguna unidad
+terminó con error.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+from functools import partial
+
+from config import (
+    TRABAJADORES_EXTRACCION, MAX_UNIDADES_POR_CONTRIBUYENTE, PERIODOS_POR_UNIDAD, PROCESOS_EXTRACCION,
+    LOG_NIVEL, LOG_FORMATO, LOG_REGISTROS_POR_SEGUNDO
+)
+from bitacora import configurar_logging
+from contribuyentes import obtener_credenciales, listar_contribuyentes
+from periodos import periodos_en_rango, formatear_periodo
+from planificador import PlanificadorJusto
+from supervisor import SupervisorProcesos
+from procesador import lotes_tipados, columnas_de
+from guardador import guardar_datos_json, guardar_registros_excel, guardar_lotes
+
+logger = logging.getLogger("rcv_scrap")
+
+# Formato -> extensión del archivo de salida
+FORMATOS = {"parquet": "parquet", "csv": "csv", "json": "json", "excel": "xlsx"}
+
+
+def dividir_en_unidades(desde, hasta, tipos_documento=None, contextos=1, forzar=False,
+                        periodos_por_unidad=PERIODOS_POR_UNIDAD):
+    """
+    Divide un rango en unidades de trabajo de periodos_por_unidad períodos (como la API)
+    """
+    periodos = periodos_en_rango(desde, hasta)
+    return [
+        {
+            "desde": formatear_periodo(*periodos[i]),
+            "hasta": formatear_periodo(*periodos[min(i + periodos_por_unidad, len(periodos)) - 1]),
+            "tipos_documento": tipos_documento,
+            "contextos": contextos,
+            "forzar": forzar,
+        }
+        for i in range(0, len(periodos), periodos_por_unidad)
+    ]
+
+
+def escribir_periodo(datos_periodo, salida, formatos):
+    """
+    Escribe un archivo por formato con los datos completos de un período
+    (Excel fila a fila; Parquet y CSV lote a lote en una sola pasada)
+
+    Returns:
+        list: Rutas escritas
+    """
+    directorio = os.path.join(salida, datos_periodo["rut"])
+    os.makedirs(directorio, exist_ok=True)
+    periodo = formatear_periodo(datos_periodo["periodo"]["mes"], datos_periodo["periodo"]["anio"])
+    registros = datos_periodo["datos"]
+    rutas = {formato: os.path.join(directorio, f"{periodo}.{FORMATOS[formato]}") for formato in formatos}
+
+    if "json" in rutas:
+        guardar_datos_json(datos_periodo, rutas["json"])
+    if "excel" in rutas:
+        guardar_registros_excel(registros, rutas["excel"], columnas_de(registros))
+    if "parquet" in rutas or "csv" in rutas:
+        guardar_lotes(lotes_tipados(registros), rutas.get("parquet"), rutas.get("csv"))
+    return list(rutas.values())
+
+
+def escribir_periodos(resultado, salida, formatos):
+    """
+    Escribe los archivos de cada período del resultado de un rango
+
+    Returns:
+        list: Rutas escritas
+    """
+    # Los registros del rango ya vienen agrupados por período (RegistrosPorPeriodo)
+    registros_por_periodo = {grupo[0]["Periodo"]: grupo for grupo in resultado["datos"].grupos}
+
+    rutas = []
+    for info in resultado["periodos"]:
+        datos_periodo = {
+            "rut": resultado["rut"],
+            **{clave: valor for clave, valor in info.items() if clave not in ("mes", "anio")},
+            "periodo": {"mes": info["mes"], "anio": info["anio"]},
+            "datos": registros_por_periodo.get(formatear_periodo(info["mes"], info["anio"]), []),
+        }
+        rutas.extend(escribir_periodo(datos_periodo, salida, formatos))
+    return rutas
+
+
+def ejecutar_unidad(rut, salida, formatos, **kwargs):
+    """
+    Extrae una unidad de trabajo sin publicar las salidas del contribuyente y escribe sus
+    períodos en salida. El hilo conserva su navegador para las unidades siguientes.
+    """
+    from extractor import ejecutar_scraping_rango
+
+    resultado = ejecutar_scraping_rango(rut=rut, exportar=False, conservar_navegador=True, **kwargs)
+    if resultado:
+        rutas = escribir_periodos(resultado, salida, formatos)
+        logger.info("Unidad %s a %s de %s***: %d archivos", kwargs["desde"], kwargs["hasta"], rut[:7], len(rutas))
+    return resultado
+
+
+def _liberar_navegador():
+    # Solo si alguna unidad ya cargó extractor (y con él un navegador)
+    extractor = sys.modules.get("extractor")
+    if extractor is not None:
+        extractor.cerrar_navegador_del_hilo()
+
+
+def _linea_progreso(trabajo):
+    progreso = trabajo["progreso"] or {}
+    partes = [f"[{trabajo['rut']}] {trabajo['estado']} {trabajo['unidades_completadas']}/{trabajo['unidades_total']} unidades"]
+    if trabajo["estado"] == "ejecutando" and progreso.get("fase"):
+        detalle = progreso["fase"]
+        if progreso.get("periodo"):
+            detalle += f" {progreso['periodo']}"
+        if progreso.get("tipo"):
+            detalle += f" tipo {progreso['tipo']} ({progreso['tipo_indice']}/{progreso['tipos_total']})"
+        partes.append(detalle)
+    partes.append(f"{trabajo['total_registros'] or progreso.get('filas', 0)} registros")
+    if progreso.get("folios_total"):
+        partes.append(f"folios {progreso['folios']}/{progreso['folios_total']}")
+    if progreso.get("eta_segundos") is not None:
+        partes.append(f"ETA {progreso['eta_segundos']:.0f}s")
+    memoria = (trabajo.get("metricas") or {}).get("memoria")
+    if memoria and trabajo["estado"] in ("completado", "error"):
+        partes.append(f"RSS pico {memoria['rss_pico_mb']:.0f} MB")
+    if trabajo["error"]:
+        partes.append(f"error: {trabajo['error']}")
+    return " | ".join(partes)
+
+
+def esperar_trabajos(planificador, trabajos, intervalo=2.0, flujo=None):
+    """
+    Espera a que terminen los trabajos mostrando una línea por cada cambio de progreso
+
+    Returns:
+        list: Estado final de cada trabajo (como_dict)
+    """
+    flujo = flujo or sys.stderr
+    mostradas = {}
+    while True:
+        estados = [planificador.obtener(trabajo.id) for trabajo in trabajos]
+        for estado in estados:
+            linea = _linea_progreso(estado)
+            if mostradas.get(estado["id"]) != linea:
+                mostradas[estado["id"]] = linea
+                print(linea, file=flujo, flush=True)
+        if all(estado["estado"] in ("completado", "error") for estado in estados):
+            return estados
+        time.sleep(intervalo)
+
+
+def _lista(valores):
+    """
+    Une opciones repetibles y separadas por comas ("33,61" o --tipos 33 --tipos 61)
+    """
+    return [v.strip() for valor in valores or [] for v in valor.split(",") if v.strip()]
+
+
+def _resolver_ruts(valores):
+    ruts = _lista(valores)
+    if not ruts:
+        return [obtener_credenciales()[0]]
+    if "*" in ruts:
+        return [c["rut"] for c in listar_contribuyentes()]
+    return [obtener_credenciales(rut)[0] for rut in ruts]
+
+
+def extraer_en_procesos(args, ruts, formatos):
+    """
+    Modo multi-proceso: el supervisor reparte las unidades y este proceso escribe los archivos
+    """
+    periodos = periodos_en_rango(args.desde, args.hasta or args.desde)
+    total = len(ruts) * len(periodos)
+    completados = [0]
+
+    def al_completar(datos_completos):
+        completados[0] += 1
+        escribir_periodo(datos_completos, args.salida, formatos)
+        periodo = formatear_periodo(datos_completos["periodo"]["mes"], datos_completos["periodo"]["anio"])
+        origen = " (almacén)" if datos_completos.get("desde_almacen") else ""
+        print(
+            f"[{datos_completos['rut']}] {periodo}{origen} | {len(datos_completos['datos'])} registros | "
+            f"{completados[0]}/{total} períodos",
+            file=sys.stderr, flush=True
+        )
+
+    inicio = time.perf_counter()
+    supervisor = SupervisorProcesos(args.procesos)
+    estadisticas = supervisor.ejecutar(ruts, periodos, _lista(args.tipos) or None, args.forzar, al_completar)
+    for error in estadisticas["errores"]:
+        print(f"[{error['rut']}] {error['periodo']} | error: {error['error']}", file=sys.stderr)
+    print(
+        f"{estadisticas['periodos']}/{total} períodos ({estadisticas['desde_almacen']} desde el almacén), "
+        f"{estadisticas['registros']} registros en {args.salida} con {supervisor.procesos} procesos "
+        f"({time.perf_counter() - inicio:.1f}s)",
+        file=sys.stderr
+    )
+    return 1 if estadisticas["errores"] else 0
+
+
+def extraer(args, parser):
+    formatos = _lista(args.formato) or ["parquet"]
+    invalidos = [f for f in formatos if f not in FORMATOS]
+    if invalidos:
+        parser.error(f"Formato no soportado: {', '.join(invalidos)} (usa {', '.join(FORMATOS)})")
+    try:
+        ruts = _resolver_ruts(args.rut)
+        unidades = dividir_en_unidades(
+            args.desde, args.hasta or args.desde, _lista(args.tipos) or None, args.contextos, args.forzar,
+            args.periodos_por_unidad
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    if not ruts:
+        parser.error("No hay contribuyentes registrados")
+    if args.procesos > 0:
+        return extraer_en_procesos(args, ruts, formatos)
+
+    planificador = PlanificadorJusto(
+        partial(ejecutar_unidad, salida=args.salida, formatos=formatos),
+        trabajadores=args.trabajadores,
+        max_por_contribuyente=args.max_por_rut,
+        al_quedar_inactivo=_liberar_navegador
+    )
+    inicio = time.perf_counter()
+    trabajos = [
+        planificador.enviar(
+            rut,
+            [dict(unidad) for unidad in unidades],
+            parametros={
+                "periodo": {"desde": args.desde, "hasta": args.hasta or args.desde},
+                "tipos_documento": _lista(args.tipos) or None,
+                "origen": "cli"
+            }
+        )
+        for rut in ruts
+    ]
+    estados = esperar_trabajos(planificador, trabajos, args.intervalo)
+
+    errores = [estado for estado in estados if estado["estado"] == "error"]
+    print(
+        f"{len(estados) - len(errores)}/{len(estados)} contribuyentes completados, "
+        f"{sum(estado['total_registros'] for estado in estados)} registros en {args.salida} "
+        f"({time.perf_counter() - inicio:.1f}s)",
+        file=sys.stderr
+    )
+    return 1 if errores else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="rcv_scrap", description="Extracción por lotes del RCV sin servidor HTTP")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    extraccion = subparsers.add_parser(
+        "extraer", aliases=["extract"], help="Extraer un rango de períodos de uno o varios contribuyentes"
+    )
+    extraccion.add_argument(
+        "--rut", action="append",
+        help="RUT del contribuyente (repetible o separado por comas, '*' para todos; por defecto SII_RUT)"
+    )
+    extraccion.add_argument("--desde", required=True, help="Período inicial YYYY-MM")
+    extraccion.add_argument("--hasta", help="Período final YYYY-MM (por defecto igual a --desde)")
+    extraccion.add_argument("--tipos", action="append", help="Tipos de documento, ej: 33,61 (por defecto todos)")
+    extraccion.add_argument(
+        "--trabajadores", "--workers", type=int, default=TRABAJADORES_EXTRACCION,
+        help="Unidades de trabajo en paralelo"
+    )
+    extraccion.add_argument(
+        "--procesos", type=int, default=PROCESOS_EXTRACCION,
+        help="Procesos trabajadores con su propio navegador (0 = hilos en un solo proceso)"
+    )
+    extraccion.add_argument(
+        "--max-por-rut", type=int, default=MAX_UNIDADES_POR_CONTRIBUYENTE,
+        help="Máximo de unidades simultáneas de un mismo contribuyente"
+    )
+    extraccion.add_argument(
+        "--contextos", type=int, default=1, help="Contextos de navegador por unidad (comparten la sesión)"
+    )
+    extraccion.add_argument(
+        "--periodos-por-unidad", type=int, default=PERIODOS_POR_UNIDAD, help="Períodos por unidad de trabajo"
+    )
+    extraccion.add_argument(
+        "--formato", "--format", action="append", help=f"Formatos de salida ({', '.join(FORMATOS)}; por defecto parquet)"
+    )
+    extraccion.add_argument("--salida", default="salida", help="Directorio de salida")
+    extraccion.add_argument("--forzar", action="store_true", help="Extraer desde el SII aunque el período esté vigente")
+    extraccion.add_argument("--intervalo", type=float, default=2.0, help="Segundos entre actualizaciones de progreso")
+    extraccion.add_argument("--verbose", action="store_true", help="Mostrar los logs INFO del extractor")
+    args = parser.parse_args(argv)
+
+    configurar_logging(LOG_NIVEL, LOG_FORMATO, por_segundo=LOG_REGISTROS_POR_SEGUNDO)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    return extraer(args, parser)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
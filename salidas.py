@@ -0,0 +1,263 @@
+"""
+Versiones publicadas de los archivos de salida (JSON, Excel, Parquet y CSV)
+
+Cada exportación se escribe en un directorio temporal y se publica con un
+rename atómico como DIRECTORIO_SALIDAS/<version>/, donde la versión es el
+hash del contenido (RUT, período, tipos, resumen del SII y registros).
+
+Una versión queda como actual en uno o más ámbitos: el del contribuyente
+("rut-<RUT>") y, para las extracciones de la API, el del trabajo
+("trabajo-<id>"). Cada ámbito tiene su puntero
+DIRECTORIO_SALIDAS/punteros/<ambito>.json, reemplazado de forma atómica: un
+lector ve completa la versión anterior o la nueva, nunca un archivo a medio
+escribir, y las extracciones de un contribuyente nunca reemplazan las de otro.
+Las versiones publicadas no se modifican y la API las sirve directamente con
+FileResponse.
+
+Si el contenido no cambió la versión ya existe y no se reescribe; solo vuelve
+a quedar como actual. Cada ámbito conserva sus SALIDAS_VERSIONES más recientes,
+se conservan los punteros de los SALIDAS_TRABAJOS trabajos más recientes y una
+versión se elimina cuando ningún puntero la referencia.
+"""
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from config import DIRECTORIO_SALIDAS, SALIDAS_VERSIONES, SALIDAS_TRABAJOS
+from metricas import contar
+
+logger = logging.getLogger("salidas")
+
+_PUNTEROS = "punteros"
+_lock = threading.Lock()
+
+
+def ambito_rut(rut):
+    """
+    Ámbito de las salidas de un contribuyente (o de varios, con rut None)
+    """
+    return f"rut-{rut or 'todos'}"
+
+
+def ambito_trabajo(trabajo_id):
+    """
+    Ámbito de las salidas de un trabajo de la API
+    """
+    return f"trabajo-{trabajo_id}"
+
+
+def clave_contenido(datos_completos):
+    """
+    Hash del contenido exportable de una extracción (registro a registro, sin serializar todo junto)
+
+    Returns:
+        str: Nombre de la versión
+    """
+    encabezado = [
+        datos_completos.get("rut"),
+        datos_completos.get("periodo"),
+        sorted(datos_completos.get("tipos_documento_procesados") or []),
+        datos_completos.get("resumen_sii"),
+    ]
+    digest = hashlib.sha256(json.dumps(encabezado, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    for registro in datos_completos.get("datos") or []:
+        digest.update(b"\n")
+        digest.update(json.dumps(registro, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return digest.hexdigest()[:20]
+
+
+def _ruta_puntero(ambito):
+    # El ámbito viene de RUTs e ids de trabajo: solo se admiten caracteres seguros en un nombre de archivo
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", ambito) or ambito.startswith("."):
+        raise ValueError(f"Ámbito de salidas inválido: {ambito}")
+    return os.path.join(DIRECTORIO_SALIDAS, _PUNTEROS, f"{ambito}.json")
+
+
+def version_actual(ambito):
+    """
+    Puntero a la versión publicada actual del ámbito (o None si aún no tiene salidas)
+
+    Returns:
+        dict: {"ambito", "version", "fecha_publicacion", "archivos", "historial"}
+    """
+    try:
+        with open(_ruta_puntero(ambito), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("No se pudo leer el puntero de salidas %s: %s", ambito, str(e))
+        return None
+
+
+def ruta_actual(nombre, puntero):
+    """
+    Ruta de un archivo (ej: ARCHIVO_JSON) en la versión del puntero, o None si no existe
+    """
+    if not puntero or nombre not in puntero.get("archivos", []):
+        return None
+    ruta = os.path.join(DIRECTORIO_SALIDAS, puntero["version"], nombre)
+    return ruta if os.path.exists(ruta) else None
+
+
+def _escribir_puntero(ambito, puntero):
+    ruta = _ruta_puntero(ambito)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(puntero, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+
+
+def _punteros():
+    """
+    Punteros publicados: {ambito: puntero} (None si el puntero existe pero no se pudo leer)
+    """
+    directorio = os.path.join(DIRECTORIO_SALIDAS, _PUNTEROS)
+    try:
+        nombres = os.listdir(directorio)
+    except FileNotFoundError:
+        return {}
+    return {
+        nombre[:-len(".json")]: version_actual(nombre[:-len(".json")])
+        for nombre in nombres if nombre.endswith(".json")
+    }
+
+
+def _podar(descartadas, publicados):
+    """
+    Elimina los punteros de trabajos más antiguos (salvo los recién publicados) y las
+    versiones que ya no referencia ningún puntero (con el lock tomado). Si algún puntero
+    no se puede leer no se elimina ninguna versión, ya que podría ser una de las suyas
+    """
+    punteros = _punteros()
+    trabajos = sorted(
+        (
+            ambito for ambito, puntero in punteros.items()
+            if puntero and ambito.startswith(ambito_trabajo("")) and ambito not in publicados
+        ),
+        key=lambda ambito: os.stat(_ruta_puntero(ambito)).st_mtime_ns
+    )
+    conservar = max(0, SALIDAS_TRABAJOS - sum(1 for ambito in publicados if ambito.startswith(ambito_trabajo(""))))
+    for ambito in trabajos[:max(0, len(trabajos) - conservar)]:
+        descartadas.update(punteros.pop(ambito)["historial"])
+        try:
+            os.remove(_ruta_puntero(ambito))
+        except OSError:
+            pass
+    if not all(punteros.values()):
+        logger.warning("Hay punteros de salidas ilegibles: no se eliminan versiones anteriores")
+        return
+    referenciadas = {
+        version for puntero in punteros.values() for version in [puntero["version"], *puntero["historial"]]
+    }
+    # Las versiones descartadas que un lector tenga abiertas se siguen leyendo hasta cerrarlas
+    for version in descartadas - referenciadas:
+        shutil.rmtree(os.path.join(DIRECTORIO_SALIDAS, version), ignore_errors=True)
+
+
+def _escribir_version(clave, escribir):
+    """
+    Genera los archivos de una versión en un directorio temporal
+
+    Returns:
+        str: Ruta del directorio temporal, o None si la escritura falló
+    """
+    os.makedirs(DIRECTORIO_SALIDAS, exist_ok=True)
+    temporal = os.path.join(DIRECTORIO_SALIDAS, f".{clave}.{uuid.uuid4().hex[:8]}.tmp")
+    os.makedirs(temporal)
+    try:
+        escrito = escribir(temporal)
+    except Exception as e:
+        logger.error("Error al escribir la versión %s: %s", clave, str(e))
+        escrito = False
+    if escrito is False:
+        shutil.rmtree(temporal, ignore_errors=True)
+        return None
+    return temporal
+
+
+def _apuntar(clave, directorio, ambitos):
+    """
+    Deja la versión como actual en los ámbitos y poda las anteriores (con el lock tomado)
+
+    Returns:
+        list: Punteros escritos, en el orden de ambitos
+    """
+    punteros = []
+    archivos = sorted(os.listdir(directorio))
+    descartadas = set()
+    for ambito in ambitos:
+        anterior = version_actual(ambito) or {}
+        historial = [clave] + [v for v in anterior.get("historial", []) if v != clave]
+        puntero = {
+            "ambito": ambito,
+            "version": clave,
+            "fecha_publicacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "archivos": archivos,
+            "historial": historial[:SALIDAS_VERSIONES],
+        }
+        _escribir_puntero(ambito, puntero)
+        descartadas.update(historial[SALIDAS_VERSIONES:])
+        punteros.append(puntero)
+    _podar(descartadas, ambitos)
+    return punteros
+
+
+def publicar(clave, escribir, ambitos):
+    """
+    Publica una versión de las salidas y la deja como actual en los ámbitos dados
+
+    Args:
+        clave: Nombre de la versión (ver clave_contenido)
+        escribir: Función escribir(directorio) que genera los archivos; retorna False si falló
+        ambitos: Ámbitos cuyo puntero pasa a la nueva versión (ver ambito_rut y ambito_trabajo)
+
+    Returns:
+        dict: Puntero del primer ámbito, o None si la escritura falló (la versión anterior sigue vigente)
+    """
+    directorio = os.path.join(DIRECTORIO_SALIDAS, clave)
+    temporal, nueva = None, False
+    try:
+        while True:
+            # Los archivos se escriben fuera del lock; si la versión ya existe se reutiliza
+            if temporal is None and not os.path.isdir(directorio):
+                temporal = _escribir_version(clave, escribir)
+                if temporal is None:
+                    contar(
+                        "rcv_salidas_publicadas_total", ayuda="Versiones de archivos de salida publicadas",
+                        resultado="error"
+                    )
+                    return None
+            with _lock:
+                # Con el lock tomado ninguna poda puede eliminarla hasta que un puntero la referencie
+                if not os.path.isdir(directorio):
+                    if temporal is None:
+                        # Se podó entre la comprobación y el lock: escribirla de nuevo
+                        continue
+                    os.rename(temporal, directorio)
+                    temporal, nueva = None, True
+                elif temporal is None:
+                    logger.info("Salidas sin cambios (versión %s): no se reescriben", clave)
+                punteros = _apuntar(clave, directorio, ambitos)
+                break
+    finally:
+        if temporal is not None:
+            # Otra exportación publicó el mismo contenido mientras tanto
+            shutil.rmtree(temporal, ignore_errors=True)
+
+    contar(
+        "rcv_salidas_publicadas_total", ayuda="Versiones de archivos de salida publicadas",
+        resultado="nueva" if nueva else "sin_cambios"
+    )
+    logger.info(
+        "Salidas publicadas: versión %s en %s (%s)", clave, ", ".join(ambitos),
+        ", ".join(punteros[0]["archivos"] if punteros else [])
+    )
+    return punteros[0] if punteros else None
@@ -4,12 +4,158 @@ Módulo de extracción de datos del portal SII
 import time
 import re
 import logging
+from contextlib import contextmanager
 from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from config import *
+from limitador import limitador
+from metricas import medir, contar
+from trazas import span, trazado
+from progreso import sumar
+from selectores import resolutor
+from capturas import capturar_folio
 
 logger = logging.getLogger("scraper")
+# Mensajes por registro/folio: muestreados (ver bitacora.FiltroMuestreo)
+logger_registros = logging.getLogger("scraper.registros")
 
 
+class PeriodoNoSeleccionado(Exception):
+    """
+    El portal no confirmó el período solicitado: lo que muestre no corresponde a ese período
+    """
+
+
+# Tipos de solicitud que cuentan como respuesta del SII a una operación (no imágenes, fuentes ni estilos)
+_TIPOS_RED = ("document", "xhr", "fetch")
+# Solicitudes iniciadas hasta estos segundos después de la acción se consideran su respuesta
+_RED_QUIETA = 0.3
+# Tope de la espera de la respuesta dentro del permiso: un XHR más largo (polling, long-poll)
+# no se cuenta como latencia del SII; un documento que no responde en el tope sí es congestión
+_RESPUESTA_MAXIMA = 5.0
+# Tope de la espera (fuera del permiso) a que la página quede sin solicitudes pendientes
+_QUIETA_MAXIMA = 2.0
+
+
+class _RedPendiente:
+    """
+    Solicitudes de la página iniciadas durante una operación (eventos request/requestfinished/requestfailed)
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.pendientes = {}  # request -> instante en que se inició
+        self.ultima_actividad = time.monotonic()
+        self.error_servidor = False
+        self._oyentes = {
+            "request": self._iniciada,
+            "requestfinished": self._terminada,
+            "requestfailed": self._terminada,
+            "response": self._respuesta,
+        }
+        for evento, oyente in self._oyentes.items():
+            page.on(evento, oyente)
+
+    def _iniciada(self, request):
+        if request.resource_type in _TIPOS_RED:
+            self.ultima_actividad = time.monotonic()
+            self.pendientes[request] = self.ultima_actividad
+
+    def _terminada(self, request):
+        if self.pendientes.pop(request, None) is not None:
+            self.ultima_actividad = time.monotonic()
+
+    def _respuesta(self, response):
+        if response.request in self.pendientes and (response.status == 429 or response.status >= 500):
+            self.error_servidor = True
+
+    def esperar_respuesta(self, maximo):
+        """
+        Espera las solicitudes iniciadas por la operación (hasta _RED_QUIETA segundos después
+        de la acción); las que empiezan después, como un polling de la página, no se esperan
+
+        Returns:
+            list: Solicitudes de la operación que siguen pendientes al agotar el plazo
+        """
+        corte = time.monotonic() + _RED_QUIETA
+        limite = time.monotonic() + maximo
+        while True:
+            propias = [r for r, inicio in self.pendientes.items() if inicio <= corte]
+            ahora = time.monotonic()
+            if (not propias and ahora >= corte) or ahora >= limite:
+                return propias
+            # wait_for_timeout procesa los eventos de la página mientras espera
+            self.page.wait_for_timeout(50)
+
+    def esperar_quieta(self, maximo):
+        """
+        Espera a que no queden solicitudes pendientes durante _RED_QUIETA segundos
+
+        Returns:
+            bool: False si se agotó el plazo con solicitudes pendientes
+        """
+        limite = time.monotonic() + maximo
+        while self.pendientes or time.monotonic() - self.ultima_actividad < _RED_QUIETA:
+            if time.monotonic() >= limite:
+                return False
+            self.page.wait_for_timeout(50)
+        return True
+
+    def cerrar(self):
+        for evento, oyente in self._oyentes.items():
+            try:
+                self.page.remove_listener(evento, oyente)
+            except Exception:
+                pass
+
+
+@contextmanager
+def _solicitud(operacion, page=None):
+    """
+    Obtiene un permiso del limitador compartido para una navegación o clic que
+    genera tráfico hacia el SII. Los timeouts se informan como congestión.
+
+    Con page, el permiso se mantiene hasta que responden las solicitudes (documento y
+    XHR) que generó la operación, como máximo _RESPUESTA_MAXIMA segundos: la latencia que
+    recibe el limitador es el tiempo de respuesta del SII y no solo el del despacho del
+    clic. Un documento sin respuesta en ese plazo y las respuestas 429/5xx se informan
+    como congestión. Ya liberado el permiso se espera (con tope y medido aparte, fase
+    "red_quieta") a que la página no tenga solicitudes pendientes.
+    """
+    red = None
+    try:
+        with span("solicitud", operacion=operacion), limitador.permiso(operacion) as permiso:
+            red = _RedPendiente(page) if page is not None else None
+            try:
+                yield permiso
+                if red is not None:
+                    sin_respuesta = red.esperar_respuesta(_RESPUESTA_MAXIMA)
+                    if sin_respuesta:
+                        logger.debug(
+                            "%d solicitudes de '%s' sin respuesta tras %.1fs",
+                            len(sin_respuesta), operacion, _RESPUESTA_MAXIMA
+                        )
+                    if red.error_servidor or any(r.resource_type == "document" for r in sin_respuesta):
+                        permiso.congestion()
+            except PlaywrightTimeoutError:
+                permiso.congestion()
+                raise
+        if red is not None:
+            with medir("red_quieta", operacion=operacion):
+                red.esperar_quieta(_QUIETA_MAXIMA)
+    finally:
+        if red is not None:
+            red.cerrar()
+
+
+def _pausa(segundos, permiso):
+    """
+    Completa una espera fija contada desde el inicio de la solicitud (el tiempo de
+    respuesta ya esperado dentro del permiso se descuenta)
+    """
+    time.sleep(max(0.0, segundos - (time.monotonic() - permiso.inicio)))
+
+
+@trazado(argumentos=("url",))
 def navegar(page, url, timeout=60000):
     """
     Navega a una URL manejando redirects y generando logs detallados.
@@ -25,7 +171,10 @@ def navegar(page, url, timeout=60000):
     """
     logger.info("Navegando a: %s", url)
     try:
-        response = page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+        with _solicitud("navegar", page) as permiso:
+            response = page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+            if response and (response.status == 429 or response.status >= 500):
+                permiso.congestion()
         
         if response:
             status = response.status
@@ -50,6 +199,7 @@ def navegar(page, url, timeout=60000):
         raise
 
 
+@trazado()
 def login_sii(page, rut, clave):
     """
     Realiza el login en el portal del SII
@@ -59,11 +209,12 @@ def login_sii(page, rut, clave):
     # Click en "Ingresar a Mi SII"
     logger.info("Haciendo clic en 'Ingresar a Mi SII'")
     try:
-        page.click("text=Ingresar a Mi SII", timeout=30000)
+        with _solicitud("login", page) as permiso:
+            page.click("text=Ingresar a Mi SII", timeout=30000)
     except PlaywrightTimeoutError:
         logger.error("Timeout al hacer clic en 'Ingresar a Mi SII'")
         raise
-    time.sleep(SLEEP_MEDIUM)
+    _pausa(SLEEP_MEDIUM, permiso)
     logger.debug("Formulario de credenciales visible")
     
     # Completar RUT y clave
@@ -76,8 +227,9 @@ def login_sii(page, rut, clave):
 
     # Enviar formulario
     logger.info("Enviando formulario de login...")
-    page.click('button[id="bt_ingresar"]')
-    time.sleep(SLEEP_LONG)
+    with _solicitud("login", page) as permiso:
+        page.click('button[id="bt_ingresar"]')
+    _pausa(SLEEP_LONG, permiso)
     logger.debug("Formulario enviado, esperando respuesta del servidor")
     
     # Verificar si hay error de login
@@ -100,6 +252,7 @@ def login_sii(page, rut, clave):
     return True
 
 
+@trazado(argumentos=("mes", "anio"))
 def navegar_a_rcv(page, mes=None, anio=None):
     """
     Navega al módulo RCV y selecciona el período si se proporciona
@@ -113,171 +266,221 @@ def navegar_a_rcv(page, mes=None, anio=None):
 
     logger.info("Haciendo clic en botón de ingreso al RCV...")
     time.sleep(SLEEP_EXTRA_LONG)
-    page.click('button[class="btn btn-default btn-xs-block btn-block"]')
+    with _solicitud("ingreso_rcv", page) as permiso:
+        page.click('button[class="btn btn-default btn-xs-block btn-block"]')
     logger.debug("Botón clickeado, esperando carga del módulo")
-    time.sleep(3)
+    _pausa(SLEEP_LONG + SLEEP_MEDIUM, permiso)
     page.wait_for_load_state("networkidle")
     logger.debug("Módulo RCV cargado y en estado idle")
     
-    # Si se proporcionan mes y año, intentar seleccionarlos
+    # Si se proporcionan mes y año deben quedar aplicados: los datos del período por
+    # defecto no pueden guardarse bajo el período solicitado
     if mes and anio:
-        logger.info("Intentando seleccionar período: %02d/%d...", mes, anio)
-        try:
-            # Esperar a que los selectores de período estén disponibles
-            logger.debug("Esperando selector de mes...")
-            page.wait_for_selector('select#periodoMes', timeout=5000)
-            
-            # Seleccionar mes (formato con cero al inicio: "01", "02", etc.)
-            mes_formateado = f"{mes:02d}"
-            page.select_option('select#periodoMes', mes_formateado)
-            logger.info("Mes seleccionado: %s", mes_formateado)
-            time.sleep(SLEEP_SHORT)
-            
-            # Seleccionar año
-            selectores_anio = [
-                'select#periodoAnho',
-                'select#periodoAnio',
-                'select#periodoAno',
-                'select[ng-model*="periodo"][ng-model*="an" i]'
-            ]
-            
-            anio_seleccionado = False
-            for selector in selectores_anio:
-                try:
-                    if page.query_selector(selector):
-                        page.select_option(selector, str(anio))
-                        logger.info("Año seleccionado: %d con selector '%s'", anio, selector)
-                        anio_seleccionado = True
-                        time.sleep(SLEEP_SHORT)
-                        break
-                except Exception as e_anio:
-                    logger.debug("Selector '%s' no funcionó: %s", selector, str(e_anio))
-                    continue
-            
-            if not anio_seleccionado:
-                logger.warning("No se pudo seleccionar el año %d", anio)
-            
-            # Hacer clic en botón de consultar
-            botones_consultar = [
-                'button:has-text("Consultar")',
-                'button:has-text("Buscar")',
-                'button.btn:has-text("Consultar")',
-                'input[type="submit"]',
-                'button[type="submit"]'
-            ]
-            
-            for btn in botones_consultar:
-                try:
-                    if page.query_selector(btn):
-                        logger.info("Haciendo clic en botón consultar: %s", btn)
-                        page.click(btn)
-                        time.sleep(SLEEP_MEDIUM)
-                        page.wait_for_load_state("networkidle")
-                        logger.info("Período aplicado exitosamente: %02d/%d", mes, anio)
-                        break
-                except:
-                    logger.debug("Botón '%s' no disponible", btn)
-                    continue
-                
-        except Exception as e:
-            logger.warning("No se pudo cambiar el período: %s", str(e))
-            logger.info("Continuando con período por defecto del sistema")
+        if not seleccionar_periodo(page, mes, anio):
+            raise PeriodoNoSeleccionado(f"No se pudo seleccionar el período {mes:02d}/{anio} en el RCV")
     else:
         logger.info("Usando período por defecto del sistema")
 
 
-def obtener_tipos_documento_disponibles(page):
+@trazado(argumentos=("mes", "anio"))
+def seleccionar_periodo(page, mes, anio):
     """
-    Extrae los tipos de documentos disponibles de la tabla "Resúmenes por tipo de documento"
+    Cambia el período consultado desde la pantalla de resumen del RCV
+    (selectores de mes/año y botón consultar), sin volver a cargar el módulo
     
     Args:
-        page: Objeto page de Playwright
+        page: Objeto page de Playwright (en la pantalla de resumen)
+        mes: Mes a consultar (1-12)
+        anio: Año a consultar (ej: 2025)
         
     Returns:
-        list: Lista de códigos de tipos de documento disponibles (ej: ['33', '39', '61'])
+        bool: True si el período se aplicó
     """
-    logger.info("Extrayendo tipos de documentos disponibles...")
-    tipos_disponibles = []
-    
+    logger.info("Intentando seleccionar período: %02d/%d...", mes, anio)
     try:
-        # Esperar un poco para que la página cargue completamente
-        time.sleep(SLEEP_MEDIUM)
-        logger.debug("Página estabilizada para extracción")
+        # Esperar a que los selectores de período estén disponibles
+        logger.debug("Esperando selector de mes...")
+        page.wait_for_selector('select#periodoMes', timeout=5000)
         
-        # Buscar todos los enlaces con href que contengan "#detalle/"
-        logger.info("Buscando enlaces a detalles de documentos...")
-        enlaces = page.query_selector_all('a[href*="#detalle/"]')
+        # Seleccionar mes (formato con cero al inicio: "01", "02", etc.)
+        mes_formateado = f"{mes:02d}"
+        page.select_option('select#periodoMes', mes_formateado)
+        logger.info("Mes seleccionado: %s", mes_formateado)
+        time.sleep(SLEEP_SHORT)
         
-        if enlaces:
-            logger.info("Encontrados %d enlaces a detalles", len(enlaces))
-            for enlace in enlaces:
-                try:
-                    href = enlace.get_attribute("href")
-                    if href and "#detalle/" in href:
-                        # Extraer el código del tipo de documento
-                        tipo_doc = href.split("#detalle/")[1].strip()
-                        # Limpiar cualquier parámetro adicional
-                        if "?" in tipo_doc:
-                            tipo_doc = tipo_doc.split("?")[0]
-                        if "&" in tipo_doc:
-                            tipo_doc = tipo_doc.split("&")[0]
-                        if tipo_doc and tipo_doc.isdigit() and tipo_doc not in tipos_disponibles:
-                            tipos_disponibles.append(tipo_doc)
-                            # Intentar obtener el texto del enlace para más info
-                            try:
-                                texto = enlace.inner_text().strip()
-                                logger.debug("Tipo %s encontrado: %s", tipo_doc, texto[:50] if texto else 'sin descripción')
-                            except:
-                                logger.debug("Tipo de documento encontrado: %s", tipo_doc)
-                except Exception as e_enlace:
-                    logger.debug("Error al procesar enlace: %s", str(e_enlace))
-                    continue
+        # Seleccionar año
+        selectores_anio = [
+            'select#periodoAnho',
+            'select#periodoAnio',
+            'select#periodoAno',
+            'select[ng-model*="periodo"][ng-model*="an" i]'
+        ]
         
-        # Si no encontró enlaces, buscar en tablas directamente
-        if not tipos_disponibles:
-            logger.info("No se encontraron enlaces directos, buscando en tablas...")
-            tablas = page.query_selector_all("table")
-            logger.debug("Encontradas %d tablas en la página", len(tablas))
-            
-            for idx, tabla in enumerate(tablas):
-                try:
-                    # Buscar enlaces dentro de la tabla
-                    enlaces_tabla = tabla.query_selector_all('a[href*="#detalle/"]')
-                    if enlaces_tabla:
-                        logger.info("Tabla %d contiene %d enlaces a detalles", idx+1, len(enlaces_tabla))
-                        for enlace in enlaces_tabla:
-                            href = enlace.get_attribute("href")
-                            if href and "#detalle/" in href:
-                                tipo_doc = href.split("#detalle/")[1].strip().split("?")[0].split("&")[0]
-                                if tipo_doc and tipo_doc.isdigit() and tipo_doc not in tipos_disponibles:
-                                    tipos_disponibles.append(tipo_doc)
-                                    logger.debug("Tipo de documento extraído de tabla: %s", tipo_doc)
-                except Exception as e_tabla:
-                    logger.debug("Error al procesar tabla %d: %s", idx+1, str(e_tabla))
-                    continue
+        def seleccionar_anio(selector, _elemento):
+            page.select_option(selector, str(anio))
+            logger.info("Año seleccionado: %d con selector '%s'", anio, selector)
+            time.sleep(SLEEP_SHORT)
+
+        selector, _ = resolutor.probar(page, "periodo.anio", selectores_anio, seleccionar_anio)
+        anio_seleccionado = selector is not None
+        if not anio_seleccionado:
+            logger.warning("No se pudo seleccionar el año %d", anio)
         
-        if not tipos_disponibles:
-            logger.warning("No se encontraron tipos de documentos con métodos convencionales")
-            logger.info("Intentando extraer de cualquier enlace en la página con expresión regular...")
-            # Último intento: buscar cualquier patrón que parezca un tipo de documento
-            todo_html = page.content()
-            import re
-            patrones = re.findall(r'#detalle/(\d+)', todo_html)
-            if patrones:
-                tipos_disponibles = list(set(patrones))
-                logger.info("Encontrados %d tipos mediante expresión regular", len(tipos_disponibles))
-                for tipo in tipos_disponibles:
-                    logger.debug("Tipo extraído con regex: %s", tipo)
-        else:
-            logger.info("Total de tipos disponibles: %d", len(tipos_disponibles))
+        # Hacer clic en botón de consultar
+        botones_consultar = [
+            'button:has-text("Consultar")',
+            'button:has-text("Buscar")',
+            'button.btn:has-text("Consultar")',
+            'input[type="submit"]',
+            'button[type="submit"]'
+        ]
         
-        return sorted(tipos_disponibles)
+        def consultar(btn, _elemento):
+            logger.info("Haciendo clic en botón consultar: %s", btn)
+            with _solicitud("consultar_periodo", page) as permiso:
+                page.click(btn)
+            _pausa(SLEEP_MEDIUM, permiso)
+            page.wait_for_load_state("networkidle")
+
+        btn, _ = resolutor.probar(page, "periodo.consultar", botones_consultar, consultar)
+        if btn:
+            if not anio_seleccionado or not _periodo_confirmado(page, mes_formateado, selector, anio):
+                logger.warning("El portal no confirmó el período %02d/%d", mes, anio)
+                return False
+            logger.info("Período aplicado exitosamente: %02d/%d", mes, anio)
+            return True
+        
+        logger.warning("No se encontró botón para consultar el período %02d/%d", mes, anio)
+        return False
+            
+    except Exception as e:
+        logger.warning("No se pudo cambiar el período: %s", str(e))
+        return False
+
+
+def _periodo_confirmado(page, mes_formateado, selector_anio, anio):
+    """
+    Verifica que los selectores de mes y año sigan mostrando el período consultado
+    """
+    try:
+        return (
+            page.input_value('select#periodoMes') == mes_formateado
+            and page.input_value(selector_anio) == str(anio)
+        )
+    except Exception as e:
+        logger.debug("No se pudo leer el período aplicado: %s", str(e))
+        return False
+
+
+# Recolecta en una sola evaluación los enlaces #detalle/{tipo}, sus etiquetas y
+# las celdas de su fila en la tabla de resumen (con los encabezados de la tabla)
+_JS_RESUMEN_TIPOS = """
+() => {
+    const texto = (nodo) => (nodo && nodo.innerText ? nodo.innerText.trim() : "");
+    const enlaces = Array.from(document.querySelectorAll('a[href*="#detalle/"]')).map((a) => {
+        const codigo = (a.getAttribute("href") || "").match(/#detalle\\/(\\d+)/);
+        const fila = a.closest("tr");
+        const tabla = a.closest("table");
+        const primera = tabla ? tabla.querySelector("tr") : null;
+        return {
+            tipo: codigo ? codigo[1] : null,
+            etiqueta: texto(a),
+            celdas: fila ? Array.from(fila.querySelectorAll("th, td")).map(texto) : [],
+            encabezados: primera && primera !== fila
+                ? Array.from(primera.querySelectorAll("th, td")).map(texto) : [],
+        };
+    });
+    // Códigos referenciados fuera de <a> (ej: atributos ng-href u onclick), sin transferir el HTML
+    const otros = enlaces.length ? [] :
+        Array.from(new Set((document.body.innerHTML.match(/#detalle\\/(\\d+)/g) || [])))
+            .map((coincidencia) => coincidencia.split("/")[1]);
+    return {enlaces: enlaces, otros: otros};
+}
+"""
+
+
+def _entero_resumen(texto):
+    """
+    Convierte un valor de la tabla de resumen ("1.234", "$ -5.000") a entero, o None
+    """
+    limpio = re.sub(r"[.\s$]", "", texto or "")
+    return int(limpio) if re.fullmatch(r"-?\d+", limpio) else None
+
+
+def _fila_resumen(tipo, enlace):
+    """
+    Interpreta la fila de resumen de un tipo: cantidad de documentos y montos por columna
+    """
+    fila = {"tipo": tipo, "descripcion": enlace["etiqueta"], "documentos": None, "montos": {}}
+    for encabezado, valor in zip(enlace["encabezados"], enlace["celdas"]):
+        nombre = encabezado.upper()
+        if "DOCUMENTOS" in nombre and "TIPO" not in nombre:
+            fila["documentos"] = _entero_resumen(valor)
+        elif nombre.startswith("MONTO") or "IVA" in nombre:
+            monto = _entero_resumen(valor)
+            if monto is not None:
+                fila["montos"][encabezado] = monto
+    return fila
+
+
+@trazado(contar_resultado=True)
+def obtener_resumen_tipos(page):
+    """
+    Lee la tabla "Resúmenes por tipo de documento" con una única evaluación en la página
     
+    Args:
+        page: Objeto page de Playwright
+        
+    Returns:
+        list: Un dict por tipo con tipo, descripcion, documentos (int o None si la tabla
+              no lo informa) y montos ({encabezado: entero}), ordenados por código
+    """
+    logger.info("Extrayendo resumen por tipo de documento...")
+    try:
+        # Esperar un poco para que la página cargue completamente
+        time.sleep(SLEEP_MEDIUM)
+        recolectado = page.evaluate(_JS_RESUMEN_TIPOS)
     except Exception as e:
         logger.error("Error al extraer tipos de documento: %s", str(e))
         return []
+    
+    resumen = {}
+    for enlace in recolectado["enlaces"]:
+        tipo = enlace["tipo"]
+        if not tipo:
+            continue
+        fila = _fila_resumen(tipo, enlace)
+        # Un tipo puede tener varios enlaces (código y cantidad): conservar el que trae conteos
+        if tipo not in resumen or (resumen[tipo]["documentos"] is None and fila["documentos"] is not None):
+            resumen[tipo] = fila
+    for tipo in recolectado["otros"]:
+        if tipo not in resumen:
+            logger.debug("Tipo extraído fuera de enlaces: %s", tipo)
+            resumen[tipo] = {"tipo": tipo, "descripcion": "", "documentos": None, "montos": {}}
+    
+    if not resumen:
+        logger.warning("No se encontraron tipos de documentos en la tabla de resumen")
+    else:
+        logger.info("Total de tipos disponibles: %d", len(resumen))
+        for fila in resumen.values():
+            logger.debug("Tipo %s: %s documentos (%s)", fila["tipo"], fila["documentos"], fila["descripcion"][:50])
+    return [resumen[tipo] for tipo in sorted(resumen)]
 
 
+def obtener_tipos_documento_disponibles(page):
+    """
+    Extrae los tipos de documentos disponibles de la tabla "Resúmenes por tipo de documento"
+    
+    Args:
+        page: Objeto page de Playwright
+        
+    Returns:
+        list: Lista de códigos de tipos de documento disponibles (ej: ['33', '39', '61'])
+    """
+    return [fila["tipo"] for fila in obtener_resumen_tipos(page)]
+
+
+@trazado()
 def volver_a_resumen(page):
     """
     Vuelve a la pantalla de resumen usando el botón volver
@@ -299,22 +502,21 @@ def volver_a_resumen(page):
             '[onclick*="back"]'
         ]
         
-        for selector in botones_volver:
-            try:
-                boton = page.query_selector(selector)
-                if boton:
-                    logger.debug("Botón volver encontrado con selector: %s", selector)
-                    boton.click()
-                    time.sleep(SLEEP_MEDIUM)
-                    page.wait_for_load_state("networkidle")
-                    logger.info("Regresado a pantalla de resumen exitosamente")
-                    return True
-            except:
-                logger.debug("Selector '%s' no funcionó para volver", selector)
-                continue
+        def volver(selector, boton):
+            logger.debug("Botón volver encontrado con selector: %s", selector)
+            with _solicitud("volver_resumen", page) as permiso:
+                boton.click()
+            _pausa(SLEEP_MEDIUM, permiso)
+            page.wait_for_load_state("networkidle")
+
+        selector, _ = resolutor.probar(page, "resumen.volver", botones_volver, volver)
+        if selector:
+            logger.info("Regresado a pantalla de resumen exitosamente")
+            return True
         
         # Si no encuentra botón, intentar navegar directamente
         logger.warning("No se encontró botón volver, navegando directamente a URL RCV...")
+        contar("rcv_reintentos_total", ayuda="Reintentos y caminos de respaldo", operacion="volver_a_resumen")
         navegar(page, URL_RCV)
         time.sleep(SLEEP_MEDIUM)
         page.wait_for_load_state("networkidle")
@@ -335,6 +537,7 @@ def volver_a_resumen(page):
             return False
 
 
+@trazado(argumentos=("tipo_documento",))
 def navegar_a_detalle_tipo(page, tipo_documento):
     """
     Navega al detalle de un tipo de documento específico
@@ -342,25 +545,33 @@ def navegar_a_detalle_tipo(page, tipo_documento):
     Args:
         page: Objeto page de Playwright
         tipo_documento: Código del tipo de documento (33, 39, etc.)
+
+    Raises:
+        Exception: Si no se pudo abrir el detalle; lo que muestre la página no es el detalle del tipo
     """
-    navegar(page, url_detalle)
-    
     # Click en el detalle del tipo de documento
+    selector = f'a[href="#detalle/{tipo_documento}"]'
+    logger.debug("Haciendo clic en enlace: %s", selector)
     try:
-        selector = f'a[href="#detalle/{tipo_documento}"]'
-        logger.debug("Haciendo clic en enlace: %s", selector)
-        page.click(selector)
-        time.sleep(3)
-        logger.info("Detalle del tipo %s cargado exitosamente", tipo_documento)
+        with _solicitud("detalle_tipo", page) as permiso:
+            page.click(selector)
     except Exception as e:
-        logger.warning("Advertencia al hacer clic en detalle del tipo %s: %s", tipo_documento, str(e))
-        time.sleep(2)
+        logger.error("No se pudo abrir el detalle del tipo %s: %s", tipo_documento, str(e))
+        raise
+    _pausa(SLEEP_LONG + SLEEP_MEDIUM, permiso)
+    logger.info("Detalle del tipo %s cargado exitosamente", tipo_documento)
 
 
+@trazado(contar_resultado=True)
 def parsear_tabla(tabla):
     """
     Parsea una tabla HTML y la convierte en una lista de diccionarios
     """
+    with medir("parseo_tabla"):
+        return _parsear_tabla(tabla)
+
+
+def _parsear_tabla(tabla):
     try:
         # Obtener todas las filas
         filas = tabla.query_selector_all("tr")
@@ -397,62 +608,49 @@ def parsear_tabla(tabla):
         return []
 
 
+@trazado(argumentos=("folio",))
 def extraer_razon_social(page, folio):
     """
     Extrae la razón social del emisor desde el detalle del documento
     """
-    logger.debug("Extrayendo razón social para folio %s", folio)
+    with medir("enriquecimiento_folio"):
+        return _extraer_razon_social(page, folio)
+
+
+def _extraer_razon_social(page, folio):
+    logger_registros.debug("Extrayendo razón social para folio %s", folio)
     try:
         # Buscar el link/botón del folio para hacer clic
         folio_selector = f'a:has-text("{folio}")'
         elemento = page.query_selector(folio_selector)
         
         if elemento:
-            logger.debug("Elemento del folio %s encontrado, haciendo clic...", folio)
+            logger_registros.debug("Elemento del folio %s encontrado, haciendo clic...", folio)
             # Hacer clic para abrir el detalle (abre un modal/pop-up)
-            elemento.click()
-            time.sleep(SLEEP_LONG)
-            logger.debug("Modal de detalle abierto para folio %s", folio)
+            with _solicitud("detalle_folio", page) as permiso:
+                elemento.click()
+            _pausa(SLEEP_LONG, permiso)
+            logger_registros.debug("Modal de detalle abierto para folio %s", folio)
             
             # Buscar la razón social en el detalle
-            razon_social = None
             texto_detalle = page.inner_text("body")
-            logger.debug("Texto del detalle extraído (%d caracteres)", len(texto_detalle))
-            
-            # Buscar patrones comunes
-            patrones = [
-                r"Razón Social[:\s]+([^\n]+)",
-                r"Emisor[:\s]+([^\n]+)",
-                r"Nombre[:\s]+([^\n]+)",
-            ]
-            
-            for patron in patrones:
-                match = re.search(patron, texto_detalle, re.IGNORECASE)
-                if match:
-                    razon_social = match.group(1).strip()
-                    # Limpiar prefijos no deseados
-                    razon_social = re.sub(
-                        r'^(Emisor|Razón Social|Nombre)\s*[::\t]+\s*', 
-                        '', 
-                        razon_social, 
-                        flags=re.IGNORECASE
-                    ).strip()
-                    logger.debug("Razón social encontrada con patrón '%s': %s", patron, razon_social)
-                    break
+            logger_registros.debug("Texto del detalle extraído (%d caracteres)", len(texto_detalle))
+            capturar_folio(folio, texto_detalle)
+            razon_social = razon_social_desde_texto(texto_detalle)
             
             if not razon_social:
-                logger.debug("No se encontró razón social con patrones predefinidos para folio %s", folio)
+                logger_registros.debug("No se encontró razón social con patrones predefinidos para folio %s", folio)
             
             # Cerrar el modal/pop-up
-            logger.debug("Cerrando modal de folio %s", folio)
+            logger_registros.debug("Cerrando modal de folio %s", folio)
             cerrar_modal(page)
             
             return razon_social
         
-        logger.debug("No se encontró elemento para folio %s", folio)
+        logger_registros.debug("No se encontró elemento para folio %s", folio)
         return None
     except Exception as e:
-        logger.error("Error al extraer razón social del folio %s: %s", folio, str(e))
+        logger_registros.error("Error al extraer razón social del folio %s: %s", folio, str(e))
         # Intentar cerrar el modal por si quedó abierto
         try:
             page.keyboard.press('Escape')
@@ -461,11 +659,39 @@ def extraer_razon_social(page, folio):
         return None
 
 
+def razon_social_desde_texto(texto_detalle):
+    """
+    Busca la razón social del emisor en el texto del detalle de un documento
+    """
+    # Buscar patrones comunes
+    patrones = [
+        r"Razón Social[:\s]+([^\n]+)",
+        r"Emisor[:\s]+([^\n]+)",
+        r"Nombre[:\s]+([^\n]+)",
+    ]
+    
+    for patron in patrones:
+        match = re.search(patron, texto_detalle, re.IGNORECASE)
+        if match:
+            razon_social = match.group(1).strip()
+            # Limpiar prefijos no deseados
+            razon_social = re.sub(
+                r'^(Emisor|Razón Social|Nombre)\s*[::\t]+\s*', 
+                '', 
+                razon_social, 
+                flags=re.IGNORECASE
+            ).strip()
+            logger_registros.debug("Razón social encontrada con patrón '%s': %s", patron, razon_social)
+            return razon_social
+    return None
+
+
+@trazado()
 def cerrar_modal(page):
     """
     Cierra un modal/pop-up abierto
     """
-    logger.debug("Intentando cerrar modal...")
+    logger_registros.debug("Intentando cerrar modal...")
     try:
         # Buscar botón de cerrar (X, Cerrar, etc.)
         close_selectors = [
@@ -477,29 +703,36 @@ def cerrar_modal(page):
             'button[data-dismiss="modal"]'
         ]
         
-        for selector in close_selectors:
-            close_button = page.query_selector(selector)
-            if close_button:
-                logger.debug("Botón cerrar encontrado con selector: %s", selector)
-                close_button.click()
-                time.sleep(SLEEP_SHORT)
-                logger.debug("Modal cerrado exitosamente")
-                return
+        def cerrar(selector, close_button):
+            logger_registros.debug("Botón cerrar encontrado con selector: %s", selector)
+            close_button.click()
+            time.sleep(SLEEP_SHORT)
+
+        selector, _ = resolutor.probar(page, "modal.cerrar", close_selectors, cerrar)
+        if selector:
+            logger_registros.debug("Modal cerrado exitosamente")
+            return
         
         # Si no encuentra botón, presionar ESC
-        logger.debug("No se encontró botón cerrar, presionando ESC")
+        logger_registros.debug("No se encontró botón cerrar, presionando ESC")
         page.keyboard.press('Escape')
         time.sleep(SLEEP_SHORT)
     except:
         # Si falla, intentar con ESC
-        logger.debug("Error al cerrar modal, intentando con ESC")
+        logger_registros.debug("Error al cerrar modal, intentando con ESC")
         page.keyboard.press('Escape')
         time.sleep(SLEEP_SHORT)
 
 
-def extraer_datos_tablas(page):
+@trazado(contar_resultado=True)
+def extraer_datos_tablas(page, renovar=None):
     """
     Extrae datos de todas las tablas en la página actual
+
+    Args:
+        page: Página en el detalle de un tipo de documento
+        renovar: Función renovar(page) llamada antes de cada folio que retorna la página a usar;
+            si retorna otra (contexto reciclado, ya en el mismo detalle) se continúa en ella
     """
     logger.info("Iniciando extracción de datos de tablas...")
     tablas = page.query_selector_all("table")
@@ -511,7 +744,11 @@ def extraer_datos_tablas(page):
     logger.info("Encontradas %d tablas para procesar", len(tablas))
     todos_los_datos = []
     
-    for idx, tabla in enumerate(tablas):
+    for idx in range(len(tablas)):
+        if idx >= len(tablas):
+            logger.warning("La página renovada tiene menos tablas (%d); se omiten las restantes", len(tablas))
+            break
+        tabla = tablas[idx]
         time.sleep(SLEEP_MEDIUM)
         logger.info("Procesando Tabla %d de %d...", idx+1, len(tablas))
         
@@ -526,16 +763,23 @@ def extraer_datos_tablas(page):
             logger.info("Extrayendo razones sociales para %d registros...", len(datos_tabla))
             for reg_idx, registro in enumerate(datos_tabla):
                 folio = registro.get('Folio')
+                if folio and renovar is not None:
+                    nueva = renovar(page)
+                    if nueva is not page:
+                        # Las tablas de la página anterior ya no son válidas
+                        page = nueva
+                        tablas = page.query_selector_all("table")
                 if folio:
-                    logger.debug("Procesando registro %d/%d - Folio: %s", reg_idx+1, len(datos_tabla), folio)
+                    logger_registros.debug("Procesando registro %d/%d - Folio: %s", reg_idx+1, len(datos_tabla), folio)
                     razon_social = extraer_razon_social(page, folio)
+                    sumar("folios")
                     if razon_social:
                         registro['Razon Social Emisor'] = razon_social
-                        logger.debug("Folio %s: razón social obtenida - %s", folio, razon_social)
+                        logger_registros.debug("Folio %s: razón social obtenida - %s", folio, razon_social)
                     else:
-                        logger.debug("Folio %s: no se pudo obtener razón social", folio)
+                        logger_registros.debug("Folio %s: no se pudo obtener razón social", folio)
                 else:
-                    logger.debug("Registro %d sin folio, saltando extracción de razón social", reg_idx+1)
+                    logger_registros.debug("Registro %d sin folio, saltando extracción de razón social", reg_idx+1)
             
             todos_los_datos.extend(datos_tabla)
         else:
@@ -0,0 +1,247 @@
+"""
+Resolución de selectores con caché aprendida
+
+Varias pantallas del SII se resuelven probando una lista de selectores
+candidatos en orden (botón "Volver", selector de año, botón consultar, cerrar
+modal). Cada prueba es un round-trip al navegador. El resolutor recuerda qué
+candidato funcionó en cada estado de página (contexto + URL), lo prueba
+primero, persiste el ranking entre ejecuciones y, si falla, verifica todos los
+candidatos restantes con una sola consulta combinada antes de probarlos uno
+a uno.
+"""
+import os
+import json
+import fcntl
+import logging
+import tempfile
+import threading
+from urllib.parse import urlparse
+
+from config import ARCHIVO_SELECTORES
+from metricas import contar
+
+logger = logging.getLogger("selectores")
+
+
+class ResolutorSelectores:
+    """
+    Caché de selectores ganadores por estado de página
+
+    Args:
+        ruta: Archivo JSON donde se persiste el ranking (None para no persistir)
+    """
+
+    def __init__(self, ruta=None):
+        self._ruta = ruta
+        self._lock = threading.Lock()
+        self._ranking = None  # clave -> {selector: aciertos}
+        self._pendientes = {}  # aciertos aún no persistidos, con la misma forma
+        self._descartados = set()  # (clave, selector) a quitar del archivo al persistir
+        self._consultas = 0
+        self._aciertos_aprendidos = 0
+        self._consultas_combinadas = 0
+        self._sondeos_realizados = 0
+        self._sondeos_secuenciales = 0
+
+    def _cargar(self):
+        """
+        Carga el ranking persistido (con el lock tomado)
+        """
+        if self._ranking is not None:
+            return
+        self._ranking = {}
+        if self._ruta and os.path.exists(self._ruta):
+            try:
+                with open(self._ruta, "r", encoding="utf-8") as f:
+                    self._ranking = json.load(f)
+                logger.info("Ranking de selectores cargado: %d estados de página", len(self._ranking))
+            except (OSError, ValueError) as e:
+                logger.warning("No se pudo leer %s: %s", self._ruta, str(e))
+
+    def _guardar(self):
+        """
+        Persiste el ranking de forma atómica (con el lock tomado)
+
+        Varios procesos pueden compartir el archivo: bajo un lock de archivo se relee el
+        ranking en disco, se le suman los aciertos pendientes de este proceso y se
+        reemplaza desde un temporal propio (quitando los selectores descartados).
+        """
+        if not self._ruta:
+            return
+        temporal = None
+        try:
+            directorio = os.path.dirname(os.path.abspath(self._ruta))
+            with open(f"{self._ruta}.lock", "a") as bloqueo:
+                fcntl.flock(bloqueo, fcntl.LOCK_EX)
+                ranking = {}
+                if os.path.exists(self._ruta):
+                    try:
+                        with open(self._ruta, "r", encoding="utf-8") as f:
+                            ranking = json.load(f)
+                    except ValueError as e:
+                        logger.warning("Ranking de selectores ilegible, se reescribe: %s", str(e))
+                for clave, selector in self._descartados:
+                    ranking.get(clave, {}).pop(selector, None)
+                for clave, conteos in self._pendientes.items():
+                    destino = ranking.setdefault(clave, {})
+                    for selector, aciertos in conteos.items():
+                        destino[selector] = destino.get(selector, 0) + aciertos
+                descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+                with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+                    json.dump(ranking, f, ensure_ascii=False, indent=2, sort_keys=True)
+                os.replace(temporal, self._ruta)
+                temporal = None
+            self._ranking = ranking
+            self._pendientes = {}
+            self._descartados = set()
+        except OSError as e:
+            logger.warning("No se pudo guardar el ranking de selectores: %s", str(e))
+        finally:
+            if temporal:
+                try:
+                    os.remove(temporal)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _clave(page, contexto):
+        url = urlparse(page.url)
+        return f"{contexto}@{url.netloc}{url.path}"
+
+    def _registrar(self, clave, selector, sondeos, sondeos_secuenciales, aprendido):
+        ayuda = "Sondeos de selectores: realizados vs. los que requeriría probar en orden"
+        contar("rcv_selectores_sondeos_total", sondeos, ayuda=ayuda, tipo="realizados")
+        contar("rcv_selectores_sondeos_total", sondeos_secuenciales, ayuda=ayuda, tipo="secuenciales")
+        with self._lock:
+            self._consultas += 1
+            self._sondeos_realizados += sondeos
+            self._sondeos_secuenciales += sondeos_secuenciales
+            if aprendido:
+                self._aciertos_aprendidos += 1
+            if selector is None:
+                return
+            conteos = self._ranking.setdefault(clave, {})
+            mejor_anterior = max(conteos, key=conteos.get) if conteos else None
+            conteos[selector] = conteos.get(selector, 0) + 1
+            pendientes = self._pendientes.setdefault(clave, {})
+            pendientes[selector] = pendientes.get(selector, 0) + 1
+            # Persistir cuando cambia el ganador o periódicamente para conservar los conteos
+            if mejor_anterior != max(conteos, key=conteos.get) or conteos[selector] % 50 == 0:
+                self._guardar()
+
+    def resolver(self, page, contexto, candidatos):
+        """
+        Busca el primer candidato presente en la página
+
+        Args:
+            page: Objeto page de Playwright
+            contexto: Nombre del punto de uso (ej: "resumen.volver")
+            candidatos: Selectores en orden de preferencia
+
+        Returns:
+            tuple: (selector, elemento) o (None, None) si ninguno está presente
+        """
+        clave = self._clave(page, contexto)
+        with self._lock:
+            self._cargar()
+            ranking = dict(self._ranking.get(clave, {}))
+
+        conocidos = [c for c in candidatos if ranking.get(c)]
+        aprendido = max(conocidos, key=lambda c: ranking[c]) if conocidos else None
+        sondeos = 0
+
+        # 1. El selector que funcionó antes en este estado de página
+        if aprendido:
+            sondeos += 1
+            elemento = self._consultar(page, aprendido)
+            if elemento:
+                self._registrar(clave, aprendido, sondeos, candidatos.index(aprendido) + 1, True)
+                return aprendido, elemento
+
+        # 2. Una consulta combinada para saber si queda algún candidato presente
+        restantes = [c for c in candidatos if c != aprendido]
+        if len(restantes) > 1:
+            with self._lock:
+                self._consultas_combinadas += 1
+            sondeos += 1
+            try:
+                presente = page.query_selector(", ".join(restantes)) is not None
+            except Exception as e:
+                logger.debug("Consulta combinada no soportada en '%s': %s", contexto, str(e))
+                presente = True
+            if not presente:
+                self._registrar(clave, None, sondeos, len(candidatos), False)
+                return None, None
+
+        # 3. Prueba en orden de preferencia para aprender cuál funciona
+        for selector in restantes:
+            sondeos += 1
+            elemento = self._consultar(page, selector)
+            if elemento:
+                logger.debug("Selector aprendido para '%s': %s", contexto, selector)
+                self._registrar(clave, selector, sondeos, candidatos.index(selector) + 1, False)
+                return selector, elemento
+
+        self._registrar(clave, None, sondeos, len(candidatos), False)
+        return None, None
+
+    @staticmethod
+    def _consultar(page, selector):
+        try:
+            return page.query_selector(selector)
+        except Exception as e:
+            logger.debug("Selector '%s' no válido: %s", selector, str(e))
+            return None
+
+    def probar(self, page, contexto, candidatos, accion):
+        """
+        Resuelve un candidato y ejecuta accion(selector, elemento). Si la acción falla, el
+        selector se descarta y se vuelve a resolver con los candidatos restantes, hasta agotarlos.
+
+        Returns:
+            tuple: (selector, resultado de la acción) o (None, None) si ningún candidato funcionó
+        """
+        restantes = list(candidatos)
+        while restantes:
+            selector, elemento = self.resolver(page, contexto, restantes)
+            if selector is None:
+                break
+            try:
+                return selector, accion(selector, elemento)
+            except Exception as e:
+                logger.debug("Selector '%s' no funcionó en '%s': %s", selector, contexto, str(e))
+                self.descartar(page, contexto, selector)
+                restantes.remove(selector)
+        return None, None
+
+    def descartar(self, page, contexto, selector):
+        """
+        Olvida un selector que se encontró pero no funcionó (ej: el clic falló)
+        """
+        clave = self._clave(page, contexto)
+        with self._lock:
+            self._cargar()
+            self._pendientes.get(clave, {}).pop(selector, None)
+            if self._ranking.get(clave, {}).pop(selector, None) is not None:
+                self._descartados.add((clave, selector))
+                self._guardar()
+
+    def estadisticas(self):
+        """
+        Consultas resueltas y sondeos evitados respecto de probar los candidatos en orden
+        """
+        with self._lock:
+            self._cargar()
+            return {
+                "consultas": self._consultas,
+                "aciertos_aprendidos": self._aciertos_aprendidos,
+                "consultas_combinadas": self._consultas_combinadas,
+                "sondeos_realizados": self._sondeos_realizados,
+                "sondeos_secuenciales": self._sondeos_secuenciales,
+                "sondeos_evitados": self._sondeos_secuenciales - self._sondeos_realizados,
+                "ranking": {clave: dict(conteos) for clave, conteos in self._ranking.items()},
+            }
+
+
+# Instancia compartida por todas las páginas del proceso
+resolutor = ResolutorSelectores(ARCHIVO_SELECTORES)
@@ -0,0 +1,263 @@
+"""
+Supervisor de procesos para extracciones en paralelo entre núcleos
+
+Un único proceso que maneja varios navegadores, parsea las tablas y exporta
+con pandas queda limitado por el GIL. En modo multi-proceso el supervisor
+reparte unidades (contribuyente, período y tipo de documento) entre procesos
+trabajadores, cada uno con su propio driver de Playwright y un navegador que
+conserva entre unidades junto con su caché de sesiones. Los trabajadores
+solo navegan y parsean; los registros vuelven al proceso principal, que es
+el único que deduplica, concilia y escribe en el almacén y en los archivos.
+
+Cada trabajador recibe una parte de los límites del limitador (la tasa en
+partes iguales y la concurrencia en cuotas enteras), de modo que la carga
+total sobre el SII no crece con la cantidad de procesos. Un semáforo compartido
+acota además las solicitudes simultáneas de todos a LIMITE_CONCURRENCIA_MAXIMA,
+aunque haya más procesos (hasta PROCESOS_MAXIMOS) que concurrencia. El login de
+cada contribuyente pasa por el proceso principal: la primera unidad de un RUT se ejecuta sola y
+su sesión se entrega a las demás, en vez de iniciar sesión en cada proceso.
+Las métricas de cada unidad vuelven con su resultado y se suman a las del
+proceso principal.
+"""
+import logging
+import multiprocessing
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import zip_longest
+
+from config import PROCESOS_MAXIMOS, LIMITE_CONCURRENCIA_MAXIMA, LOG_FORMATO, LOG_REGISTROS_POR_SEGUNDO
+from bitacora import configurar_logging, detener_logging
+from limitador import limitador
+from periodos import formatear_periodo
+from contribuyentes import obtener_sesion, guardar_sesion
+from metricas import contar, medir, usar_resumen, retirar_metricas, incorporar_metricas
+
+logger = logging.getLogger("supervisor")
+
+# Driver y navegador del proceso trabajador (se conservan entre unidades)
+_navegador = {"playwright": None, "navegador": None}
+
+
+def _cerrar_navegador():
+    try:
+        if _navegador["navegador"] is not None:
+            _navegador["navegador"].close()
+        if _navegador["playwright"] is not None:
+            _navegador["playwright"].stop()
+    except Exception as e:
+        logger.debug("Error al cerrar el navegador del proceso: %s", str(e))
+    _navegador["playwright"] = _navegador["navegador"] = None
+
+
+def _inicializar_trabajador(procesos, siguiente_indice, semaforo, nivel_log):
+    configurar_logging(nivel_log, LOG_FORMATO, por_segundo=LOG_REGISTROS_POR_SEGUNDO)
+    with siguiente_indice.get_lock():
+        indice = siguiente_indice.value
+        siguiente_indice.value += 1
+    limitador.repartir(indice, procesos, semaforo)
+    Finalize(None, _cerrar_navegador, exitpriority=10)
+    # Los procesos del pool terminan sin atexit: escribir los mensajes pendientes de la cola
+    Finalize(None, detener_logging, exitpriority=0)
+
+
+def _extraer_unidad(rut, mes, anio, tipos_documento, forzar, estado_sesion=None):
+    """
+    Extrae una unidad en el proceso trabajador (sin procesar ni guardar)
+
+    Args:
+        estado_sesion: Sesión del contribuyente obtenida por otra unidad (si este proceso no tiene una)
+
+    Returns:
+        tuple: (resultado, sesión del contribuyente, métricas retiradas, resumen de la unidad)
+    """
+    from extractor import abrir_navegador, extraer_periodo_sin_procesar
+
+    if estado_sesion is not None and obtener_sesion(rut) is None:
+        guardar_sesion(rut, estado_sesion)
+    if _navegador["navegador"] is None or not _navegador["navegador"].is_connected():
+        _cerrar_navegador()
+        _navegador["playwright"], _navegador["navegador"] = abrir_navegador()
+    with usar_resumen({}) as resumen:
+        resultado = extraer_periodo_sin_procesar(_navegador["navegador"], rut, mes, anio, tipos_documento, forzar)
+    return resultado, obtener_sesion(rut), retirar_metricas(), resumen
+
+
+def _unir_partes(partes):
+    """
+    Une las extracciones por tipo de un mismo período
+    """
+    datos, tipos, tipos_detalle, resumen = [], [], [], None
+    for registros, tipos_procesados, resumen_sii, detalle in partes:
+        resumen = resumen or resumen_sii
+        datos.extend(registros or [])
+        tipos.extend(t for t in tipos_procesados or [] if t not in tipos)
+        tipos_detalle.extend(t for t in detalle or [] if t not in tipos_detalle)
+    return datos, tipos, resumen, tipos_detalle
+
+
+class SupervisorProcesos:
+    """
+    Reparte unidades de extracción entre procesos trabajadores y procesa los
+    resultados en el proceso principal
+
+    Args:
+        procesos: Cantidad de procesos trabajadores (como máximo PROCESOS_MAXIMOS)
+        dividir_tipos: Con tipos de documento explícitos, una unidad por tipo (si no, una por período)
+    """
+
+    def __init__(self, procesos, dividir_tipos=True):
+        self.procesos = max(1, int(procesos))
+        if self.procesos > max(1, PROCESOS_MAXIMOS):
+            logger.warning(
+                "Se usan %d procesos en vez de %d (PROCESOS_MAXIMOS)", max(1, PROCESOS_MAXIMOS), self.procesos
+            )
+            self.procesos = max(1, PROCESOS_MAXIMOS)
+        self.dividir_tipos = dividir_tipos
+
+    def _unidades(self, pendientes, tipos_documento):
+        """
+        Unidades (rut, mes, anio, tipos) de los períodos pendientes, intercaladas entre contribuyentes
+        """
+        if self.dividir_tipos and tipos_documento:
+            grupos_tipos = [[tipo] for tipo in tipos_documento]
+        else:
+            grupos_tipos = [tipos_documento]
+        por_rut = {}
+        for rut, mes, anio in pendientes:
+            por_rut.setdefault(rut, []).extend((rut, mes, anio, tipos) for tipos in grupos_tipos)
+        return [unidad for fila in zip_longest(*por_rut.values()) for unidad in fila if unidad is not None]
+
+    def ejecutar(self, ruts, periodos, tipos_documento=None, forzar=False, al_completar=None):
+        """
+        Extrae los períodos de los contribuyentes
+
+        Args:
+            ruts: RUTs normalizados de contribuyentes registrados
+            periodos: Lista de (mes, anio)
+            tipos_documento: Tipos a extraer o None para todos
+            forzar: Extraer desde el SII aunque el período esté vigente en el almacén
+            al_completar: Función llamada en el proceso principal por cada período terminado:
+                al_completar(datos_completos)
+
+        Returns:
+            dict: {"periodos", "registros", "desde_almacen", "errores": [{"rut", "periodo", "error"}]}
+        """
+        from extractor import desde_almacen
+
+        estadisticas = {"periodos": 0, "registros": 0, "desde_almacen": 0, "errores": []}
+
+        def completar(datos_completos):
+            estadisticas["periodos"] += 1
+            estadisticas["registros"] += len(datos_completos["datos"])
+            if al_completar is not None:
+                al_completar(datos_completos)
+
+        # Los períodos vigentes se responden desde el almacén sin ocupar un proceso
+        pendientes = []
+        for rut in ruts:
+            for mes, anio in periodos:
+                vigente = None if forzar else desde_almacen(rut, mes, anio, tipos_documento)
+                if vigente:
+                    estadisticas["desde_almacen"] += 1
+                    completar(vigente)
+                else:
+                    pendientes.append((rut, mes, anio))
+
+        unidades = self._unidades(pendientes, tipos_documento)
+        if not unidades:
+            return estadisticas
+
+        grupos = {}
+        for rut, mes, anio, _ in unidades:
+            grupo = grupos.setdefault((rut, mes, anio), {"restantes": 0, "partes": [], "errores": []})
+            grupo["restantes"] += 1
+
+        # La primera unidad de cada contribuyente sale sola; las demás esperan su sesión
+        iniciales, retenidas, sesiones = [], {}, {}
+        for indice, unidad in enumerate(unidades):
+            if unidad[0] in retenidas:
+                retenidas[unidad[0]].append((indice, unidad))
+            else:
+                retenidas[unidad[0]] = []
+                iniciales.append((indice, unidad))
+
+        logger.info(
+            "Supervisor: %d unidades (%d períodos) en %d procesos",
+            len(unidades), len(grupos), self.procesos
+        )
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=self.procesos, mp_context=contexto, initializer=_inicializar_trabajador,
+            initargs=(
+                self.procesos, contexto.Value("i", 0), contexto.BoundedSemaphore(max(1, LIMITE_CONCURRENCIA_MAXIMA)),
+                logging.getLogger().level
+            )
+        ) as executor:
+            futuros = {}
+
+            def enviar(indice, unidad):
+                rut, mes, anio, tipos = unidad
+                futuro = executor.submit(_extraer_unidad, rut, mes, anio, tipos, forzar, sesiones.get(rut))
+                futuros[futuro] = (indice, rut, mes, anio, tipos)
+
+            for indice, unidad in iniciales:
+                enviar(indice, unidad)
+            while futuros:
+                terminados, _ = wait(futuros, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    indice, rut, mes, anio, tipos = futuros.pop(futuro)
+                    grupo = grupos[(rut, mes, anio)]
+                    try:
+                        resultado, estado_sesion, metricas, resumen = futuro.result()
+                        incorporar_metricas(metricas, resumen)
+                        if estado_sesion:
+                            sesiones[rut] = estado_sesion
+                        grupo["partes"].append((indice, resultado))
+                        contar("rcv_unidades_proceso_total", ayuda="Unidades ejecutadas en procesos trabajadores", resultado="ok")
+                    except Exception as e:
+                        # Las métricas de una unidad fallida quedan en el trabajador
+                        logger.error(
+                            "Error en la unidad %s %s (tipos %s): %s",
+                            rut[:7], formatear_periodo(mes, anio), tipos or "todos", str(e)
+                        )
+                        contar("rcv_unidades_proceso_total", ayuda="Unidades ejecutadas en procesos trabajadores", resultado="error")
+                        grupo["errores"].append(str(e))
+
+                    # Con sesión se liberan todas las unidades retenidas del contribuyente; sin ella
+                    # (ej: login fallido) sale solo la siguiente, para no reintentar el login en paralelo
+                    en_espera = retenidas[rut]
+                    if en_espera and rut in sesiones:
+                        for retenida in en_espera:
+                            enviar(*retenida)
+                        en_espera.clear()
+                    elif en_espera:
+                        enviar(*en_espera.pop(0))
+
+                    grupo["restantes"] -= 1
+                    if grupo["restantes"] == 0:
+                        self._consolidar(rut, mes, anio, grupos.pop((rut, mes, anio)), estadisticas, completar)
+        return estadisticas
+
+    def _consolidar(self, rut, mes, anio, grupo, estadisticas, completar):
+        """
+        Procesa y guarda un período cuando terminaron todas sus unidades (único escritor)
+        """
+        from extractor import procesar_extraccion
+
+        periodo = formatear_periodo(mes, anio)
+        if grupo["errores"]:
+            # Un período incompleto no se guarda para no reemplazar tipos con datos parciales
+            estadisticas["errores"].append({"rut": rut, "periodo": periodo, "error": "; ".join(grupo["errores"])})
+            return
+        partes = [parte for _, parte in sorted(grupo["partes"], key=lambda p: p[0])]
+        datos, tipos, resumen, tipos_detalle = _unir_partes(partes)
+        if not datos:
+            logger.warning("Período %s de %s*** sin datos", periodo, rut[:7])
+            return
+        try:
+            with medir("consolidacion"):
+                datos_completos = procesar_extraccion(rut, mes, anio, datos, tipos, resumen, tipos_detalle)
+            completar(datos_completos)
+        except Exception as e:
+            logger.error("Error al procesar el período %s de %s***: %s", periodo, rut[:7], str(e))
+            estadisticas["errores"].append({"rut": rut, "periodo": periodo, "error": str(e)})
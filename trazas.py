@@ -0,0 +1,279 @@
+"""
+Trazas estructuradas de la extracción (spans con tiempos padre/hijo)
+
+Cada trabajo puede llevar una Traza asociada al hilo que lo ejecuta. Los
+helpers de scraper.py y las fases medidas con metricas.medir abren spans con
+atributos (tipo, folio, filas, ...) y la traza se exporta en formato Chrome
+Trace (JSON), que se abre en chrome://tracing o https://ui.perfetto.dev.
+
+Sin una traza activa en el hilo, el decorador `trazado` llama directamente a
+la función y `span` retorna un objeto nulo: el costo es una consulta a un
+atributo thread-local.
+"""
+import os
+import json
+import time
+import inspect
+import logging
+import threading
+import functools
+
+from config import DIRECTORIO_TRAZAS, TRAZAS_MAXIMAS
+
+logger = logging.getLogger("trazas")
+
+
+class _EstadoHilo(threading.local):
+    # Atributos de clase como valores por defecto: evita el costo de AttributeError en getattr
+    traza = None
+    pila = None
+
+
+_local = _EstadoHilo()
+
+
+class Traza:
+    """
+    Colección de spans de un trabajo
+
+    Args:
+        nombre: Nombre de la traza (ej: id del trabajo)
+    """
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.origen = time.perf_counter()
+        self._lock = threading.Lock()
+        self._eventos = []
+        self._hilos = {}
+        self._siguiente_id = 0
+
+    def _nuevo_id(self):
+        with self._lock:
+            self._siguiente_id += 1
+            return self._siguiente_id
+
+    def _registrar(self, span):
+        hilo = threading.current_thread()
+        with self._lock:
+            self._hilos.setdefault(hilo.ident, hilo.name)
+            self._eventos.append({
+                "name": span.nombre,
+                "cat": span.nombre.split(".")[0],
+                "ph": "X",
+                "ts": round((span.inicio - self.origen) * 1e6, 1),
+                "dur": round((span.fin - span.inicio) * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": hilo.ident,
+                "args": {"id": span.id, "padre": span.padre, **span.atributos},
+            })
+
+    def cantidad_spans(self):
+        with self._lock:
+            return len(self._eventos)
+
+    def como_chrome(self):
+        """
+        Traza en formato Chrome Trace Event (objeto JSON con traceEvents)
+        """
+        with self._lock:
+            eventos = sorted(self._eventos, key=lambda e: e["ts"])
+            hilos = dict(self._hilos)
+        metadatos = [
+            {"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": f"rcv_scrap {self.nombre}"}}
+        ] + [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": ident, "args": {"name": nombre}}
+            for ident, nombre in hilos.items()
+        ]
+        return {"traceEvents": metadatos + eventos, "displayTimeUnit": "ms"}
+
+    def exportar(self, ruta):
+        """
+        Escribe la traza en un archivo JSON
+
+        Returns:
+            str: Ruta del archivo escrito
+        """
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.como_chrome(), f, ensure_ascii=False, default=str)
+        logger.info("Traza %s exportada en %s (%d spans)", self.nombre, ruta, self.cantidad_spans())
+        podar_trazas(directorio or ".")
+        return ruta
+
+
+class Span:
+    """
+    Intervalo medido dentro de una traza. Los atributos pueden completarse
+    dentro del bloque (ej: span.atributos["filas"] = len(datos)).
+    """
+
+    __slots__ = ("traza", "nombre", "atributos", "id", "padre", "inicio", "fin")
+
+    def __init__(self, traza, nombre, atributos):
+        self.traza = traza
+        self.nombre = nombre
+        self.atributos = atributos
+        self.id = None
+        self.padre = None
+        self.inicio = self.fin = 0.0
+
+    def __enter__(self):
+        self.id = self.traza._nuevo_id()
+        pila = _pila()
+        self.padre = pila[-1].id if pila else None
+        pila.append(self)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_error, error, _tb):
+        self.fin = time.perf_counter()
+        pila = _pila()
+        if pila and pila[-1] is self:
+            pila.pop()
+        if tipo_error is not None:
+            self.atributos["error"] = f"{tipo_error.__name__}: {error}"
+        self.traza._registrar(self)
+        return False
+
+
+class _SpanNulo:
+    """
+    Span sin efecto usado cuando no hay traza activa
+    """
+
+    __slots__ = ()
+
+    @property
+    def atributos(self):
+        # Un dict nuevo por acceso: lo que se escriba en un span nulo se descarta y no se comparte
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+def _pila():
+    pila = _local.pila
+    if pila is None:
+        pila = _local.pila = []
+    return pila
+
+
+def traza_actual():
+    """
+    Traza asociada al hilo actual (o None)
+    """
+    return _local.traza
+
+
+class usar_traza:
+    """
+    Asocia una traza al hilo actual durante el bloque (None la desactiva)
+    """
+
+    __slots__ = ("traza", "anterior", "pila_anterior")
+
+    def __init__(self, traza):
+        self.traza = traza
+
+    def __enter__(self):
+        self.anterior = traza_actual()
+        self.pila_anterior = _local.pila
+        _local.traza = self.traza
+        # Los spans de otro hilo no son padres de los de este
+        if self.traza is not self.anterior:
+            _local.pila = []
+        return self.traza
+
+    def __exit__(self, *args):
+        _local.traza = self.anterior
+        _local.pila = self.pila_anterior
+        return False
+
+
+def span(nombre, **atributos):
+    """
+    Abre un span en la traza del hilo actual
+
+    Ejemplo:
+        with span("detalle_tipo", tipo="33") as s:
+            datos = extraer_datos_tablas(page)
+            s.atributos["filas"] = len(datos)
+    """
+    traza = _local.traza
+    if traza is None:
+        return _SPAN_NULO
+    return Span(traza, nombre, atributos)
+
+
+def trazado(nombre=None, argumentos=(), contar_resultado=False):
+    """
+    Decorador que envuelve una función en un span
+
+    Args:
+        nombre: Nombre del span (por defecto "<módulo>.<función>")
+        argumentos: Nombres de parámetros a registrar como atributos (ej: ("folio",))
+        contar_resultado: Registrar len(resultado) como atributo "filas"
+    """
+    def decorador(funcion):
+        nombre_span = nombre or f"{funcion.__module__}.{funcion.__name__}"
+        firma = inspect.signature(funcion) if argumentos else None
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            traza = _local.traza
+            if traza is None:
+                return funcion(*args, **kwargs)
+
+            atributos = {}
+            if firma is not None:
+                try:
+                    valores = firma.bind_partial(*args, **kwargs).arguments
+                    atributos = {a: valores[a] for a in argumentos if a in valores}
+                except TypeError:
+                    pass
+            with Span(traza, nombre_span, atributos) as s:
+                resultado = funcion(*args, **kwargs)
+                if contar_resultado and resultado is not None:
+                    s.atributos["filas"] = len(resultado)
+                elif isinstance(resultado, bool):
+                    s.atributos["resultado"] = resultado
+                return resultado
+
+        return envoltura
+    return decorador
+
+
+def podar_trazas(directorio=DIRECTORIO_TRAZAS, maximo=TRAZAS_MAXIMAS):
+    """
+    Elimina los archivos de traza más antiguos, conservando los `maximo` más recientes
+    """
+    try:
+        archivos = [
+            os.path.join(directorio, nombre) for nombre in os.listdir(directorio) if nombre.endswith(".json")
+        ]
+        archivos.sort(key=os.path.getmtime)
+    except OSError as e:
+        logger.debug("No se pudo listar %s: %s", directorio, str(e))
+        return
+    for ruta in archivos[:max(0, len(archivos) - maximo)]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def ruta_traza(trabajo_id):
+    """
+    Ruta del archivo de traza de un trabajo
+    """
+    return os.path.join(DIRECTORIO_TRAZAS, f"{trabajo_id}.json")